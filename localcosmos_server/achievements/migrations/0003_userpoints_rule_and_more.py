@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('achievements', '0002_alter_pointrulecondition_factor_type'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpoints',
+            name='rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='achievements.pointrule'),
+        ),
+        migrations.AddConstraint(
+            model_name='userpoints',
+            constraint=models.UniqueConstraint(fields=('rule', 'content_type', 'object_id'), name='unique_user_points_per_rule_and_object'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
@@ -13,7 +13,9 @@ LocalcosmosUser = get_user_model()
 
 class UserPointsManager(models.Manager):
 
-    def award_user_points(self, app, user, points, awarded_for=None, content_object=None):
+    # points awarded by a rule are unique per rule and content_object
+    # returns None if the rule already awarded points for content_object
+    def award_user_points(self, app, user, points, awarded_for=None, content_object=None, rule=None):
         if user is None:
             raise ValueError('Cannot award user points without a user.')
 
@@ -22,12 +24,28 @@ class UserPointsManager(models.Manager):
             user=user,
             points=points,
             awarded_for=awarded_for,
+            rule=rule,
         )
 
         if content_object is not None:
             user_points.content_object = content_object
 
-        user_points.save()
+        if rule is not None and content_object is not None:
+
+            if self.filter(rule=rule, content_type=user_points.content_type,
+                    object_id=user_points.object_id).exists():
+                return None
+
+            # a concurrent worker might award the same points
+            try:
+                with transaction.atomic():
+                    user_points.save()
+            except IntegrityError:
+                return None
+
+        else:
+            user_points.save()
+
         return user_points
 
 
@@ -44,8 +62,17 @@ class UserPoints(models.Model):
     awarded_for = models.CharField(max_length=255, blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # the rule which awarded the points, awarded points are kept if the rule is deleted
+    rule = models.ForeignKey('PointRule', on_delete=models.SET_NULL, null=True, blank=True)
+
     objects = UserPointsManager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'content_type', 'object_id'],
+                name='unique_user_points_per_rule_and_object'),
+        ]
+
 
 # make point system totally generic and configurable in the backend
 MATCH_MODE_CHOICES = (
@@ -13,6 +13,8 @@ class DatasetPointsAwarder(RuleBasedPointsAwarder):
         context = self._build_context(user=user, dataset=dataset)
         return self.award_points_for_context(user=user, content_object=dataset, context=context)
 
+    # "first" is relative to the datasets created before this one (lower pk), not to the current table.
+    # Bulk uploads and the deferred worker award points after later datasets of the user already exist
     def _build_context(self, user, dataset):
 
         matching_geographies = []
@@ -24,7 +26,8 @@ class DatasetPointsAwarder(RuleBasedPointsAwarder):
         is_first_user_dataset = False
         is_first_species_in_polygon_for_user = False
         if user is not None:
-            is_first_user_dataset = not Dataset.objects.filter(app_uuid=self.app.uuid, user=user).exclude(pk=dataset.pk).exists()
+            is_first_user_dataset = not Dataset.objects.filter(app_uuid=self.app.uuid, user=user,
+                pk__lt=dataset.pk).exists()
 
             if dataset.name_uuid and matching_geographies:
                 prior_species_dataset_exists = False
@@ -40,7 +43,8 @@ class DatasetPointsAwarder(RuleBasedPointsAwarder):
                         user=user,
                         name_uuid=dataset.name_uuid,
                         coordinates__intersects=geography_geometry,
-                    ).exclude(pk=dataset.pk).exists():
+                        pk__lt=dataset.pk,
+                    ).exists():
                         prior_species_dataset_exists = True
                         break
 
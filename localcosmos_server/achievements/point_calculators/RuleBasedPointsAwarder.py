@@ -38,8 +38,12 @@ class RuleBasedPointsAwarder(BasePointsAwarder):
                     points=rule.points,
                     awarded_for=rule.awarded_for,
                     content_object=content_object,
+                    rule=rule,
                 )
-                awarded.append(user_points)
+
+                # None: the rule already awarded points for content_object
+                if user_points is not None:
+                    awarded.append(user_points)
 
         return awarded
 
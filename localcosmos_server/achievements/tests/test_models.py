@@ -38,6 +38,29 @@ class TestUserPointsManager(WithApp, WithUser, TestCase):
 		self.assertEqual(db_user_points.content_object, user)
 
 
+	@test_settings
+	def test_award_user_points_once_per_rule_and_object(self):
+		user = self.create_user()
+
+		rule = PointRule.objects.create(
+			app=self.app,
+			name='Rule a',
+			points=5,
+			awarded_for='rule-a',
+		)
+
+		user_points = UserPoints.objects.award_user_points(self.app, user, 5, awarded_for='rule-a',
+			content_object=user, rule=rule)
+		self.assertEqual(user_points.rule, rule)
+
+		# a retried awarding does not add points
+		duplicate = UserPoints.objects.award_user_points(self.app, user, 5, awarded_for='rule-a',
+			content_object=user, rule=rule)
+		self.assertIsNone(duplicate)
+
+		self.assertEqual(UserPoints.objects.filter(user=user, rule=rule).count(), 1)
+
+
 class TestPointRule(WithApp, TestCase):
 
 	@test_settings
@@ -51,7 +51,10 @@ class LocalcosmosPublicUserSerializer(LocalcosmosUserSerializer):
 
     dataset_count = serializers.SerializerMethodField()
 
+    # list serializers set prefetched_dataset_count for all users of a page, see DatasetListSerializer
     def get_dataset_count(self, obj):
+        if hasattr(obj, 'prefetched_dataset_count'):
+            return obj.prefetched_dataset_count
         return obj.dataset_count()
 
     class Meta:
@@ -286,6 +289,10 @@ class ImageSerializer(AppUrlSerializerMixin, serializers.Serializer):
     def to_representation(self, instance):
         data = instance.copy()  # Create a copy of the instance to avoid modifying it directly
         data['imageUrl'] = ImageUrlSerializer(instance['imageUrl'], app=self.app).data
+        # webp/avif urls, only present if the app build provides them
+        if instance.get('imageFormats', None):
+            data['imageFormats'] = {image_format: ImageUrlSerializer(image_urls, app=self.app).data
+                for image_format, image_urls in instance['imageFormats'].items()}
         data['licence'] = self.get_licence(instance)
         return data
 
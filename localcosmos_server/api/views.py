@@ -10,6 +10,7 @@
 from django.contrib.auth import logout
 from django.conf import settings
 from django.http import Http404
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import generics
@@ -88,9 +89,11 @@ class ManageUserClient:
         
         client_datasets = Dataset.objects.filter(client_id=client.client_id, user__isnull=True)
 
-        for dataset in client_datasets:
-            dataset.user = user
-            dataset.save()
+        # the dataset counters of the user are updated in the same transaction, see UserDatasetCounter
+        with transaction.atomic():
+            for dataset in client_datasets:
+                dataset.user = user
+                dataset.save()
 
 
     def get_client(self, user, platform, client_id):
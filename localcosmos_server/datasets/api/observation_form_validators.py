@@ -0,0 +1,211 @@
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import serializers
+
+from localcosmos_server.datasets.json_schemas import (POINT_JSON_FIELD_SCHEMA, GEOJSON_FIELD_SCHEMA,
+    TEMPORAL_JSON_FIELD_SCHEMA, TAXON_JSON_SCHEMA)
+
+import jsonschema
+
+'''
+    Compiled observation form validators
+    - an ObservationForm never changes for a given (uuid, version)
+    - everything DatasetSerializer.validate needs from the definition is prepared once per form version:
+      field lookup by uuid, required fields, validator per field class, choice sets and min/max bounds
+    - jsonschema validators are built once, jsonschema.validate would check the schema on every call
+    - the compiled forms are cached by ObservationFormIndex, see observation_form_cache.py
+'''
+
+def build_json_schema_validator(schema):
+    ValidatorClass = jsonschema.validators.validator_for(schema)
+    ValidatorClass.check_schema(schema)
+    return ValidatorClass(schema)
+
+
+JSON_SCHEMA_VALIDATORS = {
+    'PointJSONField': build_json_schema_validator(POINT_JSON_FIELD_SCHEMA),
+    'GeoJSONField': build_json_schema_validator(GEOJSON_FIELD_SCHEMA),
+    'DateTimeJSONField': build_json_schema_validator(TEMPORAL_JSON_FIELD_SCHEMA),
+    'TaxonField': build_json_schema_validator(TAXON_JSON_SCHEMA),
+    'SelectTaxonField': build_json_schema_validator(TAXON_JSON_SCHEMA),
+}
+
+
+class CompiledObservationFormField:
+
+    def __init__(self, field):
+
+        self.uuid = field['uuid']
+        self.field_class = field['fieldClass']
+        self.label = field['definition']['label']
+        self.required = field['definition']['required']
+
+        widget_attrs = field.get('widgetAttrs', None) or {}
+        self.min = widget_attrs.get('min', None)
+        self.max = widget_attrs.get('max', None)
+
+        self.choices = frozenset()
+        if 'choices' in field['definition']:
+            self.choices = frozenset([choice[0] for choice in field['definition']['choices']])
+
+        self.json_schema_validator = JSON_SCHEMA_VALIDATORS.get(self.field_class, None)
+
+        # values of field classes without a validator are accepted as they are
+        validator_name = 'validate_{0}'.format(self.field_class)
+        self.validate_value = getattr(self, validator_name, self.validate_unsupported_field_class)
+
+
+    def get_required_field_error_message(self):
+        message = _('The field %(field_name)s is required.') % {'field_name': self.label}
+        return message
+
+    def get_invalid_datatype_error_message(self):
+        message = _('Invalid datatype for %(field_name)s.') % {'field_name': self.label }
+        return message
+
+    def get_invalid_choice_error_message(self, value):
+        message = _('Invalid choice for %(field_name)s: %(value)s') % {
+            'field_name': self.label,
+            'value' : str(value),
+        }
+        return message
+
+
+    def validate(self, value):
+
+        if self.required == True and value is None:
+            raise serializers.ValidationError(self.get_required_field_error_message())
+
+        return self.validate_value(value)
+
+
+    def validate_json_schema(self, value):
+        error = jsonschema.exceptions.best_match(self.json_schema_validator.iter_errors(value))
+        if error is not None:
+            raise serializers.ValidationError(error.message)
+        return value
+
+    def validate_PointJSONField(self, value):
+        return self.validate_json_schema(value)
+
+    def validate_GeoJSONField(self, value):
+        return self.validate_json_schema(value)
+
+    def validate_DateTimeJSONField(self, value):
+        return self.validate_json_schema(value)
+
+    def validate_TaxonField(self, value):
+        return self.validate_json_schema(value)
+
+    def validate_SelectTaxonField(self, value):
+        return self.validate_json_schema(value)
+
+    def validate_CharField(self, value):
+        if self.required == True and not value:
+            raise serializers.ValidationError(self.get_required_field_error_message())
+        return value
+
+    def validate_min_max(self, value):
+
+        if self.min != None and value < self.min:
+            message = _('Minimum value for %(field_name)s is %(min)s.') % {
+                'field_name': self.label,
+                'min': str(self.min),
+            }
+            raise serializers.ValidationError(message)
+
+        if self.max != None and value > self.max:
+            message = _('Maximum value for %(field_name)s is %(max)s.') % {
+                'field_name': self.label,
+                'max': str(self.max),
+            }
+            raise serializers.ValidationError(message)
+
+        return value
+
+    def validate_DecimalField(self, value):
+        try:
+            value = float(value)
+        except Exception as e:
+            raise serializers.ValidationError(self.get_invalid_datatype_error_message())
+
+        return self.validate_min_max(value)
+
+    def validate_FloatField(self, value):
+        return self.validate_DecimalField(value)
+
+    def validate_IntegerField(self, value):
+        if not isinstance(value, int):
+            raise serializers.ValidationError(self.get_invalid_datatype_error_message())
+
+        return self.validate_min_max(value)
+
+    def validate_BooleanField(self, value):
+        if not isinstance(value, bool):
+            raise serializers.ValidationError(self.get_invalid_datatype_error_message())
+        return value
+
+    def validate_PictureField(self, value):
+        return value
+
+    def validate_unsupported_field_class(self, value):
+        return value
+
+    # lists and dicts sent by clients are not hashable and can not be looked up in the choices
+    def is_valid_choice(self, value):
+        try:
+            return value in self.choices
+        except TypeError:
+            return False
+
+    def validate_ChoiceField(self, value):
+        if not self.is_valid_choice(value):
+            raise serializers.ValidationError(self.get_invalid_choice_error_message(value))
+        return value
+
+    def validate_MultipleChoiceField(self, value):
+
+        if not isinstance(value, list):
+            raise serializers.ValidationError(self.get_invalid_datatype_error_message())
+
+        for choice in value:
+            if not self.is_valid_choice(choice):
+                raise serializers.ValidationError(self.get_invalid_choice_error_message(choice))
+
+        return value
+
+
+class CompiledObservationForm:
+
+    def __init__(self, definition):
+
+        self.fields = {}
+        self.required_fields = []
+
+        for field in definition['fields']:
+            compiled_field = CompiledObservationFormField(field)
+            self.fields[compiled_field.uuid] = compiled_field
+
+            if compiled_field.required:
+                self.required_fields.append(compiled_field)
+
+    # validate DatasetJSON.data against the observation form
+    def validate(self, data):
+
+        # check if required fields are missing in data
+        for field in self.required_fields:
+            if field.uuid not in data:
+                error = {}
+                error[field.uuid] = [field.get_required_field_error_message()]
+                raise serializers.ValidationError(error)
+
+        for field_uuid, value in data.items():
+
+            field = self.fields.get(field_uuid, None)
+
+            if not field:
+                raise serializers.ValidationError(_('Invalid field uuid: %(field_uuid)s') % {'field_uuid': field_uuid})
+
+            field.validate(value)
+
+        return data
@@ -0,0 +1,215 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from localcosmos_server.datasets.expressions import RowValueComparison
+
+import base64, binascii, json, uuid
+
+'''
+    Keyset (seek) pagination for dataset lists
+    - the page is selected by the last row of the previous page, (<order column>, id), not by an offset
+    - each page is an index range scan on (app_uuid, <order column>, id), page N costs the same as page 1.
+      The position is compared as row value, (<order column>, id) > (%s, %s)
+    - the cursor is opaque to the client, an empty cursor selects the first page
+    - NULL values follow the postgres defaults: last in ascending, first in descending order. The NULL rows are
+      read by a separate query, each query is a single range of the index
+'''
+class DatasetKeysetPagination(BasePagination):
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    # ordering as accepted by DatasetFilterSerializer -> model column
+    ordering_columns = {
+        'id': 'id',
+        'pk': 'id',
+        'timestamp': 'timestamp',
+        'taxon_latname': 'taxon_latname',
+        'name_uuid': 'name_uuid',
+    }
+
+    default_ordering = '-pk'
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'REST_FRAMEWORK', {}).get('PAGE_SIZE', 25)
+
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, page_size))
+        except ValueError:
+            pass
+
+        return max(1, min(page_size, self.max_page_size))
+
+
+    def get_ordering(self, queryset):
+
+        ordering = self.default_ordering
+
+        if queryset.query.order_by:
+            ordering = queryset.query.order_by[0]
+
+        descending = ordering.startswith('-')
+        column = self.ordering_columns[ordering.lstrip('-')]
+
+        return column, descending
+
+
+    def encode_cursor(self, instance):
+
+        value = getattr(instance, self.column)
+
+        if value is not None and self.column == 'timestamp':
+            value = value.isoformat()
+        elif value is not None:
+            value = str(value)
+
+        cursor = json.dumps({'value': value, 'id': instance.id}).encode('utf-8')
+        return base64.urlsafe_b64encode(cursor).decode('ascii')
+
+
+    def decode_cursor(self, cursor):
+
+        try:
+            cursor_json = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            value = cursor_json['value']
+            last_id = int(cursor_json['id'])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if self.column == 'id':
+            value = last_id
+        elif value is not None and self.column == 'timestamp':
+            value = parse_datetime(value)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+        elif value is not None and self.column == 'name_uuid':
+            try:
+                value = uuid.UUID(value)
+            except (ValueError, AttributeError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        return value, last_id
+
+
+    # the rows following (value, last_id) in the current ordering, as a list of filters
+    # the filters are queried in this order until the page is full
+    def get_keyset_filters(self, value, last_id):
+
+        column = self.column
+        isnull = '{0}__isnull'.format(column)
+
+        if column == 'id':
+            if self.descending:
+                return [Q(id__lt=last_id)]
+            return [Q(id__gt=last_id)]
+
+        if self.descending:
+            if value is None:
+                return [Q(**{isnull: True, 'id__lt': last_id}), Q(**{isnull: False})]
+
+            return [RowValueComparison([column, 'id'], '<', [value, last_id])]
+
+        if value is None:
+            return [Q(**{isnull: True, 'id__gt': last_id})]
+
+        return [RowValueComparison([column, 'id'], '>', [value, last_id]), Q(**{isnull: True})]
+
+
+    def paginate_queryset(self, queryset, request, view=None):
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.column, self.descending = self.get_ordering(queryset)
+
+        if self.column == 'id':
+            order_by = ['-id'] if self.descending else ['id']
+        elif self.descending:
+            order_by = ['-{0}'.format(self.column), '-id']
+        else:
+            order_by = [self.column, 'id']
+
+        queryset = queryset.order_by(*order_by)
+
+        cursor = request.query_params.get(self.cursor_query_param, None)
+
+        keyset_filters = [Q()]
+
+        if cursor:
+            value, last_id = self.decode_cursor(cursor)
+            keyset_filters = self.get_keyset_filters(value, last_id)
+
+        # fetch one more row than requested to know if there is a next page
+        results = []
+
+        for keyset_filter in keyset_filters:
+            if len(results) > self.page_size:
+                break
+            results += list(queryset.filter(keyset_filter)[:self.page_size + 1 - len(results)])
+
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = self.encode_cursor(results[-1])
+
+        return results
+
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+
+'''
+    use keyset pagination if the client sends the cursor parameter, limit/offset pagination otherwise
+'''
+class DatasetKeysetPaginationMixin:
+
+    keyset_pagination_class = DatasetKeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.keyset_pagination_class.cursor_query_param in self.request.query_params:
+                self._paginator = self.keyset_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -1,13 +1,19 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
 from django.contrib.auth import get_user_model
 
-from localcosmos_server.datasets.models import ObservationForm, Dataset, DatasetImages, UserGeometry
+from localcosmos_server.datasets.models import (ObservationForm, Dataset, DatasetImages, UserGeometry,
+                                               UserDatasetCounter)
 
-from localcosmos_server.datasets.json_schemas import (POINT_JSON_FIELD_SCHEMA, GEOJSON_FIELD_SCHEMA,
-    TEMPORAL_JSON_FIELD_SCHEMA, TAXON_JSON_SCHEMA, DATASET_FILTERS_SCHEMA )
+from localcosmos_server.datasets.json_schemas import DATASET_FILTERS_SCHEMA
 
 from localcosmos_server.datasets.api.serializer_fields import GeoJSONField
+from localcosmos_server.datasets.observation_form_cache import observation_form_cache, get_compiled_observation_form
+from localcosmos_server.datasets.field_filters import get_app_field_classes, get_field_filter_error
+from localcosmos_server.image_renditions import get_preferred_image_format
 
 from localcosmos_server.api.serializers import LocalcosmosPublicUserSerializer
 
@@ -114,23 +120,30 @@ class DatasetImagesSerializer(serializers.ModelSerializer):
      )
 
     image_url = serializers.SerializerMethodField()
+    image_formats = serializers.SerializerMethodField()
 
     client_id = serializers.SerializerMethodField()
 
+    # the resized images are created by the upload views, see DatasetImages.schedule_renditions
+    # the format is negotiated with the Accept header or ?image_format=
     def get_image_url(self, instance):
-        if 'request' in self.context:
-            image_urls = instance.image_urls(self.context['request'])
-        else:
-            image_urls = instance.image_urls()
-            
+        request = self.context.get('request', None)
+        image_format = get_preferred_image_format(request) if request else None
+
+        image_urls = instance.image_urls(request, image_format=image_format)
+
         return image_urls
 
+    # {image_format: {size_name: url}}
+    def get_image_formats(self, instance):
+        return instance.image_format_urls(self.context.get('request', None))
+
     def get_client_id(self, instance):
         return instance.client_id
 
     class Meta:
         model = DatasetImages
-        fields = ['id', 'dataset', 'field_uuid', 'image', 'image_url', 'client_id']
+        fields = ['id', 'dataset', 'field_uuid', 'image', 'image_url', 'image_formats', 'client_id']
 
 
 '''
@@ -190,8 +203,7 @@ class DatasetRetrieveSerializer(DatasetImagesMixin, serializers.Serializer):
         observation_form_uuid = data['observation_form']['uuid']
         observation_form_version = data['observation_form']['version']
         
-        observation_form = ObservationForm.objects.filter(uuid=observation_form_uuid,
-            version=observation_form_version).first()
+        observation_form = observation_form_cache.get(observation_form_uuid, observation_form_version)
 
         return observation_form
 
@@ -229,6 +241,7 @@ class DatasetSerializer(DatasetRetrieveSerializer):
         super().__init__(*args, **kwargs)
 
     
+    # validate data with the cached, compiled observation form, see observation_form_validators.py
     def validate(self, data):
 
         observation_form = self.get_observation_form(data)
@@ -236,182 +249,20 @@ class DatasetSerializer(DatasetRetrieveSerializer):
         if not observation_form:
             raise serializers.ValidationError(_('Observation Form does not exist'))
 
-        # check if required fields are missing in data
-        for generic_form_field in observation_form.definition['fields']:
-            if generic_form_field['definition']['required']:
-                required_uuid = generic_form_field['uuid']
-                if required_uuid not in data['data']:
-                    message = self.get_required_field_error_message(generic_form_field)
-                    error = {}
-                    error[required_uuid] = [message]
-                    raise serializers.ValidationError(error)
-
-
-        for field_uuid, value in data['data'].items():
-
-            field = None
-            for _field in observation_form.definition['fields']:
-                if _field['uuid'] == field_uuid:
-                    field = _field
-                    break
-            
-            if not field:
-                raise serializers.ValidationError(_('Invalid field uuid: %(field_uuid)s') % {'field_uuid': field_uuid})
-
-            required = field['definition']['required']
-            if required == True and value is None:
-                message = self.get_required_field_error_message(field)
-                raise serializers.ValidationError(message)
-        
-            else:
-                validator_name = 'validate_{0}'.format(field['fieldClass'])
-                validator = getattr(self, validator_name)
-                value = validator(field, value)
+        compiled_observation_form = get_compiled_observation_form(observation_form)
+        compiled_observation_form.validate(data['data'])
 
         return data
 
 
-    '''
-        validate data according to the observation form
-    '''
-    def get_required_field_error_message(self, field):
-        message = _('The field %(field_name)s is required.') % {'field_name': field['definition']['label']}
-        return message
-
-    def get_invalid_datatype_error_message(self, field):
-        message = _('Invalid datatype for %(field_name)s.') % {'field_name': field['definition']['label'] }
-        return message
-
-    def validate_json_schema(self, value, schema):
-        try:
-            is_valid = jsonschema.validate(value, schema)
-        except jsonschema.exceptions.ValidationError as e:
-            raise serializers.ValidationError(e.message)
-        return value
-
-    def validate_PointJSONField(self, field, value):
-        return self.validate_json_schema(value, POINT_JSON_FIELD_SCHEMA)
-
-    def validate_GeoJSONField(self, field, value):
-        return self.validate_json_schema(value, GEOJSON_FIELD_SCHEMA)
-
-    # currently, only a timestamp with date, time and timezone is supported
-    def validate_DateTimeJSONField(self, field, value):
-        return self.validate_json_schema(value, TEMPORAL_JSON_FIELD_SCHEMA)
-
-    def validate_TaxonField(self, field, value):
-        return self.validate_json_schema(value, TAXON_JSON_SCHEMA)
-
-    def validate_SelectTaxonField(self, field, value):
-        return self.validate_TaxonField(field, value)
-    
-    def validate_CharField(self, field, value):
-        required = field['definition']['required']
-        if required == True and not value:
-            message = self.get_required_field_error_message(field)
-            raise serializers.ValidationError(message)
-        return value
-
-
-    # validatoin for number fields
-    def validate_min_max(self, field, value):
-
-        min = field['widgetAttrs'].get('min', None)
-        max = field['widgetAttrs'].get('max', None)
-
-        if min != None and value < min:
-            message = _('Minimum value for %(field_name)s is %(min)s.') % {
-                'field_name': field['definition']['label'],
-                'min': str(min),
-            }
-            raise serializers.ValidationError(message)
-
-        if max != None and value > max:
-            message = _('Maximum value for %(field_name)s is %(max)s.') % {
-                'field_name': field['definition']['label'],
-                'min': str(max),
-            }
-            raise serializers.ValidationError(message)
-
-        return value
-
-
-    def validate_DecimalField(self, field, value):
-        try:
-            value = float(value)
-        except Exception as e:
-            message = self.get_invalid_datatype_error_message(field)
-            raise serializers.ValidationError(message)
-
-        value = self.validate_min_max(field, value)
-
-        return value
-
-
-    def validate_FloatField(self, field, value):
-        return self.validate_DecimalField(field, value)
-
-
-    def validate_IntegerField(self, field, value):
-        if not isinstance(value, int):
-            message = self.get_invalid_datatype_error_message(field)
-            raise serializers.ValidationError(message)
-
-        value = self.validate_min_max(field, value)
-
-        return value
-
-
-    def validate_BooleanField(self, field, value):
-        if not isinstance(value, bool):
-            message = self.get_invalid_datatype_error_message(field)
-            raise serializers.ValidationError(message)
-
-        return value
-
-
-    def validate_PictureField(self, field, value):
-        return value
-
-
-    # validations for choice fields
-    # check if the value is contained by the field choices
-    def get_invalid_choice_error_message(self, field, value):
-        message = _('Invalid choice for %(field_name)s: %(value)s') % {
-            'field_name': field['definition']['label'],
-            'value' : str(value),
-        }
-
-        return message
-
-    def validate_ChoiceField(self, field, value):
-        choices = [choice[0] for choice in field['definition']['choices']]
-        if value not in choices:
-            message = self.get_invalid_choice_error_message(field, value)
-            raise serializers.ValidationError(message)
-        return value
-
-    def validate_MultipleChoiceField(self, field, value):
-
-        if not isinstance(value, list):
-            message = self.get_invalid_datatype_error_message(field)
-            raise serializers.ValidationError(message)
-
-        
-        accepted_choices = [accepted_choice[0] for accepted_choice in field['definition']['choices']]
-
-        for choice in value:
-            if choice not in accepted_choices:
-                message = self.get_invalid_choice_error_message(field, choice)
-                raise serializers.ValidationError(message)
+    # return an unsaved Dataset instance
+    def build_dataset(self, validated_data, observation_form=None):
 
-        return value
+        if observation_form is None:
+            observation_form = self.get_observation_form(validated_data)
 
-
-    def create(self, validated_data):
-
-        observation_form = ObservationForm.objects.get(uuid=validated_data['observation_form']['uuid'],
-            version=validated_data['observation_form']['version'])
+            if not observation_form:
+                raise ObservationForm.DoesNotExist('Observation Form does not exist')
 
         created_at = validated_data.get('created_at', timezone.now())
 
@@ -425,6 +276,13 @@ class DatasetSerializer(DatasetRetrieveSerializer):
             user = validated_data.get('user', None),
         )
 
+        return dataset
+
+
+    def create(self, validated_data):
+
+        dataset = self.build_dataset(validated_data)
+
         dataset.save()
 
         return dataset
@@ -443,6 +301,23 @@ class DatasetSerializer(DatasetRetrieveSerializer):
         return instance
 
 
+'''
+    Bulk upload
+    - offline devices upload their datasets with a client-generated uuid
+    - the uuid makes uploads idempotent: a dataset which already exists is reported as duplicate
+'''
+class BulkDatasetSerializer(DatasetSerializer):
+
+    uuid = serializers.UUIDField()
+
+    def build_dataset(self, validated_data, observation_form=None):
+
+        dataset = super().build_dataset(validated_data, observation_form=observation_form)
+        dataset.uuid = validated_data['uuid']
+
+        return dataset
+
+
 class TaxonSerializer(serializers.Serializer):
 
     taxon_source = serializers.CharField()
@@ -453,6 +328,38 @@ class TaxonSerializer(serializers.Serializer):
 
 
 
+'''
+    one query for the first image of each dataset, one for the users and one for their dataset counters,
+    independent of the number of datasets in the list
+'''
+class DatasetListListSerializer(serializers.ListSerializer):
+
+    def prefetch(self, datasets):
+
+        first_images = DatasetImages.objects.order_by('dataset_id', 'pk').distinct('dataset_id')
+
+        prefetch_related_objects(datasets, 'user', Prefetch('images', queryset=first_images,
+            to_attr='prefetched_images'))
+
+        users = [dataset.user for dataset in datasets if dataset.user_id]
+
+        if users:
+            # Dataset.user references LocalcosmosUser.uuid
+            dataset_counts = UserDatasetCounter.objects.get_dataset_counts(set([user.uuid for user in users]))
+
+            for user in users:
+                user.prefetched_dataset_count = dataset_counts[user.uuid]
+
+    def to_representation(self, data):
+
+        datasets = data.all() if isinstance(data, models.manager.BaseManager) else data
+        datasets = list(datasets)
+
+        self.prefetch(datasets)
+
+        return super().to_representation(datasets)
+
+
 class DatasetListSerializer(serializers.ModelSerializer):
 
     taxon = serializers.SerializerMethodField()
@@ -473,19 +380,24 @@ class DatasetListSerializer(serializers.ModelSerializer):
 
         return taxon
 
+    # the url of the first image, computed without touching the disk
     def get_image_url(self, obj):
 
-        image = DatasetImages.objects.filter(dataset=obj).first()
+        image = obj.first_image
 
         image_url = None
 
-        serializer = DatasetImagesSerializer(image, context=self.context)
-        if serializer.data and 'image_url' in serializer.data:
-            image_url = serializer.data['image_url']
+        if image:
+            request = self.context.get('request', None)
+            image_format = get_preferred_image_format(request) if request else None
+
+            image_url = image.image_urls(request, image_format=image_format)
+
         return image_url
 
     class Meta:
         model = Dataset
+        list_serializer_class = DatasetListListSerializer
         fields = ('uuid', 'taxon', 'coordinates', 'geographic_reference', 'timestamp', 'image_url', 'user', 'validation_step',
             'is_valid', 'is_published')
 
@@ -498,6 +410,11 @@ class DatasetFilterSerializer(serializers.Serializer):
     filters = serializers.JSONField(write_only=True, required=False)
     order_by = serializers.CharField(write_only=True, required=False)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # field uuid -> field class of the field filters, set by validate_filters
+        self.field_classes = {}
+
     def validate_json_schema(self, value, schema):
         try:
             is_valid = jsonschema.validate(value, schema)
@@ -510,7 +427,24 @@ class DatasetFilterSerializer(serializers.Serializer):
             if not isinstance(value, list):
                 raise serializers.ValidationError('filters have to be a list')
 
-            return self.validate_json_schema(value, DATASET_FILTERS_SCHEMA)
+            value = self.validate_json_schema(value, DATASET_FILTERS_SCHEMA)
+
+            field_classes = None
+
+            for dataset_filter in value:
+                if 'field_uuid' in dataset_filter:
+                    # the field classes are looked up once, only if the filters contain fields
+                    if field_classes is None:
+                        field_classes = get_app_field_classes(self.context.get('app_uuid', None))
+                    field_uuid = str(dataset_filter['field_uuid'])
+                    field_class = field_classes.get(field_uuid, None)
+                    error = get_field_filter_error(dataset_filter, field_class)
+                    if error:
+                        raise serializers.ValidationError(error)
+                    # the comparison of filter_by_field depends on the field class
+                    self.field_classes[field_uuid] = field_class
+
+            return value
 
         return value
 
@@ -521,6 +455,42 @@ class DatasetFilterSerializer(serializers.Serializer):
         return value
 
 
+class NearbyDatasetsFilterSerializer(serializers.Serializer):
+
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    max_distance = serializers.FloatField(min_value=0, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    taxon_source = serializers.CharField(required=False)
+    taxon_nuid = serializers.CharField(required=False)
+    name_uuid = serializers.UUIDField(required=False)
+
+    def get_max_distance_setting(self):
+        return getattr(settings, 'LOCALCOSMOS_SERVER_NEARBY_DATASETS_MAX_DISTANCE', 10000)
+
+    def validate_max_distance(self, value):
+        max_distance = self.get_max_distance_setting()
+        if value > max_distance:
+            raise serializers.ValidationError('max_distance must not exceed {0} meters'.format(max_distance))
+        return value
+
+    def validate(self, data):
+        if 'taxon_nuid' in data and 'taxon_source' not in data:
+            raise serializers.ValidationError({'taxon_source': 'taxon_source is required for taxon_nuid'})
+
+        data.setdefault('max_distance', self.get_max_distance_setting())
+        return data
+
+
+class NearbyDatasetSerializer(DatasetListSerializer):
+
+    # meters
+    distance = serializers.FloatField(read_only=True)
+
+    class Meta(DatasetListSerializer.Meta):
+        fields = DatasetListSerializer.Meta.fields + ('distance',)
+
+
 class UserGeometrySerializer(serializers.ModelSerializer):
 
     geometry = GeoJSONField()
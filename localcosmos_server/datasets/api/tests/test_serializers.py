@@ -1,4 +1,5 @@
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.urls import reverse
 from rest_framework.test import APIRequestFactory
 
@@ -16,8 +17,11 @@ from localcosmos_server.datasets.models import ObservationForm, DatasetImages, D
 from rest_framework import serializers
 
 from django.utils import timezone
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-import uuid, jsonschema
+import os, uuid, copy, jsonschema
 
 
 class TestObservationformSerializer(WithObservationForm, TestCase):
@@ -216,6 +220,105 @@ class TestDatasetSerializer(WithObservationForm,  WithMedia, WithApp, TestCase):
         self.assertEqual(dataset.platform, 'browser')
 
 
+from localcosmos_server.datasets.api.observation_form_validators import CompiledObservationForm
+
+class TestCompiledObservationForm(WithObservationForm, TestCase):
+
+    def get_field_uuid(self, field_class):
+        for field in self.observation_form_json['fields']:
+            if field['fieldClass'] == field_class:
+                return field['uuid']
+
+    @test_settings
+    def test_validate(self):
+
+        data_creator = DataCreator()
+        data = data_creator.get_dataset_data(self.observation_form_json)
+
+        compiled_observation_form = CompiledObservationForm(self.observation_form_json)
+
+        self.assertEqual(compiled_observation_form.validate(data), data)
+
+        invalid_values = [
+            ('ChoiceField', 'invalid choice'),
+            # unhashable values
+            ('ChoiceField', ['invalid choice']),
+            ('ChoiceField', {'choice': 'invalid'}),
+            ('MultipleChoiceField', ['invalid choice']),
+            ('MultipleChoiceField', [['nested choice']]),
+            ('MultipleChoiceField', 'no list'),
+            ('IntegerField', 11),
+            ('IntegerField', 1.5),
+            ('DecimalField', -1),
+            ('BooleanField', 'true'),
+            ('PointJSONField', {'type': 'Feature'}),
+        ]
+
+        for field_class, value in invalid_values:
+            invalid_data = data.copy()
+            invalid_data[self.get_field_uuid(field_class)] = value
+
+            with self.assertRaises(serializers.ValidationError):
+                compiled_observation_form.validate(invalid_data)
+
+        # required field missing
+        invalid_data = data.copy()
+        taxon_field_uuid = self.observation_form_json['taxonomicReference']
+        del invalid_data[taxon_field_uuid]
+
+        with self.assertRaises(serializers.ValidationError) as context:
+            compiled_observation_form.validate(invalid_data)
+
+        self.assertIn(taxon_field_uuid, context.exception.detail)
+
+        # unknown field
+        invalid_data = data.copy()
+        invalid_data[str(uuid.uuid4())] = 'value'
+
+        with self.assertRaises(serializers.ValidationError):
+            compiled_observation_form.validate(invalid_data)
+
+
+    # values of field classes without a validator, e.g. of newer app kit versions, are accepted as they are
+    @test_settings
+    def test_validate_unsupported_field_class(self):
+
+        data_creator = DataCreator()
+        data = data_creator.get_dataset_data(self.observation_form_json)
+
+        definition = copy.deepcopy(self.observation_form_json)
+        field = definition['fields'][-1]
+        field['fieldClass'] = 'UnsupportedField'
+        field['definition']['required'] = False
+
+        compiled_observation_form = CompiledObservationForm(definition)
+
+        data[field['uuid']] = {'any': ['value']}
+        self.assertEqual(compiled_observation_form.validate(data), data)
+
+        # None is accepted for optional fields
+        data[field['uuid']] = None
+        self.assertEqual(compiled_observation_form.validate(data), data)
+
+
+    @test_settings
+    def test_unsupported_field_class(self):
+
+        definition = copy.deepcopy(self.observation_form_json)
+
+        field = definition['fields'][-1]
+        field['fieldClass'] = 'UnsupportedField'
+
+        data_creator = DataCreator()
+        data = data_creator.get_dataset_data(self.observation_form_json)
+        data[field['uuid']] = 'any value'
+
+        compiled_observation_form = CompiledObservationForm(definition)
+
+        self.assertEqual(compiled_observation_form.validate(data), data)
+
+
+
 class TestDatasetImagesSerializer(WithObservationForm, WithMedia, WithApp, TestCase):
 
     @test_settings
@@ -274,7 +377,42 @@ class TestDatasetImagesSerializer(WithObservationForm, WithMedia, WithApp, TestC
             self.assertIn(size, serializer.data['image_url'])
 
 
-class TestDatasetListSerializer(WithObservationForm, WithMedia, WithApp, TestCase):
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS=['webp'])
+    def test_deserialize_image_format(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset_image = self.create_dataset_image(dataset)
+        dataset_image.create_renditions()
+
+        factory = APIRequestFactory()
+
+        # the original format
+        request = factory.get('/', HTTP_ACCEPT='image/jpeg,image/*')
+        serializer = DatasetImagesSerializer(dataset_image, context={'request': request})
+
+        for size in ['1x', '2x', '4x']:
+            self.assertTrue(serializer.data['image_url'][size].endswith('.jpg'))
+            self.assertTrue(serializer.data['image_formats']['webp'][size].endswith('.webp'))
+
+        # Accept header
+        request = factory.get('/', HTTP_ACCEPT='image/webp,image/*')
+        serializer = DatasetImagesSerializer(dataset_image, context={'request': request})
+
+        for size in ['1x', '2x', '4x']:
+            self.assertTrue(serializer.data['image_url'][size].endswith('.webp'))
+
+        # query parameter
+        request = factory.get('/', {'image_format': 'webp'})
+        serializer = DatasetImagesSerializer(dataset_image, context={'request': request})
+
+        for size in ['1x', '2x', '4x']:
+            self.assertTrue(serializer.data['image_url'][size].endswith('.webp'))
+
+
+class TestDatasetListSerializer(WithUser, WithObservationForm, WithMedia, WithApp, TestCase):
 
     @test_settings
     def test_deserialize(self):
@@ -299,6 +437,61 @@ class TestDatasetListSerializer(WithObservationForm, WithMedia, WithApp, TestCas
         self.assertEqual(dataset_['coordinates']['type'],'Feature')
 
 
+    @test_settings
+    def test_query_count(self):
+
+        observation_form = self.create_observation_form()
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                data = DatasetListSerializer(Dataset.objects.all(), many=True).data
+            return len(context.captured_queries), data
+
+        dataset = self.create_dataset(observation_form)
+        dataset_image = self.create_dataset_image(dataset)
+        dataset_image.create_renditions()
+
+        query_count, data = count_queries()
+
+        for i in range(0, 3):
+            dataset = self.create_dataset(observation_form)
+            self.create_dataset_image(dataset)
+
+        # the first image of every dataset is prefetched
+        self.assertEqual(count_queries()[0], query_count)
+
+        image_url = data[0]['image_url']
+        self.assertEqual(image_url, dataset_image.image_urls())
+
+        # the resized images have been created by create_renditions
+        for size_name, url in image_url.items():
+            self.assertTrue(os.path.isfile(os.path.join(settings.MEDIA_ROOT,
+                url.replace(settings.MEDIA_URL, '', 1))))
+
+
+    @test_settings
+    def test_dataset_counts(self):
+
+        observation_form = self.create_observation_form()
+
+        user = self.create_user()
+        secondary_user = self.create_secondary_user()
+
+        for i in range(0, 3):
+            self.create_dataset(observation_form, user=user)
+
+        self.create_dataset(observation_form, user=secondary_user)
+        self.create_dataset(observation_form)
+
+        data = DatasetListSerializer(Dataset.objects.all().order_by('pk'), many=True).data
+
+        dataset_counts = [dataset['user']['dataset_count'] if dataset['user'] else None for dataset in data]
+        self.assertEqual(dataset_counts, [3, 3, 3, 1, None])
+
+        self.assertEqual(dataset_counts[0], user.dataset_count())
+        self.assertEqual(dataset_counts[3], secondary_user.dataset_count())
+
+
 class TestDatasetFilterSerializer(WithObservationForm, WithMedia, WithApp, TestCase):
 
     @test_settings
@@ -417,6 +610,38 @@ class TestDatasetFilterSerializer(WithObservationForm, WithMedia, WithApp, TestC
         self.assertIn('endswith', serializer.errors['filters'][0])
 
 
+    @test_settings
+    def test_serialize_field_filter(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        integer_field_uuid = '1b35044c-2f26-4d92-85ff-b56a667a1741'
+        field_filter = {
+            'field_uuid': integer_field_uuid,
+            'value': 5,
+            'operator': '>',
+        }
+
+        data = {
+            'filters': [field_filter],
+        }
+
+        serializer = DatasetFilterSerializer(data=data, context={'app_uuid': self.app.uuid})
+        is_valid = serializer.is_valid()
+        self.assertEqual(serializer.errors, {})
+        self.assertEqual(serializer.field_classes, {integer_field_uuid: 'IntegerField'})
+        # the client filter is not modified
+        self.assertEqual(serializer.validated_data['filters'][0], field_filter)
+        self.assertNotIn('field_class', serializer.validated_data['filters'][0])
+
+        # the field is looked up in the observation forms of the app only
+        serializer = DatasetFilterSerializer(data=data, context={'app_uuid': uuid.uuid4()})
+        is_valid = serializer.is_valid()
+        self.assertIn('filters', serializer.errors)
+        self.assertIn(integer_field_uuid, serializer.errors['filters'][0])
+
+
 class TestUserGeometrySerializer(WithUserGeometry, WithUser, WithApp, TestCase):
 
     def setUp(self, *args, **kwargs):
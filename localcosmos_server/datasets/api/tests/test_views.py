@@ -3,16 +3,23 @@ from rest_framework.test import APITestCase
 from rest_framework import status
 
 from django.urls import reverse
+from django.db import IntegrityError
 
 from localcosmos_server.tests.common import (test_settings, DataCreator, TEST_IMAGE_PATH, TEST_CLIENT_ID, TEST_PLATFORM,
     GEOJSON_POLYGON, TEST_USER_GEOMETRY_NAME, TEST_TAXA)
 from localcosmos_server.tests.mixins import WithUser, WithApp, WithObservationForm, WithMedia, WithUserGeometry
 
 from localcosmos_server.datasets.models import ObservationForm, Dataset, DatasetImages
+from localcosmos_server.achievements.models import PointRule, PointRuleCondition, UserPoints
+from localcosmos_server.achievements.factor_types import FACTOR_IS_FIRST_DATASET_FOR_USER
 
 from django.utils import timezone
 
-import json
+from unittest import mock
+
+import base64, json, uuid
+
+from datetime import timedelta
 
 
 class CreatedUsersMixin:
@@ -361,6 +368,365 @@ class TestListCreateDataset(WithDatasetPostData, WithObservationForm, WithMedia,
 
 
 
+class TestBulkCreateDatasets(WithDatasetPostData, WithObservationForm, WithMedia, WithUser, WithApp,
+    CreatedUsersMixin, APITestCase):
+
+    def get_bulk_post_data(self, count=2):
+
+        bulk_post_data = []
+
+        for i in range(0, count):
+            post_data = self.get_post_data()
+            post_data['uuid'] = str(uuid.uuid4())
+            bulk_post_data.append(post_data)
+
+        return bulk_post_data
+
+
+    @test_settings
+    def test_post(self):
+
+        self.create_observation_form()
+
+        url_kwargs = {
+            'app_uuid' : self.app.uuid,
+        }
+
+        url = reverse('api_bulk_create_datasets', kwargs=url_kwargs)
+
+        bulk_post_data = self.get_bulk_post_data()
+
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for post_data in bulk_post_data:
+            self.assertEqual(response.data['results'][post_data['uuid']]['status'], 'created')
+
+            dataset = Dataset.objects.get(uuid=post_data['uuid'])
+            self.assertEqual(dataset.user, self.user)
+            self.assertEqual(dataset.validation_step, 'completed')
+            self.assertTrue(dataset.is_valid)
+            self.assertTrue(dataset.coordinates is not None)
+
+        # uploading again reports duplicates
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for post_data in bulk_post_data:
+            self.assertEqual(response.data['results'][post_data['uuid']]['status'], 'duplicate')
+
+        self.assertEqual(Dataset.objects.all().count(), len(bulk_post_data))
+
+
+    @test_settings
+    @mock.patch('localcosmos_server.datasets.models.LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED', True)
+    def test_post_first_dataset_achievement(self):
+
+        self.create_observation_form()
+
+        rule = PointRule.objects.create(app=self.app, name='First dataset', points=10,
+            awarded_for='First dataset bonus')
+        PointRuleCondition.objects.create(rule=rule, factor_type=FACTOR_IS_FIRST_DATASET_FOR_USER,
+            operator='equals', value_json=True)
+
+        url_kwargs = {
+            'app_uuid' : self.app.uuid,
+        }
+
+        url = reverse('api_bulk_create_datasets', kwargs=url_kwargs)
+
+        self.client.force_authenticate(user=self.user)
+
+        # the first datasets of the user, all achievements are awarded after the INSERT of the batch
+        bulk_post_data = self.get_bulk_post_data(count=3)
+
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        first_dataset = Dataset.objects.filter(user=self.user).order_by('pk').first()
+
+        user_points = UserPoints.objects.filter(user=self.user, awarded_for='First dataset bonus')
+        self.assertEqual(user_points.count(), 1)
+        self.assertEqual(user_points.first().content_object, first_dataset)
+
+        # a second upload is not the first one
+        response = self.client.post(url, self.get_bulk_post_data(count=1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(user_points.count(), 1)
+
+
+    @test_settings
+    def test_post_with_errors(self):
+
+        self.create_observation_form()
+
+        url_kwargs = {
+            'app_uuid' : self.ao_app.uuid,
+        }
+
+        url = reverse('api_bulk_create_datasets', kwargs=url_kwargs)
+
+        bulk_post_data = self.get_bulk_post_data()
+        invalid_post_data = bulk_post_data[1]
+        invalid_post_data['observation_form']['version'] = 999
+
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['results']
+        self.assertEqual(results[bulk_post_data[0]['uuid']]['status'], 'created')
+        self.assertEqual(results[invalid_post_data['uuid']]['status'], 'error')
+
+        self.assertEqual(Dataset.objects.all().count(), 1)
+
+
+    @test_settings
+    def test_post_error_result_key(self):
+
+        self.create_observation_form()
+
+        url = reverse('api_bulk_create_datasets', kwargs={'app_uuid': self.ao_app.uuid})
+
+        bulk_post_data = self.get_bulk_post_data(count=1)
+        invalid_post_data = bulk_post_data[0]
+        invalid_post_data['observation_form']['version'] = 999
+        invalid_post_data['uuid'] = invalid_post_data['uuid'].upper()
+
+        response = self.client.post(url, bulk_post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # all results are keyed by the canonical uuid
+        results = response.data['results']
+        self.assertEqual(results[invalid_post_data['uuid'].lower()]['status'], 'error')
+
+
+    @test_settings
+    def test_post_concurrent_upload(self):
+
+        observation_form = self.create_observation_form()
+
+        url = reverse('api_bulk_create_datasets', kwargs={'app_uuid': self.app.uuid})
+
+        self.client.force_authenticate(user=self.user)
+
+        bulk_post_data = self.get_bulk_post_data()
+        concurrent_uuid = bulk_post_data[0]['uuid']
+
+        bulk_create_datasets = Dataset.objects.bulk_create_datasets
+
+        # another upload inserts the first dataset between the duplicate check and the INSERT
+        def concurrent_upload(app_uuid, datasets):
+            if not Dataset.objects.filter(uuid=concurrent_uuid).exists():
+                dataset = self.create_dataset(observation_form)
+                Dataset.objects.filter(pk=dataset.pk).update(uuid=concurrent_uuid)
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return bulk_create_datasets(app_uuid, datasets)
+
+        with mock.patch.object(Dataset.objects, 'bulk_create_datasets', side_effect=concurrent_upload):
+            response = self.client.post(url, bulk_post_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['results']
+        self.assertEqual(results[concurrent_uuid]['status'], 'duplicate')
+        self.assertEqual(results[bulk_post_data[1]['uuid']]['status'], 'created')
+
+        self.assertEqual(Dataset.objects.all().count(), 2)
+
+
+    @test_settings
+    def test_post_no_list(self):
+
+        url_kwargs = {
+            'app_uuid' : self.ao_app.uuid,
+        }
+
+        url = reverse('api_bulk_create_datasets', kwargs=url_kwargs)
+
+        response = self.client.post(url, self.get_post_data(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestDatasetChanges(WithObservationForm, WithUser, WithApp, CreatedUsersMixin, APITestCase):
+
+    def get_changes(self, cursor=None, **params):
+
+        url = reverse('api_dataset_changes', kwargs={'app_uuid': self.app.uuid})
+
+        if cursor:
+            params['cursor'] = cursor
+
+        return self.client.get(url, params)
+
+    # the cursor without its issue time
+    def get_cursor_position(self, cursor):
+        cursor_json = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return cursor_json['xid'], cursor_json['sequence']
+
+
+    @test_settings
+    def test_get(self):
+
+        observation_form = self.create_observation_form()
+
+        self.client.force_authenticate(user=self.user)
+
+        dataset = self.create_dataset(observation_form, user=self.user)
+        dataset_2 = self.create_dataset(observation_form, user=self.user)
+        # dataset of another device
+        self.create_dataset(observation_form)
+
+        response = self.get_changes()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([d['uuid'] for d in response.data['datasets']], [str(dataset.uuid), str(dataset_2.uuid)])
+        self.assertEqual(response.data['deleted'], [])
+        self.assertFalse(response.data['has_more'])
+
+        cursor = response.data['cursor']
+
+        # no changes since the cursor
+        response = self.get_changes(cursor)
+        self.assertEqual(response.data['datasets'], [])
+        self.assertEqual(self.get_cursor_position(response.data['cursor']), self.get_cursor_position(cursor))
+
+        # updates, including queryset updates during validation
+        Dataset.objects.filter(pk=dataset.pk).update(is_valid=False)
+
+        response = self.get_changes(cursor)
+        self.assertEqual([d['uuid'] for d in response.data['datasets']], [str(dataset.uuid)])
+
+        cursor = response.data['cursor']
+
+        # deletions are returned as tombstones
+        dataset_2.delete()
+
+        response = self.get_changes(cursor)
+        self.assertEqual(response.data['datasets'], [])
+        self.assertEqual(response.data['deleted'], [str(dataset_2.uuid)])
+
+
+    @test_settings
+    def test_get_paginated(self):
+
+        observation_form = self.create_observation_form()
+
+        datasets = [self.create_dataset(observation_form) for i in range(0, 3)]
+
+        response = self.get_changes(limit=2, client_id=TEST_CLIENT_ID)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['datasets']), 2)
+        self.assertTrue(response.data['has_more'])
+
+        response = self.get_changes(response.data['cursor'], limit=2, client_id=TEST_CLIENT_ID)
+        self.assertEqual([d['uuid'] for d in response.data['datasets']], [str(datasets[2].uuid)])
+        self.assertFalse(response.data['has_more'])
+
+
+    @test_settings
+    def test_get_invalid(self):
+
+        # anonymous requests need a client_id
+        response = self.get_changes()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.get_changes('invalid', client_id=TEST_CLIENT_ID)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    @test_settings
+    def test_get_running_transactions(self):
+
+        observation_form = self.create_observation_form()
+
+        dataset = self.create_dataset(observation_form)
+
+        response = self.get_changes(client_id=TEST_CLIENT_ID)
+        cursor = response.data['cursor']
+
+        # the change of a transaction which has started earlier and commits later is not skipped
+        with mock.patch('localcosmos_server.datasets.api.views.get_change_watermark', return_value=1):
+            Dataset.objects.filter(pk=dataset.pk).update(is_valid=False)
+            response = self.get_changes(cursor, client_id=TEST_CLIENT_ID)
+
+        self.assertEqual(response.data['datasets'], [])
+        self.assertEqual(self.get_cursor_position(response.data['cursor']), self.get_cursor_position(cursor))
+
+        response = self.get_changes(cursor, client_id=TEST_CLIENT_ID)
+        self.assertEqual([d['uuid'] for d in response.data['datasets']], [str(dataset.uuid)])
+
+
+    @test_settings
+    def test_get_expired_cursor(self):
+
+        response = self.get_changes(client_id=TEST_CLIENT_ID)
+        cursor = response.data['cursor']
+
+        expired = timezone.now() + timedelta(days=91)
+        with mock.patch('localcosmos_server.datasets.api.views.timezone.now', return_value=expired):
+            response = self.get_changes(cursor, client_id=TEST_CLIENT_ID)
+
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+
+from django.contrib.gis.geos import Point
+
+class TestNearbyDatasets(WithObservationForm, WithUser, WithApp, CreatedUsersMixin, APITestCase):
+
+    def get_nearby(self, **params):
+        url = reverse('api_nearby_datasets', kwargs={'app_uuid': self.app.uuid})
+        return self.client.get(url, params)
+
+    def create_dataset_at(self, observation_form, longitude, latitude):
+        dataset = self.create_dataset(observation_form)
+        coordinates = Point(longitude, latitude, srid=4326).transform(3857, clone=True)
+        Dataset.objects.filter(pk=dataset.pk).update(coordinates=coordinates)
+        return dataset
+
+
+    @test_settings
+    def test_get(self):
+
+        observation_form = self.create_observation_form(
+            observation_form_json=self.observation_form_point_json)
+
+        # about 110m, 1.1km and 11km north of the point
+        dataset = self.create_dataset_at(observation_form, 11.0, 49.001)
+        dataset_2 = self.create_dataset_at(observation_form, 11.0, 49.01)
+        self.create_dataset_at(observation_form, 11.0, 49.1)
+
+        response = self.get_nearby(longitude=11.0, latitude=49.0, max_distance=5000)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual([d['uuid'] for d in response.data], [str(dataset.uuid), str(dataset_2.uuid)])
+        self.assertTrue(100 < response.data[0]['distance'] < 120)
+        self.assertTrue(1100 < response.data[1]['distance'] < 1120)
+
+        response = self.get_nearby(longitude=11.0, latitude=49.0, max_distance=5000, limit=1)
+        self.assertEqual([d['uuid'] for d in response.data], [str(dataset.uuid)])
+
+        # other taxa
+        response = self.get_nearby(longitude=11.0, latitude=49.0, name_uuid=str(uuid.uuid4()))
+        self.assertEqual(response.data, [])
+
+
+    @test_settings
+    def test_get_invalid(self):
+
+        response = self.get_nearby(longitude=11.0)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.get_nearby(longitude=11.0, latitude=49.0, max_distance=10000000)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.get_nearby(longitude=11.0, latitude=49.0, limit=1000)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class TestRetrieveDataset(WithDatasetPostData, WithObservationForm, WithUser, WithApp, CreatedUsersMixin, APITestCase):
     
     @test_settings
@@ -694,6 +1060,172 @@ class TestGetFilteredDatasets(WithMedia, WithObservationForm, WithUser, WithApp,
         self.assertEqual(content['count'], 2)
 
 
+class TestGetFilteredDatasetsByField(WithMedia, WithObservationForm, WithUser, WithApp, CreatedUsersMixin,
+    APITestCase):
+
+    integer_field_uuid = '1b35044c-2f26-4d92-85ff-b56a667a1741'
+    boolean_field_uuid = '95663afc-2f14-4087-9722-248cee51ba11'
+    choice_field_uuid = '2187e7d8-be9f-449b-b07d-aac768e8a64a'
+
+    def setUp(self):
+        super().setUp()
+
+        observation_form = self.create_observation_form()
+
+        self.dataset_1 = self.create_dataset(observation_form)
+        self.dataset_2 = self.create_dataset(observation_form)
+
+        for dataset, count, checked, choice in [(self.dataset_1, 1, True, 'good'), (self.dataset_2, 10, False, 'bad')]:
+            dataset.data[self.integer_field_uuid] = count
+            dataset.data[self.boolean_field_uuid] = checked
+            dataset.data[self.choice_field_uuid] = choice
+            Dataset.objects.filter(pk=dataset.pk).update(data=dataset.data)
+
+
+    def get_filtered_uuids(self, filters, expected_status=200):
+
+        url = reverse('api_get_filtered_datasets', kwargs={'app_uuid': self.app.uuid})
+
+        response = self.client.post(url, {'filters': filters}, format='json')
+        self.assertEqual(response.status_code, expected_status)
+
+        if expected_status != 200:
+            return None
+
+        content = json.loads(response.content)
+        return set([result['uuid'] for result in content['results']])
+
+
+    @test_settings
+    def test_numeric_filters(self):
+
+        expected = {
+            ('>', 5): set([str(self.dataset_2.uuid)]),
+            ('<=', 1): set([str(self.dataset_1.uuid)]),
+            ('=', 10): set([str(self.dataset_2.uuid)]),
+            ('!=', 10): set([str(self.dataset_1.uuid)]),
+            ('>=', 100): set([]),
+        }
+
+        for (operator, value), expected_uuids in expected.items():
+            filters = [{'fieldUuid': self.integer_field_uuid, 'operator': operator, 'value': value}]
+            self.assertEqual(self.get_filtered_uuids(filters), expected_uuids)
+
+
+    @test_settings
+    def test_text_and_boolean_filters(self):
+
+        filters = [{'fieldUuid': self.choice_field_uuid, 'operator': '=', 'value': 'good'}]
+        self.assertEqual(self.get_filtered_uuids(filters), set([str(self.dataset_1.uuid)]))
+
+        filters = [{'fieldUuid': self.choice_field_uuid, 'operator': 'startswith', 'value': 'BA'}]
+        self.assertEqual(self.get_filtered_uuids(filters), set([str(self.dataset_2.uuid)]))
+
+        filters = [{'fieldUuid': self.boolean_field_uuid, 'operator': '!=', 'value': True}]
+        self.assertEqual(self.get_filtered_uuids(filters), set([str(self.dataset_2.uuid)]))
+
+        filters = [
+            {'fieldUuid': self.boolean_field_uuid, 'operator': '=', 'value': True},
+            {'fieldUuid': self.integer_field_uuid, 'operator': '>', 'value': 5},
+        ]
+        self.assertEqual(self.get_filtered_uuids(filters), set([]))
+
+
+    @test_settings
+    def test_invalid_filters(self):
+
+        filters = [{'fieldUuid': self.integer_field_uuid, 'operator': 'startswith', 'value': 1}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        filters = [{'fieldUuid': self.boolean_field_uuid, 'operator': '>', 'value': True}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        filters = [{'fieldUuid': self.integer_field_uuid, 'operator': 'like', 'value': 1}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        # the value has to match the field class
+        filters = [{'fieldUuid': self.choice_field_uuid, 'operator': '>', 'value': 5}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        filters = [{'fieldUuid': self.integer_field_uuid, 'operator': '=', 'value': '10'}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        filters = [{'fieldUuid': self.boolean_field_uuid, 'operator': '=', 'value': 'true'}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+        # no observation form contains the field
+        filters = [{'fieldUuid': str(uuid.uuid4()), 'operator': '=', 'value': 1}]
+        self.get_filtered_uuids(filters, expected_status=400)
+
+
+class TestGetFilteredDatasetsKeysetPagination(WithMedia, WithObservationForm, WithUser, WithApp, CreatedUsersMixin,
+    APITestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        observation_form = self.create_observation_form()
+        self.datasets = [self.create_dataset(observation_form) for i in range(0, 5)]
+
+        # equal values are ordered by id
+        timestamp = timezone.now()
+        Dataset.objects.filter(pk__in=[d.pk for d in self.datasets[:3]]).update(timestamp=timestamp)
+        Dataset.objects.filter(pk=self.datasets[3].pk).update(timestamp=None)
+        Dataset.objects.filter(pk=self.datasets[4].pk).update(taxon_latname=None, name_uuid=None)
+
+
+    def get_all_pages(self, order_by, limit=2):
+
+        url = reverse('api_get_filtered_datasets', kwargs={'app_uuid': self.app.uuid})
+        url = '{0}?cursor=&limit={1}'.format(url, limit)
+
+        post_data = {
+            'orderBy': order_by,
+        }
+
+        uuids = []
+
+        while url:
+            response = self.client.post(url, post_data, format='json')
+            self.assertEqual(response.status_code, 200)
+
+            content = json.loads(response.content)
+            self.assertFalse('count' in content)
+            self.assertTrue(len(content['results']) <= limit)
+
+            uuids += [result['uuid'] for result in content['results']]
+            url = content['next']
+
+        return uuids
+
+
+    @test_settings
+    def test_pages(self):
+
+        for order_by in ['pk', '-pk', 'timestamp', '-timestamp', 'taxon_latname', 'name_uuid']:
+
+            uuids = self.get_all_pages(order_by)
+
+            expected_order = ['{0}'.format(order_by), '-id' if order_by.startswith('-') else 'id']
+            if order_by in ['pk', '-pk']:
+                expected_order = [order_by]
+
+            expected_uuids = [str(u) for u in Dataset.objects.filter(app_uuid=self.app.uuid).order_by(
+                *expected_order).values_list('uuid', flat=True)]
+
+            self.assertEqual(uuids, expected_uuids)
+
+
+    @test_settings
+    def test_invalid_cursor(self):
+
+        url = reverse('api_get_filtered_datasets', kwargs={'app_uuid': self.app.uuid})
+        url = '{0}?cursor=invalid'.format(url)
+
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
 class TestCreateDatasetImage(WithMedia, WithDatasetPostData, WithObservationForm, WithUser, WithApp, CreatedUsersMixin,
     APITestCase):
 
@@ -10,12 +10,15 @@ urlpatterns = [
         views.RetrieveObservationForm.as_view(), name='api_retrieve_observation_form'),
     # dataset
     path('<uuid:app_uuid>/dataset/', views.ListCreateDataset.as_view(), name='api_list_create_dataset'),
+    path('<uuid:app_uuid>/dataset/bulk/', views.BulkCreateDatasets.as_view(), name='api_bulk_create_datasets'),
     path('<uuid:app_uuid>/dataset/<uuid:uuid>/', views.ManageDataset.as_view(), name='api_manage_dataset'),
     path('<uuid:app_uuid>/dataset/<uuid:uuid>/image/', views.CreateDatasetImage.as_view(),
         name='api_create_dataset_image'),
     path('<uuid:app_uuid>/dataset/<uuid:uuid>/image/<int:pk>/', views.DestroyDatasetImage.as_view(),
         name='api_destroy_dataset_image'),
     path('<uuid:app_uuid>/datasets/', views.GetFilteredDatasets.as_view(), name='api_get_filtered_datasets'),
+    path('<uuid:app_uuid>/datasets/nearby/', views.NearbyDatasets.as_view(), name='api_nearby_datasets'),
+    path('<uuid:app_uuid>/datasets/changes/', views.DatasetChanges.as_view(), name='api_dataset_changes'),
     # user geometries
     path('<uuid:app_uuid>/user-geometry/', views.CreateListUserGeometry.as_view(),
         name='api_create_list_user_geometry'),
@@ -1,3 +1,8 @@
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import IntegrityError
+from django.utils import timezone
+
 from rest_framework import generics, status
 from rest_framework.views import APIView
 
@@ -6,7 +11,10 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 
 from .serializers import (DatasetSerializer, ObservationFormSerializer, DatasetListSerializer, DatasetImagesSerializer,
-                          UserGeometrySerializer, DatasetFilterSerializer)
+                          UserGeometrySerializer, DatasetFilterSerializer, BulkDatasetSerializer,
+                          DatasetRetrieveSerializer, NearbyDatasetsFilterSerializer, NearbyDatasetSerializer)
+
+from .pagination import DatasetKeysetPaginationMixin
 
 from .permissions import (AnonymousObservationsPermission, DatasetOwnerOnly, DatasetAppOnly, AuthenticatedOwnerOnly,
                           AnonymousObservationsPermissionOrGet, MaxThreeInstancesPerUser)
@@ -14,7 +22,10 @@ from .permissions import (AnonymousObservationsPermission, DatasetOwnerOnly, Dat
 from localcosmos_server.api.permissions import AppMustExist
 from localcosmos_server.api.views import SchemaSpecificMapClusterer
 
-from localcosmos_server.datasets.models import Dataset, ObservationForm, DatasetImages, UserGeometry
+from localcosmos_server.datasets.field_filters import filter_by_field
+from localcosmos_server.datasets.models import (Dataset, ObservationForm, DatasetImages, UserGeometry,
+                                               DatasetTombstone, get_change_watermark)
+from localcosmos_server.datasets.expressions import RowValueComparison
 
 from djangorestframework_camel_case.parser import CamelCaseJSONParser, CamelCaseMultiPartParser
 from djangorestframework_camel_case.render import CamelCaseJSONRenderer
@@ -23,6 +34,10 @@ from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiExam
 
 from .examples import get_observation_form_example
 
+import base64, binascii, json, uuid
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
 
 @extend_schema_view(
     post=extend_schema(
@@ -100,8 +115,9 @@ class AppUUIDSerializerMixin:
     - retrieve all datasets for one client_id (GET)
     - retrieve all datasets (GET)
     - more complex lookups require a separate POST endpoint with filters as JSON
+    - pass ?cursor= for keyset pagination, see DatasetKeysetPagination
 '''
-class ListCreateDataset(AppUUIDSerializerMixin, generics.ListCreateAPIView):
+class ListCreateDataset(DatasetKeysetPaginationMixin, AppUUIDSerializerMixin, generics.ListCreateAPIView):
 
     permission_classes = (AppMustExist, AnonymousObservationsPermissionOrGet,)
     authentication_classes = (JWTAuthentication,)
@@ -141,7 +157,121 @@ class ListCreateDataset(AppUUIDSerializerMixin, generics.ListCreateAPIView):
         return DatasetSerializer(self.kwargs['app_uuid'], *args, **kwargs)
 
 
-class GetFilteredDatasets(generics.GenericAPIView):
+'''
+    Create multiple Datasets with one request
+    - offline devices upload all pending datasets at once
+    - expects a list of DatasetJSON objects, each with a client-generated uuid
+    - valid datasets are inserted in one transaction
+    - returns the result per dataset uuid: created, duplicate or error. The results are keyed by the
+      canonical form of the uuid, invalid datasets without a valid uuid by their index in the upload
+    - datasets inserted by a concurrent upload are reported as duplicate, the others are inserted
+'''
+class BulkCreateDatasets(APIView):
+
+    permission_classes = (AppMustExist, AnonymousObservationsPermission,)
+    authentication_classes = (JWTAuthentication,)
+    parser_classes = (CamelCaseJSONParser,)
+    renderer_classes = (CamelCaseJSONRenderer,)
+    serializer_class = BulkDatasetSerializer
+
+    max_datasets = 500
+
+    def get_result_key(self, index, dataset_json):
+
+        if isinstance(dataset_json, dict) and 'uuid' in dataset_json:
+            try:
+                return str(uuid.UUID(str(dataset_json['uuid'])))
+            except ValueError:
+                pass
+
+        return str(index)
+
+    def post(self, request, *args, **kwargs):
+
+        app_uuid = kwargs['app_uuid']
+
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of datasets.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(request.data) > self.max_datasets:
+            message = 'At most {0} datasets can be uploaded at once.'.format(self.max_datasets)
+            return Response({'detail': message}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = None
+        if request.user.is_authenticated == True:
+            user = request.user
+
+        serializer_context = {
+            'request': request,
+        }
+
+        results = {}
+        valid_serializers = []
+
+        for index, dataset_json in enumerate(request.data):
+
+            serializer = self.serializer_class(app_uuid, data=dataset_json, context=serializer_context)
+
+            if serializer.is_valid():
+                valid_serializers.append(serializer)
+            else:
+                results[self.get_result_key(index, dataset_json)] = {
+                    'status': 'error',
+                    'errors': serializer.errors,
+                }
+
+        uploaded_uuids = [serializer.validated_data['uuid'] for serializer in valid_serializers]
+        existing_uuids = set(Dataset.objects.filter(uuid__in=uploaded_uuids).values_list('uuid', flat=True))
+
+        datasets = []
+
+        for serializer in valid_serializers:
+
+            dataset_uuid = serializer.validated_data['uuid']
+
+            if dataset_uuid in existing_uuids:
+                results[str(dataset_uuid)] = {
+                    'status': 'duplicate',
+                }
+                continue
+
+            # the same dataset can be contained twice in one upload
+            existing_uuids.add(dataset_uuid)
+
+            serializer.validated_data['user'] = user
+            datasets.append(serializer.build_dataset(serializer.validated_data))
+
+        created_datasets = []
+
+        # bulk_create_datasets inserts all datasets or none, each retry leaves out at least one dataset
+        while datasets:
+            try:
+                created_datasets = Dataset.objects.bulk_create_datasets(app_uuid, datasets)
+                break
+            except IntegrityError:
+                # a concurrent upload inserted some of the datasets first
+                conflicting_uuids = set(Dataset.objects.filter(
+                    uuid__in=[dataset.uuid for dataset in datasets]).values_list('uuid', flat=True))
+
+                if not conflicting_uuids:
+                    raise
+
+                for dataset_uuid in conflicting_uuids:
+                    results[str(dataset_uuid)] = {
+                        'status': 'duplicate',
+                    }
+
+                datasets = [dataset for dataset in datasets if dataset.uuid not in conflicting_uuids]
+
+        for dataset in created_datasets:
+            results[str(dataset.uuid)] = {
+                'status': 'created',
+            }
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class GetFilteredDatasets(DatasetKeysetPaginationMixin, generics.GenericAPIView):
     permission_classes = (AppMustExist,)
     parser_classes = (CamelCaseJSONParser,)
     renderer_classes = (CamelCaseJSONRenderer,)
@@ -150,12 +280,19 @@ class GetFilteredDatasets(generics.GenericAPIView):
 
     http_method_names = ['post']
 
-    def get_queryset(self, filters=[], order_by=None):
+    def get_queryset(self, filters=[], order_by=None, field_classes={}):
         queryset = Dataset.objects.filter(app_uuid=self.app_uuid)
 
         orm_filters = {}
         orm_excludes = {}
-        for filter in filters:
+        for index, filter in enumerate(filters):
+
+            # observation form field values, stored in Dataset.data
+            if 'field_uuid' in filter:
+                field_class = field_classes[str(filter['field_uuid'])]
+                queryset = filter_by_field(queryset, filter, field_class, 'field_value_{0}'.format(index))
+                continue
+
             operator = filter['operator']
 
             if operator == '=':
@@ -178,14 +315,14 @@ class GetFilteredDatasets(generics.GenericAPIView):
 
         self.app_uuid = kwargs['app_uuid']
 
-        filter_serializer = self.filter_serializer(data=request.data)
+        filter_serializer = self.filter_serializer(data=request.data, context={'app_uuid': self.app_uuid})
 
         if filter_serializer.is_valid():
 
             filters = filter_serializer.validated_data.get('filters', [])
             order_by = filter_serializer.validated_data.get('order_by', None)
 
-            queryset = self.get_queryset(filters, order_by)
+            queryset = self.get_queryset(filters, order_by, filter_serializer.field_classes)
 
             page = self.paginate_queryset(queryset)
             if page is not None:
@@ -198,6 +335,158 @@ class GetFilteredDatasets(generics.GenericAPIView):
         return Response(filter_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+'''
+    The datasets of an app closest to a point (WGS84), nearest first
+    - the search radius (max_distance, meters) and the number of results (limit) are bounded,
+      see DatasetManager.nearby
+    - optional taxon filters: taxon_source and taxon_nuid (including descendants), or name_uuid
+'''
+class NearbyDatasets(generics.GenericAPIView):
+
+    permission_classes = (AppMustExist,)
+    renderer_classes = (CamelCaseJSONRenderer,)
+    serializer_class = NearbyDatasetSerializer
+    filter_serializer = NearbyDatasetsFilterSerializer
+
+    @extend_schema(parameters=[NearbyDatasetsFilterSerializer])
+    def get(self, request, *args, **kwargs):
+
+        filter_serializer = self.filter_serializer(data=request.GET)
+
+        if filter_serializer.is_valid():
+
+            filters = filter_serializer.validated_data
+
+            point = Point(filters['longitude'], filters['latitude'], srid=4326)
+
+            datasets = Dataset.objects.nearby(point, kwargs['app_uuid'], filters['max_distance'],
+                limit=filters['limit'], taxon_source=filters.get('taxon_source', None),
+                taxon_nuid=filters.get('taxon_nuid', None), name_uuid=filters.get('name_uuid', None))
+
+            serializer = self.get_serializer(datasets, many=True)
+            return Response(serializer.data)
+
+        return Response(filter_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+'''
+    Delta sync for offline devices
+    - returns the datasets of the user (or client_id) which have been created, updated, validated or deleted
+      since the given cursor, ordered by the id of their writing transaction and their change_sequence
+    - only changes of committed transactions are returned, see get_change_watermark. A change which is
+      committed after the response is returned by a later request, it is not skipped
+    - deleted datasets are returned as tombstones (uuids)
+    - the cursor is opaque to the client, omitting it starts a full sync
+    - the client repeats the request with the returned cursor until hasMore is false
+    - cursors expire after LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS, the tombstones are pruned.
+      The client then receives 410 and starts a full sync
+'''
+class DatasetChanges(APIView):
+
+    permission_classes = (AppMustExist,)
+    authentication_classes = (JWTAuthentication,)
+    renderer_classes = (CamelCaseJSONRenderer,)
+    serializer_class = DatasetRetrieveSerializer
+
+    default_limit = 100
+    max_limit = 1000
+
+    def get_cursor_max_age(self):
+        retention_days = getattr(settings, 'LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS', 90)
+        return timedelta(days=retention_days)
+
+    def encode_cursor(self, change_xid, change_sequence):
+        cursor = json.dumps({
+            'xid': change_xid,
+            'sequence': change_sequence,
+            'issued_at': int(timezone.now().timestamp()),
+        }).encode('utf-8')
+        return base64.urlsafe_b64encode(cursor).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            cursor_json = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            change_xid = int(cursor_json['xid'])
+            change_sequence = int(cursor_json['sequence'])
+            issued_at = datetime.fromtimestamp(int(cursor_json['issued_at']), tz=dt_timezone.utc)
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError, OverflowError, OSError):
+            raise ValueError('Invalid cursor')
+
+        return change_xid, change_sequence, issued_at
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.GET.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+
+        return max(1, min(limit, self.max_limit))
+
+
+    def get(self, request, *args, **kwargs):
+
+        app_uuid = kwargs['app_uuid']
+
+        change_xid = 0
+        change_sequence = 0
+        if 'cursor' in request.GET:
+            try:
+                change_xid, change_sequence, issued_at = self.decode_cursor(request.GET['cursor'])
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if issued_at < timezone.now() - self.get_cursor_max_age():
+                return Response({'detail': 'The cursor has expired, restart the sync without a cursor.'},
+                    status=status.HTTP_410_GONE)
+
+        limit = self.get_limit(request)
+
+        # changes of transactions which are still running are returned by a later request
+        watermark = get_change_watermark()
+
+        position = RowValueComparison(['change_xid', 'change_sequence'], '>', [change_xid, change_sequence])
+
+        datasets = Dataset.objects.filter(position, app_uuid=app_uuid, change_xid__lt=watermark)
+        tombstones = DatasetTombstone.objects.filter(position, app_uuid=app_uuid, change_xid__lt=watermark)
+
+        if request.user.is_authenticated:
+            datasets = datasets.filter(user=request.user)
+            tombstones = tombstones.filter(user_uuid=request.user.uuid)
+        elif 'client_id' in request.GET:
+            datasets = datasets.filter(client_id=request.GET['client_id'])
+            tombstones = tombstones.filter(client_id=request.GET['client_id'])
+        else:
+            return Response({'detail': 'Authentication or a client_id is required.'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # fetch one more row than requested to know if there are more changes
+        datasets = list(datasets.select_related('user').order_by('change_xid', 'change_sequence')[:limit+1])
+        tombstones = list(tombstones.order_by('change_xid', 'change_sequence')[:limit+1])
+
+        changes = sorted(datasets + tombstones, key=lambda change: (change.change_xid, change.change_sequence))
+
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        changed_datasets = [change for change in changes if isinstance(change, Dataset)]
+        deleted = [str(change.uuid) for change in changes if isinstance(change, DatasetTombstone)]
+
+        if changes:
+            change_xid = changes[-1].change_xid
+            change_sequence = changes[-1].change_sequence
+
+        serializer = self.serializer_class(changed_datasets, many=True, context={'request': request})
+
+        response = {
+            'datasets': serializer.data,
+            'deleted': deleted,
+            'cursor': self.encode_cursor(change_xid, change_sequence),
+            'has_more': has_more,
+        }
+
+        return Response(response)
+
+
 class ManageDataset(AppUUIDSerializerMixin, generics.RetrieveUpdateDestroyAPIView):
 
     lookup_field = 'uuid'
@@ -230,6 +519,11 @@ class CreateDatasetImage(generics.CreateAPIView):
 
         return super().create(request, *args, **kwargs)
 
+    # lists only compute the urls of the resized images
+    def perform_create(self, serializer):
+        dataset_image = serializer.save()
+        dataset_image.schedule_renditions()
+
 
 class DestroyDatasetImage(AppUUIDSerializerMixin, generics.DestroyAPIView):
 
@@ -0,0 +1,296 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from localcosmos_server.datasets.models import (Dataset, DatasetTombstone, DatasetExportJob, DarwinCoreViewRefresh,
+                                               get_app_change_position)
+from localcosmos_server.datasets.expressions import RowValueComparison
+from localcosmos_server.datasets.darwin_core_sql import (get_darwin_core_view_name, get_darwin_core_view_exists_sql,
+                                                         get_darwin_core_materialized_view_exists_sql)
+
+from xml.sax.saxutils import escape, quoteattr
+
+from datetime import timedelta
+
+import csv, io, os, zipfile
+
+DWC_TERMS_NAMESPACE = 'http://rs.tdwg.org/dwc/terms/'
+
+# columns of the darwin core view which are not darwin core terms
+TERM_URIS = {
+    'modified': 'http://purl.org/dc/terms/modified',
+}
+
+OCCURRENCE_ROW_TYPE = 'http://rs.tdwg.org/dwc/terms/Occurrence'
+
+OCCURRENCE_FILENAME = 'occurrence.txt'
+
+
+'''
+    Darwin Core Archive (zip: occurrence.txt, meta.xml, eml.xml) of the darwin core view of an app
+    - the rows are read from the view with a server side cursor in chunks, see darwin_core_sql.py
+    - the view has to be enabled in the app admin, a materialized view is read as of its last refresh
+    - incremental archives: filters={'previous_export': <uuid of a finished DatasetExportJob>}
+      the rows of the previous archive are copied, only datasets which changed or were deleted since then are
+      read from the database. Changes are detected by (Dataset.change_xid, Dataset.change_sequence), which are
+      assigned by the server, not by last_modified, which is reported by the clients
+    - change_position is the latest change included in the archive, see get_app_change_position. It is stored in
+      DatasetExportJob.change_xid and DatasetExportJob.change_sequence
+    - deleted datasets are detected by their tombstones, an archive older than the tombstones is not built upon
+'''
+class DarwinCoreArchive:
+
+    chunk_size = 2000
+
+    file_extension = 'zip'
+
+    taxon_source = 'taxonomy.sources.col'
+
+    def __init__(self, request, app, filters={}, base_url=None):
+
+        self.request = request
+        self.app = app
+
+        filters = dict(filters)
+
+        self.previous_export = None
+
+        previous_export_uuid = filters.pop('previous_export', None)
+        if previous_export_uuid:
+            self.previous_export = DatasetExportJob.objects.filter(uuid=previous_export_uuid,
+                app_uuid=app.uuid, change_xid__isnull=False, change_sequence__isnull=False).first()
+
+            # the previous archive has expired, fall back to a full archive
+            if self.previous_export and not os.path.isfile(self.previous_export.get_filepath(app)):
+                self.previous_export = None
+
+            # the tombstones of datasets deleted since the previous archive may have been pruned
+            tombstone_retention_days = getattr(settings, 'LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS', 90)
+            tombstones_since = timezone.now() - timedelta(days=tombstone_retention_days)
+            if self.previous_export and self.previous_export.started_at < tombstones_since:
+                self.previous_export = None
+
+        filters['app_uuid'] = app.uuid
+        self.filters = filters
+
+        self.view_name = get_darwin_core_view_name(app)
+        self.change_position = None
+
+
+    @property
+    def is_incremental(self):
+        return self.previous_export is not None
+
+
+    # the datasets which are read from the database, for the progress of export jobs
+    def get_queryset(self):
+        queryset = Dataset.objects.filter(taxon_source=self.taxon_source, **self.filters)
+
+        if self.is_incremental:
+            queryset = queryset.filter(self.get_changes_since_previous_export())
+
+        return queryset
+
+
+    def get_changes_since_previous_export(self):
+        return RowValueComparison(['change_xid', 'change_sequence'], '>',
+            [self.previous_export.change_xid, self.previous_export.change_sequence])
+
+
+    def view_exists(self):
+
+        if settings.LOCALCOSMOS_PRIVATE == True:
+            schema_name = 'public'
+        else:
+            schema_name = connection.schema_name
+
+        with connection.cursor() as cursor:
+            cursor.execute(get_darwin_core_view_exists_sql(self.app, schema_name))
+            if cursor.fetchone()[0] == True:
+                return True
+
+            cursor.execute(get_darwin_core_materialized_view_exists_sql(self.app, schema_name))
+            return cursor.fetchone()[0] == True
+
+
+    # a materialized view contains the changes up to its last refresh
+    def get_current_change_position(self):
+
+        refresh = DarwinCoreViewRefresh.objects.filter(app_uuid=self.app.uuid).first()
+
+        if refresh:
+            return (refresh.change_xid or 0, refresh.change_sequence or 0)
+
+        return get_app_change_position(self.app.uuid)
+
+
+    # occurrenceIDs of the previous archive which are replaced or removed
+    # changes which are committed later have a higher position than change_position, the next archive reads them
+    def get_changed_occurrence_ids(self):
+
+        changes = self.get_changes_since_previous_export()
+
+        changed_ids = set()
+
+        for dataset_uuid in Dataset.objects.filter(changes, app_uuid=self.app.uuid).values_list(
+                'uuid', flat=True).iterator(chunk_size=self.chunk_size):
+            changed_ids.add(str(dataset_uuid))
+
+        for dataset_uuid in DatasetTombstone.objects.filter(changes, app_uuid=self.app.uuid).values_list(
+                'uuid', flat=True).iterator(chunk_size=self.chunk_size):
+            changed_ids.add(str(dataset_uuid))
+
+        return changed_ids
+
+
+    # the rows of exactly the changed occurrenceIDs are read, the rows which are not copied from the previous
+    # archive, also if datasets change while the archive is written
+    def get_select_sql(self, changed_ids=None):
+
+        sql = 'SELECT * FROM {0}'.format(connection.ops.quote_name(self.view_name))
+        params = []
+
+        if self.is_incremental:
+            sql = '{0} WHERE "occurrenceID" = ANY(%s::uuid[])'.format(sql)
+            params = [sorted(changed_ids)]
+
+        return sql, params
+
+
+    def serialize_value(self, value):
+        if value is None:
+            return ''
+        elif hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+
+    # yields lists of rows, the first yielded value is the list of column names
+    def iterate_view_chunks(self, changed_ids=None):
+
+        sql, params = self.get_select_sql(changed_ids)
+
+        # chunked_cursor is a server side cursor on postgres
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, params)
+
+            # the description of a server side cursor is available after the first fetch
+            rows = cursor.fetchmany(self.chunk_size)
+
+            yield [column.name for column in cursor.description]
+
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(self.chunk_size)
+
+
+    # returns False if the previous archive has different columns
+    def copy_previous_rows(self, writer, columns, changed_ids):
+
+        previous_filepath = self.previous_export.get_filepath(self.app)
+
+        with zipfile.ZipFile(previous_filepath, 'r') as previous_archive:
+            with previous_archive.open(OCCURRENCE_FILENAME, 'r') as previous_file:
+                reader = csv.reader(io.TextIOWrapper(previous_file, encoding='utf-8', newline=''),
+                    delimiter='\t')
+
+                if next(reader, None) != columns:
+                    return False
+
+                for row in reader:
+                    if row[0] not in changed_ids:
+                        writer.writerow(row)
+
+        return True
+
+
+    def get_term_uri(self, column):
+        return TERM_URIS.get(column, '{0}{1}'.format(DWC_TERMS_NAMESPACE, column))
+
+
+    def get_meta_xml(self, columns):
+
+        fields = '\n'.join(['    <field index="{0}" term={1}/>'.format(index, quoteattr(self.get_term_uri(column)))
+            for index, column in enumerate(columns)])
+
+        return '''<?xml version="1.0" encoding="UTF-8"?>
+<archive xmlns="http://rs.tdwg.org/dwc/text/" metadata="eml.xml">
+  <core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="&quot;"
+    ignoreHeaderLines="1" rowType={0}>
+    <files>
+      <location>{1}</location>
+    </files>
+    <id index="0"/>
+{2}
+  </core>
+</archive>
+'''.format(quoteattr(OCCURRENCE_ROW_TYPE), OCCURRENCE_FILENAME, fields)
+
+
+    def get_eml_xml(self):
+
+        return '''<?xml version="1.0" encoding="UTF-8"?>
+<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1" packageId={0} system="http://localcosmos.org"
+  xml:lang={1}>
+  <dataset>
+    <title>{2}</title>
+    <creator>
+      <organizationName>{2}</organizationName>
+    </creator>
+    <pubDate>{3}</pubDate>
+    <language>{4}</language>
+    <abstract>
+      <para>{5}</para>
+    </abstract>
+  </dataset>
+</eml:eml>
+'''.format(quoteattr(str(self.app.uuid)), quoteattr(self.app.primary_language), escape(self.app.name),
+            timezone.now().date().isoformat(), escape(self.app.primary_language),
+            escape('Observations reported with the app {0}'.format(self.app.name)))
+
+
+    # progress_callback(rows_processed) is called after each chunk read from the database
+    def write_file(self, filepath, progress_callback=None):
+
+        if not self.view_exists():
+            raise ValueError('The Darwin Core view of the app {0} does not exist'.format(self.app.uid))
+
+        change_position = self.get_current_change_position()
+
+        changed_ids = None
+        if self.is_incremental:
+            changed_ids = self.get_changed_occurrence_ids()
+
+        rows_processed = 0
+
+        with zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+
+            with archive.open(OCCURRENCE_FILENAME, 'w', force_zip64=True) as occurrence_file:
+
+                text_file = io.TextIOWrapper(occurrence_file, encoding='utf-8', newline='')
+                writer = csv.writer(text_file, delimiter='\t', lineterminator='\n')
+
+                chunks = self.iterate_view_chunks(changed_ids)
+                columns = next(chunks)
+
+                writer.writerow(columns)
+
+                if self.is_incremental and not self.copy_previous_rows(writer, columns, changed_ids):
+                    raise ValueError('The columns of the Darwin Core view have changed, create a full archive')
+
+                for rows in chunks:
+                    for row in rows:
+                        writer.writerow([self.serialize_value(value) for value in row])
+
+                    rows_processed += len(rows)
+
+                    if progress_callback is not None:
+                        progress_callback(rows_processed)
+
+                text_file.flush()
+                text_file.detach()
+
+            archive.writestr('meta.xml', self.get_meta_xml(columns))
+            archive.writestr('eml.xml', self.get_eml_xml())
+
+        self.change_position = change_position
@@ -4,26 +4,58 @@ def get_darwin_core_view_name(app):
     return '{0}_datasets_darwin_core'.format(app.uid)
 
 
+def get_darwin_core_index_name(app):
+    return '{0}_occurrence_id_idx'.format(get_darwin_core_view_name(app))
+
+
 '''
     getting taxonRank is impossible because the taxonomy is not present as a database
     currently, only taxa present in the catalogue of life are listed
     the full scientific name with author is supported
 '''
-def get_darwin_core_view_create_sql(app):
-    
-    view_name = get_darwin_core_view_name(app)
-    
-    sql = '''CREATE OR REPLACE VIEW {0} as SELECT 
-        dd.uuid AS "occurrenceID", 
-        'HumanObservation' AS "basisOfRecord", 
+def get_darwin_core_select_sql(app):
+
+    sql = '''SELECT
+        dd.uuid AS "occurrenceID",
+        'HumanObservation' AS "basisOfRecord",
         dd.timestamp AS "eventDate",
         concat_ws(' ', dd.taxon_latname, dd.taxon_author) AS "scientificName",
-        ST_Y(ST_Transform(dd.coordinates, 4326)) AS "decimalLatitude", 
-        ST_X(ST_Transform(dd.coordinates, 4326)) AS "decimalLongitude", 
+        ST_Y(ST_Transform(dd.coordinates, 4326)) AS "decimalLatitude",
+        ST_X(ST_Transform(dd.coordinates, 4326)) AS "decimalLongitude",
         'EPSG:4326' AS "geodeticDatum"
         FROM
-        datasets_dataset dd WHERE dd.app_uuid='{1}' AND dd.taxon_source='taxonomy.sources.col';
-    '''.format(view_name, str(app.uuid))
+        datasets_dataset dd WHERE dd.app_uuid='{0}' AND dd.taxon_source='taxonomy.sources.col'
+    '''.format(str(app.uuid))
+    return sql
+
+
+def get_darwin_core_view_create_sql(app):
+
+    view_name = get_darwin_core_view_name(app)
+
+    sql = 'CREATE OR REPLACE VIEW {0} as {1};'.format(view_name, get_darwin_core_select_sql(app))
+    return sql
+
+
+'''
+    the materialized variant stores the rows, consumers do not read the datasets table
+    - the unique index on occurrenceID is required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+    - it is refreshed by the management command refresh_darwin_core_views
+'''
+def get_darwin_core_materialized_view_create_sql(app):
+
+    view_name = get_darwin_core_view_name(app)
+
+    sql = '''CREATE MATERIALIZED VIEW IF NOT EXISTS {0} as {1} WITH DATA;
+        CREATE UNIQUE INDEX IF NOT EXISTS {2} ON {0} ("occurrenceID");'''.format(view_name,
+        get_darwin_core_select_sql(app), get_darwin_core_index_name(app))
+    return sql
+
+
+# readers are not blocked while the materialized view is refreshed
+def get_darwin_core_materialized_view_refresh_sql(app):
+    view_name = get_darwin_core_view_name(app)
+    sql = 'REFRESH MATERIALIZED VIEW CONCURRENTLY {0}'.format(view_name)
     return sql
 
 
@@ -33,8 +65,22 @@ def get_darwin_core_view_drop_sql(app):
     return sql
 
 
+def get_darwin_core_materialized_view_drop_sql(app):
+    view_name = get_darwin_core_view_name(app)
+    sql = 'DROP MATERIALIZED VIEW IF EXISTS {0}'.format(view_name)
+    return sql
+
+
 def get_darwin_core_view_exists_sql(app, schema_name):
 
     view_name = get_darwin_core_view_name(app)
     sql = '''SELECT EXISTS (SELECT FROM INFORMATION_SCHEMA.VIEWS WHERE table_schema='{0}' AND table_name='{1}') '''.format(schema_name, view_name)
-    return sql
\ No newline at end of file
+    return sql
+
+
+# materialized views are not listed in INFORMATION_SCHEMA.VIEWS
+def get_darwin_core_materialized_view_exists_sql(app, schema_name):
+
+    view_name = get_darwin_core_view_name(app)
+    sql = '''SELECT EXISTS (SELECT FROM pg_matviews WHERE schemaname='{0}' AND matviewname='{1}') '''.format(schema_name, view_name)
+    return sql
@@ -0,0 +1,401 @@
+from django.contrib.gis.db.models.functions import Transform
+from django.db import models
+from django.db.models import Func
+
+from localcosmos_server.utils import datetime_from_cron
+
+from localcosmos_server.datasets.models import Dataset, DatasetImages
+from localcosmos_server.datasets.observation_form_cache import observation_form_cache
+
+import json
+
+
+'''
+    Common base of the dataset exports (csv, parquet, geojson, geopackage)
+    - exporters take (request, app, filters=, base_url=) and provide get_queryset(), file_extension
+      and write_file(filepath, progress_callback=None), see export_jobs.py
+    - the datasets are read with a server side cursor in chunks, memory does not grow with the number of datasets
+    - the images of a chunk are read with one query
+    - serialize_<field class> converts a reported value to text
+'''
+class DatasetExport:
+
+    chunk_size = 2000
+
+    file_extension = None
+
+    # base_url is used for absolute image urls if there is no request, e.g. in background exports
+    def __init__(self, request, app, filters={}, base_url=None):
+
+        # required for urls
+        self.request = request
+
+        if base_url is None and request is not None:
+            base_url = '{0}://{1}'.format(request.scheme, request.get_host())
+
+        self.base_url = base_url or ''
+
+        filters = dict(filters)
+        filters['app_uuid'] = app.uuid
+
+        self.filters = filters
+
+
+    def get_queryset(self):
+        return Dataset.objects.filter(**self.filters)
+
+
+    # the layout is derived from the distinct observation forms, not from the datasets
+    def iterate_observation_form_indices(self):
+
+        observation_form_ids = self.get_queryset().order_by().values_list('observation_form_id',
+            flat=True).distinct()
+
+        for observation_form_id in sorted(observation_form_ids):
+
+            observation_form = observation_form_cache.get_by_id(observation_form_id)
+            yield observation_form_id, observation_form_cache.get_index(observation_form)
+
+
+    def get_PointJSONField_coordinate_label(self, coordinate, label):
+        return '{0} ({1})'.format(label, coordinate)
+
+    def get_PointJSONField_coordinate_uuid(self, coordinate, field_uuid):
+        return '{0}_{1}'.format(field_uuid, coordinate)
+
+
+    # fields_by_observation_form: {observation_form_id: [(field_uuid, field_class, column)]}
+    def has_picture_fields(self, fields_by_observation_form):
+        return any(field_class == 'PictureField'
+            for form_fields in fields_by_observation_form.values() for field_uuid, field_class, column in form_fields)
+
+
+    # newest first, the order of Dataset.Meta.ordering which the csv export has always used
+    def iterate_chunks(self):
+
+        queryset = self.get_queryset().select_related('user').order_by('-pk')
+
+        chunk = []
+
+        for dataset in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(dataset)
+
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+    # one query per chunk: dataset_id -> {field_uuid: [image urls]}
+    def get_image_urls_map(self, datasets):
+
+        images = DatasetImages.objects.filter(dataset_id__in=[dataset.pk for dataset in datasets]).only(
+            'dataset_id', 'field_uuid', 'image').order_by('pk')
+
+        image_urls_map = {}
+
+        for image in images:
+            dataset_image_urls = image_urls_map.setdefault(image.dataset_id, {})
+            field_image_urls = dataset_image_urls.setdefault(str(image.field_uuid), [])
+            field_image_urls.append('{0}{1}'.format(self.base_url, image.image.url))
+
+        return image_urls_map
+
+
+    def get_user_names(self, dataset):
+
+        username = None
+        full_name = None
+
+        if dataset.user:
+            username = dataset.user.username
+            full_name = '{0} {1}'.format(dataset.user.first_name, dataset.user.last_name)
+
+        return username, full_name
+
+
+    def serialize_TaxonField(self, value):
+        if value:
+            return '{0} {1}'.format(value['taxonLatname'], value['taxonAuthor'])
+        return value
+
+
+    def serialize_SelectTaxonField(self, value):
+        return self.serialize_TaxonField(value)
+
+
+    def serialize_PointJSONField(self, value):
+        if value:
+            return value['geometry']['coordinates']
+        return value
+
+
+    def serialize_DateTimeJSONField(self, value):
+
+        if value:
+            dt = datetime_from_cron(value)
+            return dt.isoformat()
+        return value
+
+
+    def serialize_MultipleChoiceField(self, value):
+        if value and type(value) == list:
+            return ','.join(value)
+        return value
+
+
+    def serialize_ChoiceField(self, value):
+        return value
+
+
+    def serialize_CharField(self, value):
+        return value
+
+
+    def serialize_GeoJSONField(self, value):
+        return json.dumps(value)
+
+    def serialize_BooleanField(self, value):
+        return value
+
+
+    def serialize_DecimalField(self, value):
+        return value
+
+
+    def serialize_FloatField(self, value):
+        return value
+
+
+    def serialize_IntegerField(self, value):
+        return value
+
+
+    def serialize_PictureField(self, value):
+        if value:
+            raise ValueError('Not implemented: PictureField')
+        return value
+
+
+# field class -> type name of the typed layout, see TypedDatasetExport
+FIELD_CLASS_TYPES = {
+    'IntegerField': 'int64',
+    'DecimalField': 'float64',
+    'FloatField': 'float64',
+    'BooleanField': 'bool',
+    'DateTimeJSONField': 'timestamp',
+    'MultipleChoiceField': 'list',
+    'PictureField': 'list',
+    'PointJSONField': 'float64',
+}
+
+
+'''
+    Base of the exports with typed columns (parquet, geojson, geopackage)
+    - numbers, booleans, timestamps and lists instead of text
+    - longitude and latitude (WGS84) are read from Dataset.coordinates
+    - fields of different observation forms sharing a label share a column, as in the csv export.
+      If their types differ, the column is a string column
+    - a reported value which does not match the type of its field, e.g. text in an IntegerField, is exported as
+      empty value, the export is not aborted
+'''
+class TypedDatasetExport(DatasetExport):
+
+    # (column name, type name)
+    dataset_columns = [
+        ('uuid', 'string'),
+        ('observation_form_uuid', 'string'),
+        ('client_id', 'string'),
+        ('username', 'string'),
+        ('name', 'string'),
+        ('platform', 'string'),
+        ('timestamp', 'timestamp'),
+        ('longitude', 'float64'),
+        ('latitude', 'float64'),
+        ('taxon_latname', 'string'),
+        ('taxon_author', 'string'),
+        ('taxon_source', 'string'),
+        ('name_uuid', 'string'),
+    ]
+
+    # longitude and latitude are computed by the database, the geometry columns are not loaded
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        coordinates = Transform('coordinates', 4326)
+
+        return queryset.annotate(
+            longitude=Func(coordinates, function='ST_X', output_field=models.FloatField()),
+            latitude=Func(coordinates, function='ST_Y', output_field=models.FloatField()),
+        ).defer('coordinates', 'geographic_reference').select_related('observation_form')
+
+
+    # returns (columns, fields_by_observation_form)
+    # columns: [(column name, type name)]
+    # fields_by_observation_form: {observation_form_id: [(field_uuid, field_class, column name or (x, y))]}
+    def get_typed_layout(self):
+
+        columns = list(self.dataset_columns)
+        column_types = dict(columns)
+
+        label_to_column = {}
+
+        def add_column(label, type_name):
+
+            if label not in label_to_column:
+                column_name = label
+                # field labels must not shadow the dataset columns
+                if column_name in column_types:
+                    column_name = 'field: {0}'.format(label)
+
+                label_to_column[label] = column_name
+                column_types[column_name] = type_name
+                columns.append((column_name, type_name))
+
+            column_name = label_to_column[label]
+
+            if column_types[column_name] != type_name:
+                column_types[column_name] = 'string'
+
+            return column_name
+
+        fields_by_observation_form = {}
+
+        for observation_form_id, observation_form_index in self.iterate_observation_form_indices():
+
+            form_fields = []
+
+            for field in observation_form_index.fields:
+
+                label = field['definition']['label']
+                field_class = field['fieldClass']
+                type_name = FIELD_CLASS_TYPES.get(field_class, 'string')
+
+                if field_class == 'PointJSONField':
+                    column_x = add_column(self.get_PointJSONField_coordinate_label('x', label), type_name)
+                    column_y = add_column(self.get_PointJSONField_coordinate_label('y', label), type_name)
+                    form_fields.append((field['uuid'], field_class, (column_x, column_y)))
+                else:
+                    form_fields.append((field['uuid'], field_class, add_column(label, type_name)))
+
+            fields_by_observation_form[observation_form_id] = form_fields
+
+        columns = [(column_name, column_types[column_name]) for column_name, type_name in columns]
+
+        return columns, fields_by_observation_form
+
+
+    def get_typed_row(self, dataset, form_fields, image_urls={}):
+
+        username, full_name = self.get_user_names(dataset)
+
+        row = {
+            'uuid': str(dataset.uuid),
+            'observation_form_uuid': str(dataset.observation_form.uuid),
+            'client_id': dataset.client_id,
+            'username': username,
+            'name': full_name,
+            'platform': dataset.platform,
+            'timestamp': dataset.timestamp,
+            'longitude': dataset.longitude,
+            'latitude': dataset.latitude,
+            'taxon_latname': dataset.taxon_latname,
+            'taxon_author': dataset.taxon_author,
+            'taxon_source': dataset.taxon_source,
+            'name_uuid': str(dataset.name_uuid) if dataset.name_uuid else None,
+        }
+
+        reported_data = dataset.data
+
+        for field_uuid, field_class, column_name in form_fields:
+
+            if field_class == 'PictureField':
+                field_image_urls = image_urls.get(str(field_uuid), [])
+                if field_image_urls:
+                    row[column_name] = field_image_urls
+
+            elif field_uuid in reported_data:
+
+                value = reported_data[field_uuid]
+
+                if field_class == 'PointJSONField':
+                    coordinates = self.serialize_PointJSONField(value)
+                    if coordinates:
+                        row[column_name[0]] = coordinates[0]
+                        row[column_name[1]] = coordinates[1]
+
+                else:
+                    typed_value_fn = getattr(self, 'typed_{0}'.format(field_class), None)
+                    if typed_value_fn:
+                        value = typed_value_fn(value)
+                    else:
+                        value = getattr(self, 'serialize_{0}'.format(field_class), self.serialize_CharField)(value)
+
+                    row[column_name] = value
+
+        return row
+
+
+    # values which do not match the type of a merged string column are stored as text
+    def coerce_value(self, value, type_name):
+
+        if value is None or type_name != 'string' or isinstance(value, str):
+            return value
+
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+
+        return str(value)
+
+
+    def typed_IntegerField(self, value):
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+
+    def typed_DecimalField(self, value):
+        if value is None or value == '':
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+
+    def typed_FloatField(self, value):
+        return self.typed_DecimalField(value)
+
+
+    # bool('false') would be True
+    def typed_BooleanField(self, value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return value == 1
+        if isinstance(value, str):
+            value = value.strip().lower()
+            if value in ('true', '1'):
+                return True
+            if value in ('false', '0'):
+                return False
+        return None
+
+
+    def typed_DateTimeJSONField(self, value):
+        if value:
+            return datetime_from_cron(value)
+        return None
+
+
+    def typed_MultipleChoiceField(self, value):
+        if value is None:
+            return None
+        if not isinstance(value, list):
+            value = [value]
+        return [str(choice) for choice in value]
@@ -0,0 +1,104 @@
+from localcosmos_server.datasets.models import DatasetExportJob
+
+from importlib import import_module
+from importlib.util import find_spec
+
+import os, traceback
+
+# export_format -> exporter class
+# exporters take (request, app, filters=, base_url=) and provide get_queryset(), file_extension
+# and write_file(filepath, progress_callback=None), see dataset_export.DatasetExport
+DATASET_EXPORT_CLASSES = {
+    'csv': 'localcosmos_server.datasets.csv_export.DatasetCSVExport',
+    'parquet': 'localcosmos_server.datasets.parquet_export.DatasetParquetExport',
+    'geojson': 'localcosmos_server.datasets.geo_export.DatasetGeoJSONExport',
+    'gpkg': 'localcosmos_server.datasets.geo_export.DatasetGeoPackageExport',
+    'dwca': 'localcosmos_server.datasets.darwin_core_archive.DarwinCoreArchive',
+}
+
+
+# export_format -> optional dependency, see extras_require in setup.py
+DATASET_EXPORT_REQUIREMENTS = {
+    'parquet': 'pyarrow',
+}
+
+
+# formats whose optional dependency is not installed are not offered
+def is_export_format_available(export_format):
+
+    if export_format not in DATASET_EXPORT_CLASSES:
+        return False
+
+    requirement = DATASET_EXPORT_REQUIREMENTS.get(export_format, None)
+
+    return requirement is None or find_spec(requirement) is not None
+
+
+class DatasetExportCancelled(Exception):
+    pass
+
+
+def get_export_class(export_format):
+    module_path, class_name = DATASET_EXPORT_CLASSES[export_format].rsplit('.', 1)
+    return getattr(import_module(module_path), class_name)
+
+
+def run_export_job(job):
+
+    app = job.get_app()
+
+    if app is None:
+        raise ValueError('App {0} does not exist'.format(job.app_uuid))
+
+    export_class = get_export_class(job.export_format)
+    exporter = export_class(None, app, filters=job.filters, base_url=job.base_url)
+
+    job.total_rows = exporter.get_queryset().count()
+    job.rows_processed = 0
+    job.save(update_fields=['total_rows', 'rows_processed'])
+
+    filename = job.get_filename(exporter.file_extension)
+    filepath = job.get_filepath(app, filename)
+
+    # a download never sees a partially written file
+    tmp_filepath = '{0}.part'.format(filepath)
+
+    def on_progress(rows_processed):
+        DatasetExportJob.objects.filter(pk=job.pk).update(rows_processed=rows_processed)
+
+        if DatasetExportJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise DatasetExportCancelled()
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    try:
+        exporter.write_file(tmp_filepath, progress_callback=on_progress)
+    except DatasetExportCancelled:
+        os.remove(tmp_filepath)
+        job.set_cancelled()
+        return
+    except Exception:
+        if os.path.isfile(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+    os.replace(tmp_filepath, filepath)
+
+    job.filename = filename
+    job.rows_processed = job.total_rows
+    job.change_xid, job.change_sequence = getattr(exporter, 'change_position', (None, None))
+    job.save(update_fields=['filename', 'rows_processed', 'change_xid', 'change_sequence'])
+    job.set_finished()
+
+
+# used by the worker and for exports within the request
+def process_export_job(job):
+
+    if job.cancel_requested == True:
+        job.set_cancelled()
+        return
+
+    try:
+        run_export_job(job)
+    except Exception:
+        job.set_failed(traceback.format_exc())
@@ -0,0 +1,44 @@
+from django.db.models import BooleanField, F, Func, Value
+
+'''
+    Row value comparison: (column_1, column_2) > (value_1, value_2)
+    - one range condition on a multicolumn index, unlike the equivalent
+      column_1 > value_1 OR (column_1 = value_1 AND column_2 > value_2)
+    - usable in queryset.filter(), the values must not be NULL
+'''
+class RowValueComparison(Func):
+
+    output_field = BooleanField()
+
+    operators = ('<', '<=', '>', '>=')
+
+    def __init__(self, columns, operator, values):
+
+        if operator not in self.operators:
+            raise ValueError('Unsupported operator: {0}'.format(operator))
+
+        if len(columns) != len(values):
+            raise ValueError('The number of columns and values differ')
+
+        self.operator = operator
+        self.width = len(columns)
+
+        expressions = [F(column) for column in columns] + [Value(value) for value in values]
+
+        super().__init__(*expressions)
+
+
+    def as_sql(self, compiler, connection, **extra_context):
+
+        sqls = []
+        params = []
+
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            sqls.append(sql)
+            params.extend(expression_params)
+
+        sql = '({0}) {1} ({2})'.format(', '.join(sqls[:self.width]), self.operator,
+            ', '.join(sqls[self.width:]))
+
+        return sql, params
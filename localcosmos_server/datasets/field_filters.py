@@ -0,0 +1,160 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import models
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+
+from localcosmos_server.datasets.models import Dataset
+from localcosmos_server.datasets.observation_form_cache import observation_form_cache
+
+'''
+    Filtering datasets by the values of observation form fields
+    - the values are stored in Dataset.data, keyed by field uuid
+    - the field class decides how a value is compared, it is looked up in the observation forms used by the
+      datasets of the app. Values which do not match the field class are rejected by DatasetFilterSerializer
+    - numeric fields are compared as double precision: (data->>'<field_uuid>')::double precision
+    - text fields are compared as text: data->>'<field_uuid>'
+    - BooleanField and MultipleChoiceField values use jsonb containment: data @> '{"<field_uuid>": ...}'
+    - each filter also requires data ? '<field_uuid>', which matches the predicate of the partial field indexes
+    - the indexes are created by the management command create_dataset_field_indexes
+'''
+NUMERIC_FIELD_CLASSES = ['IntegerField', 'DecimalField', 'FloatField']
+TEXT_FIELD_CLASSES = ['CharField', 'ChoiceField']
+CONTAINMENT_FIELD_CLASSES = ['BooleanField', 'MultipleChoiceField']
+
+FIELD_FILTER_OPERATORS = ['=', '!=', '<', '<=', '>', '>=', 'startswith', 'contains']
+
+RANGE_LOOKUPS = {
+    '<': 'lt',
+    '<=': 'lte',
+    '>': 'gt',
+    '>=': 'gte',
+}
+
+DATA_GIN_INDEX_NAME = 'dataset_data_gin_idx'
+
+
+def get_numeric_field_expression(field_uuid):
+    return Cast(KeyTextTransform(str(field_uuid), 'data'), models.FloatField())
+
+
+def get_text_field_expression(field_uuid):
+    return KeyTextTransform(str(field_uuid), 'data')
+
+
+def get_field_index_name(field_uuid):
+    return 'dataset_field_{0}_idx'.format(str(field_uuid).replace('-', ''))
+
+
+# field uuid -> field class of all observation forms used by the datasets of an app
+# field uuids are unique, all versions of a form have the same field class for a field uuid
+def get_app_field_classes(app_uuid):
+
+    observation_form_ids = Dataset.objects.filter(app_uuid=app_uuid).values_list(
+        'observation_form_id', flat=True).distinct()
+
+    field_classes = {}
+
+    for observation_form_id in observation_form_ids:
+        observation_form = observation_form_cache.get_by_id(observation_form_id)
+        if observation_form is not None:
+            field_classes.update(observation_form_cache.get_index(observation_form).field_classes)
+
+    return field_classes
+
+
+# operators are checked by DATASET_FILTERS_SCHEMA in DatasetFilterSerializer
+def get_field_filter_error(field_filter, field_class):
+
+    field_uuid = field_filter['field_uuid']
+    value = field_filter['value']
+    operator = field_filter['operator']
+
+    if field_class is None:
+        return 'No observation form contains the field {0}'.format(field_uuid)
+
+    if field_class in NUMERIC_FIELD_CLASSES:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return 'The {0} {1} can only be filtered by numbers'.format(field_class, field_uuid)
+        if operator in ['startswith', 'contains']:
+            return 'Numbers can not be filtered with {0}'.format(operator)
+
+    elif field_class in TEXT_FIELD_CLASSES:
+        if not isinstance(value, str):
+            return 'The {0} {1} can only be filtered by strings'.format(field_class, field_uuid)
+        if operator == 'contains':
+            return 'The {0} {1} can not be filtered with contains'.format(field_class, field_uuid)
+
+    elif field_class == 'BooleanField':
+        if not isinstance(value, bool):
+            return 'The {0} {1} can only be filtered by booleans'.format(field_class, field_uuid)
+        if operator not in ['=', '!=']:
+            return 'Boolean values can only be filtered with = and !='
+
+    elif field_class == 'MultipleChoiceField':
+        if not isinstance(value, str):
+            return 'The {0} {1} can only be filtered by strings'.format(field_class, field_uuid)
+        if operator != 'contains':
+            return 'The {0} {1} can only be filtered with contains'.format(field_class, field_uuid)
+
+    else:
+        return 'Fields of the class {0} can not be filtered'.format(field_class)
+
+    return None
+
+
+# field_class is validated by DatasetFilterSerializer
+def filter_by_field(queryset, field_filter, field_class, alias_name):
+
+    field_uuid = str(field_filter['field_uuid'])
+    value = field_filter['value']
+    operator = field_filter['operator']
+
+    has_key = Q(data__has_key=field_uuid)
+
+    if field_class == 'MultipleChoiceField':
+        return queryset.filter(has_key, data__contains={field_uuid: [value]})
+
+    if field_class == 'BooleanField':
+        contains = Q(data__contains={field_uuid: value})
+        if operator == '=':
+            return queryset.filter(has_key, contains)
+        return queryset.filter(has_key).exclude(contains)
+
+    if field_class in NUMERIC_FIELD_CLASSES:
+        expression = get_numeric_field_expression(field_uuid)
+    else:
+        expression = get_text_field_expression(field_uuid)
+
+    queryset = queryset.alias(**{alias_name: expression})
+
+    if operator == '=':
+        return queryset.filter(has_key, **{alias_name: value})
+    elif operator == '!=':
+        return queryset.filter(has_key).exclude(**{alias_name: value})
+    elif operator == 'startswith':
+        return queryset.filter(has_key, **{'{0}__istartswith'.format(alias_name): value})
+
+    lookup = '{0}__{1}'.format(alias_name, RANGE_LOOKUPS[operator])
+    return queryset.filter(has_key, **{lookup: value})
+
+
+# returns None if the field class is not indexed by an expression index
+def get_field_index(field):
+
+    field_uuid = field['uuid']
+    field_class = field['fieldClass']
+
+    if field_class in NUMERIC_FIELD_CLASSES:
+        expression = get_numeric_field_expression(field_uuid)
+    elif field_class in TEXT_FIELD_CLASSES:
+        expression = get_text_field_expression(field_uuid)
+    else:
+        return None
+
+    return models.Index(F('app_uuid'), expression, name=get_field_index_name(field_uuid),
+        condition=Q(data__has_key=field_uuid))
+
+
+def get_data_gin_index():
+    return GinIndex(OpClass(F('data'), name='jsonb_path_ops'), name=DATA_GIN_INDEX_NAME)
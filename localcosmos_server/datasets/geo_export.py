@@ -0,0 +1,269 @@
+from django.contrib.gis.db.models.functions import AsGeoJSON, AsWKB, Transform
+
+from localcosmos_server.datasets.dataset_export import TypedDatasetExport
+
+from datetime import timezone as dt_timezone
+
+import json, sqlite3, struct
+
+
+def serialize_datetime(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(value).__name__))
+
+
+'''
+    Export the datasets of an app as newline-delimited GeoJSON (one Feature per line)
+    - the geometry is Dataset.geographic_reference, produced as json by the database:
+      ST_AsGeoJSON(ST_Transform(geographic_reference, 4326)), it is inserted into the line without being parsed
+    - the properties are the typed columns, see TypedDatasetExport
+    - the datasets are read in chunks with a server side cursor, memory does not grow with the number of datasets
+'''
+class DatasetGeoJSONExport(TypedDatasetExport):
+
+    file_extension = 'geojsonl'
+
+    # decimal places of the coordinates, 7 is about 1cm
+    geometry_precision = 7
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.annotate(geometry_geojson=AsGeoJSON(Transform('geographic_reference', 4326),
+            precision=self.geometry_precision))
+
+
+    def get_feature(self, dataset, columns, form_fields, image_urls={}):
+
+        row = self.get_typed_row(dataset, form_fields, image_urls=image_urls)
+
+        properties = {}
+        for column_name, type_name in columns:
+            properties[column_name] = self.coerce_value(row.get(column_name), type_name)
+
+        geometry = dataset.geometry_geojson or 'null'
+
+        return '{{"type":"Feature","geometry":{0},"properties":{1}}}\n'.format(geometry,
+            json.dumps(properties, default=serialize_datetime))
+
+
+    # progress_callback(rows_processed) is called after each chunk
+    def iterate_features(self, progress_callback=None):
+
+        columns, fields_by_observation_form = self.get_typed_layout()
+
+        has_picture_fields = self.has_picture_fields(fields_by_observation_form)
+
+        rows_processed = 0
+
+        for chunk in self.iterate_chunks():
+
+            image_urls_map = {}
+            if has_picture_fields:
+                image_urls_map = self.get_image_urls_map(chunk)
+
+            for dataset in chunk:
+                form_fields = fields_by_observation_form[dataset.observation_form_id]
+                yield self.get_feature(dataset, columns, form_fields, image_urls=image_urls_map.get(dataset.pk, {}))
+
+            rows_processed += len(chunk)
+
+            if progress_callback is not None:
+                progress_callback(rows_processed)
+
+
+    def write_file(self, filepath, progress_callback=None):
+
+        with open(filepath, 'w') as geojson_file:
+            for feature in self.iterate_features(progress_callback=progress_callback):
+                geojson_file.write(feature)
+
+
+    # yields the features, for StreamingHttpResponse
+    def stream_geojson(self):
+        yield from self.iterate_features()
+
+
+# type name of the typed layout -> GeoPackage column type
+GEOPACKAGE_COLUMN_TYPES = {
+    'string': 'TEXT',
+    'int64': 'INTEGER',
+    'float64': 'DOUBLE',
+    'bool': 'BOOLEAN',
+    'timestamp': 'DATETIME',
+    'list': 'TEXT',
+}
+
+GEOPACKAGE_APPLICATION_ID = 0x47504B47 # GPKG
+GEOPACKAGE_USER_VERSION = 10300 # 1.3
+
+# the spatial reference systems required by the GeoPackage specification
+GEOPACKAGE_SPATIAL_REF_SYS = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326,
+     'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+     'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+     'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+     'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid'),
+]
+
+
+'''
+    Export the datasets of an app as GeoPackage (sqlite) for GIS software
+    - one feature table "observations" with a geometry column in EPSG:4326 and the typed columns,
+      see TypedDatasetExport
+    - the geometry is produced as WKB by the database: ST_AsBinary(ST_Transform(geographic_reference, 4326)),
+      only the GeoPackage binary header is prepended in python
+    - each chunk of datasets is inserted with executemany
+'''
+class DatasetGeoPackageExport(TypedDatasetExport):
+
+    file_extension = 'gpkg'
+
+    table_name = 'observations'
+    geometry_column = 'geom'
+    srs_id = 4326
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.annotate(geometry_wkb=AsWKB(Transform('geographic_reference', self.srs_id)))
+
+
+    # GeoPackage binary: magic, version 0, flags (little endian header, no envelope), srs_id, WKB
+    def get_geometry_blob(self, wkb):
+        if wkb is None:
+            return None
+        return b'GP' + struct.pack('<BBi', 0, 1, self.srs_id) + bytes(wkb)
+
+
+    def get_column_value(self, value, type_name):
+
+        if value is None:
+            return None
+
+        if type_name == 'timestamp':
+            return value.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        elif type_name == 'list':
+            return json.dumps(value)
+        elif type_name == 'bool':
+            return int(value)
+
+        return self.coerce_value(value, type_name)
+
+
+    def quote_name(self, name):
+        return '"{0}"'.format(name.replace('"', '""'))
+
+
+    def create_tables(self, connection, columns):
+
+        connection.execute('PRAGMA application_id = {0}'.format(GEOPACKAGE_APPLICATION_ID))
+        connection.execute('PRAGMA user_version = {0}'.format(GEOPACKAGE_USER_VERSION))
+
+        connection.execute('''CREATE TABLE gpkg_spatial_ref_sys (
+            srs_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL PRIMARY KEY,
+            organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL,
+            definition TEXT NOT NULL,
+            description TEXT)''')
+
+        connection.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+            GEOPACKAGE_SPATIAL_REF_SYS)
+
+        connection.execute('''CREATE TABLE gpkg_contents (
+            table_name TEXT NOT NULL PRIMARY KEY,
+            data_type TEXT NOT NULL,
+            identifier TEXT UNIQUE,
+            description TEXT DEFAULT '',
+            last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE,
+            min_y DOUBLE,
+            max_x DOUBLE,
+            max_y DOUBLE,
+            srs_id INTEGER,
+            CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))''')
+
+        connection.execute('''CREATE TABLE gpkg_geometry_columns (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL,
+            z TINYINT NOT NULL,
+            m TINYINT NOT NULL,
+            CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+            CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+            CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))''')
+
+        column_definitions = ['fid INTEGER PRIMARY KEY AUTOINCREMENT',
+            '{0} GEOMETRY'.format(self.quote_name(self.geometry_column))]
+
+        for column_name, type_name in columns:
+            column_definitions.append('{0} {1}'.format(self.quote_name(column_name),
+                GEOPACKAGE_COLUMN_TYPES[type_name]))
+
+        connection.execute('CREATE TABLE {0} ({1})'.format(self.quote_name(self.table_name),
+            ', '.join(column_definitions)))
+
+        connection.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+            [self.table_name, 'features', self.table_name, self.srs_id])
+
+        # geographic_reference contains points and polygons
+        connection.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)',
+            [self.table_name, self.geometry_column, 'GEOMETRY', self.srs_id, 0, 0])
+
+
+    # progress_callback(rows_processed) is called after each chunk
+    def write_file(self, filepath, progress_callback=None):
+
+        columns, fields_by_observation_form = self.get_typed_layout()
+
+        has_picture_fields = self.has_picture_fields(fields_by_observation_form)
+
+        insert_sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            self.quote_name(self.table_name),
+            ', '.join([self.quote_name(self.geometry_column)] + [self.quote_name(column_name)
+                for column_name, type_name in columns]),
+            ', '.join(['?'] * (len(columns) + 1)),
+        )
+
+        connection = sqlite3.connect(filepath)
+
+        try:
+            self.create_tables(connection, columns)
+
+            rows_processed = 0
+
+            for chunk in self.iterate_chunks():
+
+                image_urls_map = {}
+                if has_picture_fields:
+                    image_urls_map = self.get_image_urls_map(chunk)
+
+                rows = []
+
+                for dataset in chunk:
+                    form_fields = fields_by_observation_form[dataset.observation_form_id]
+                    row = self.get_typed_row(dataset, form_fields, image_urls=image_urls_map.get(dataset.pk, {}))
+
+                    values = [self.get_geometry_blob(dataset.geometry_wkb)]
+                    for column_name, type_name in columns:
+                        values.append(self.get_column_value(row.get(column_name), type_name))
+
+                    rows.append(values)
+
+                connection.executemany(insert_sql, rows)
+                connection.commit()
+
+                rows_processed += len(chunk)
+
+                if progress_callback is not None:
+                    progress_callback(rows_processed)
+
+            connection.execute('''UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now')
+                WHERE table_name = ?''', [self.table_name])
+            connection.commit()
+
+        finally:
+            connection.close()
@@ -138,6 +138,10 @@ OBSERVATION_FORM_SCHEMA = {
                 },
                 "initial": {
                     
+                },
+                "isFilterable": {
+                    "description": "Create a database index for filtering datasets by this field",
+                    "type": "boolean"
                 }
             },
         },
@@ -797,6 +801,12 @@ DATASET_FILTERS_SCHEMA = {
     "additionalProperties": False,
     "$defs": {
         "datasetFilter": {
+            "oneOf": [
+                { "$ref": "#/$defs/columnFilter" },
+                { "$ref": "#/$defs/fieldFilter" }
+            ]
+        },
+        "columnFilter": {
             "type": "object",
             "properties": {
                 "column": {
@@ -813,6 +823,25 @@ DATASET_FILTERS_SCHEMA = {
             },
             "required": ["column", "value", "operator"],
             "additionalProperties": False
+        },
+        "fieldFilter": {
+            "description": "Filter by the value of an observation form field, stored in Dataset.data",
+            "type": "object",
+            "properties": {
+                "field_uuid": {
+                    "type": "string",
+                    "format": "uuid"
+                },
+                "value": {
+                    "type": ["string", "number", "boolean"]
+                },
+                "operator": {
+                    "type": "string",
+                    "enum" : ["=", "!=", "<", "<=", ">", ">=", "startswith", "contains"]
+                },
+            },
+            "required": ["field_uuid", "value", "operator"],
+            "additionalProperties": False
         }
     }
 }
\ No newline at end of file
@@ -0,0 +1,83 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+CHANGE_TRACKING_SQL = '''
+CREATE SEQUENCE IF NOT EXISTS datasets_dataset_change_sequence_seq;
+
+CREATE OR REPLACE FUNCTION datasets_dataset_set_change_sequence() RETURNS trigger AS $$
+BEGIN
+    NEW.change_sequence := nextval('datasets_dataset_change_sequence_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER datasets_dataset_change_sequence_trigger
+    BEFORE INSERT OR UPDATE ON datasets_dataset
+    FOR EACH ROW EXECUTE FUNCTION datasets_dataset_set_change_sequence();
+
+CREATE OR REPLACE FUNCTION datasets_dataset_create_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO datasets_datasettombstone (uuid, app_uuid, user_uuid, client_id, change_sequence, deleted_at)
+    VALUES (OLD.uuid, OLD.app_uuid, OLD.user_id, OLD.client_id,
+        nextval('datasets_dataset_change_sequence_seq'), now());
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER datasets_dataset_tombstone_trigger
+    AFTER DELETE ON datasets_dataset
+    FOR EACH ROW EXECUTE FUNCTION datasets_dataset_create_tombstone();
+'''
+
+REVERSE_CHANGE_TRACKING_SQL = '''
+DROP TRIGGER IF EXISTS datasets_dataset_tombstone_trigger ON datasets_dataset;
+DROP FUNCTION IF EXISTS datasets_dataset_create_tombstone();
+DROP TRIGGER IF EXISTS datasets_dataset_change_sequence_trigger ON datasets_dataset;
+DROP FUNCTION IF EXISTS datasets_dataset_set_change_sequence();
+DROP SEQUENCE IF EXISTS datasets_dataset_change_sequence_seq;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0007_datasetvalidationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='change_sequence',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='DatasetTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField()),
+                ('app_uuid', models.UUIDField()),
+                ('user_uuid', models.UUIDField(null=True)),
+                ('client_id', models.CharField(max_length=255)),
+                ('change_sequence', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['app_uuid', 'change_sequence'], name='tombstone_app_change_seq_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'change_sequence'], name='dataset_app_change_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'user', 'change_sequence'], name='dataset_app_user_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'client_id', 'change_sequence'], name='dataset_app_client_change_idx'),
+        ),
+        migrations.RunSQL(CHANGE_TRACKING_SQL, REVERSE_CHANGE_TRACKING_SQL),
+    ]
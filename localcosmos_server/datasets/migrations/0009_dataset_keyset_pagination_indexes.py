@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0008_dataset_change_sequence_datasettombstone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'id'], name='dataset_app_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'timestamp', 'id'], name='dataset_app_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'taxon_latname', 'id'], name='dataset_app_latname_id_idx'),
+        ),
+    ]
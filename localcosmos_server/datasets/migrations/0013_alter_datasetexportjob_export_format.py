@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0012_alter_datasetexportjob_export_format'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datasetexportjob',
+            name='export_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('parquet', 'Parquet'), ('geojson', 'GeoJSON (newline-delimited)'), ('gpkg', 'GeoPackage')], default='csv', max_length=50),
+        ),
+    ]
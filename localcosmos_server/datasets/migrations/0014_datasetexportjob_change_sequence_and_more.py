@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0013_alter_datasetexportjob_export_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetexportjob',
+            name='change_sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='datasetexportjob',
+            name='export_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('parquet', 'Parquet'), ('geojson', 'GeoJSON (newline-delimited)'), ('gpkg', 'GeoPackage'), ('dwca', 'Darwin Core Archive')], default='csv', max_length=50),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0014_datasetexportjob_change_sequence_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DarwinCoreViewRefresh',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_uuid', models.UUIDField(unique=True)),
+                ('change_sequence', models.BigIntegerField(null=True)),
+                ('refreshed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
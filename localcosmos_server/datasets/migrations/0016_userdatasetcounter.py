@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+USER_DATASET_COUNTER_SQL = '''
+CREATE OR REPLACE FUNCTION datasets_dataset_count_user_datasets() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.user_id IS NOT NULL THEN
+        UPDATE datasets_userdatasetcounter SET dataset_count = dataset_count - 1
+        WHERE user_id = OLD.user_id AND app_uuid = OLD.app_uuid;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+        INSERT INTO datasets_userdatasetcounter (user_id, app_uuid, dataset_count)
+        VALUES (NEW.user_id, NEW.app_uuid, 1)
+        ON CONFLICT (user_id, app_uuid)
+        DO UPDATE SET dataset_count = datasets_userdatasetcounter.dataset_count + 1;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER datasets_dataset_user_counter_trigger
+    AFTER INSERT OR DELETE ON datasets_dataset
+    FOR EACH ROW EXECUTE FUNCTION datasets_dataset_count_user_datasets();
+
+CREATE TRIGGER datasets_dataset_user_counter_update_trigger
+    AFTER UPDATE OF user_id, app_uuid ON datasets_dataset
+    FOR EACH ROW
+    WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id OR OLD.app_uuid IS DISTINCT FROM NEW.app_uuid)
+    EXECUTE FUNCTION datasets_dataset_count_user_datasets();
+
+INSERT INTO datasets_userdatasetcounter (user_id, app_uuid, dataset_count)
+SELECT user_id, app_uuid, COUNT(*) FROM datasets_dataset WHERE user_id IS NOT NULL GROUP BY user_id, app_uuid;
+'''
+
+REVERSE_USER_DATASET_COUNTER_SQL = '''
+DROP TRIGGER IF EXISTS datasets_dataset_user_counter_update_trigger ON datasets_dataset;
+DROP TRIGGER IF EXISTS datasets_dataset_user_counter_trigger ON datasets_dataset;
+DROP FUNCTION IF EXISTS datasets_dataset_count_user_datasets();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0015_darwincoreviewrefresh'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDatasetCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_uuid', models.UUIDField()),
+                ('dataset_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dataset_counters', to=settings.AUTH_USER_MODEL, to_field='uuid')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'app_uuid'), name='unique_user_dataset_counter')],
+            },
+        ),
+        migrations.RunSQL(USER_DATASET_COUNTER_SQL, REVERSE_USER_DATASET_COUNTER_SQL),
+    ]
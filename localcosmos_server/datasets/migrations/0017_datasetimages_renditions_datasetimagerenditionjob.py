@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0016_userdatasetcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetimages',
+            name='renditions',
+            field=models.JSONField(null=True),
+        ),
+        migrations.CreateModel(
+            name='DatasetImageRenditionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='queued', max_length=50)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('dataset_image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendition_jobs', to='datasets.datasetimages')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
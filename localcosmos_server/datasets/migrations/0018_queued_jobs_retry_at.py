@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0017_datasetimages_renditions_datasetimagerenditionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetachievementsjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datasetexportjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datasetimagerenditionjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datasetvalidationjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
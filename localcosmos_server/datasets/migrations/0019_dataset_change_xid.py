@@ -0,0 +1,91 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+CHANGE_TRACKING_SQL = '''
+CREATE OR REPLACE FUNCTION datasets_dataset_set_change_sequence() RETURNS trigger AS $$
+BEGIN
+    NEW.change_sequence := nextval('datasets_dataset_change_sequence_seq');
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION datasets_dataset_create_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO datasets_datasettombstone (uuid, app_uuid, user_uuid, client_id, change_sequence, change_xid,
+        deleted_at)
+    VALUES (OLD.uuid, OLD.app_uuid, OLD.user_id, OLD.client_id,
+        nextval('datasets_dataset_change_sequence_seq'), pg_current_xact_id()::text::bigint, now());
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+UPDATE datasets_dataset SET change_sequence = nextval('datasets_dataset_change_sequence_seq')
+    WHERE change_sequence IS NULL;
+'''
+
+REVERSE_CHANGE_TRACKING_SQL = '''
+CREATE OR REPLACE FUNCTION datasets_dataset_set_change_sequence() RETURNS trigger AS $$
+BEGIN
+    NEW.change_sequence := nextval('datasets_dataset_change_sequence_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION datasets_dataset_create_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO datasets_datasettombstone (uuid, app_uuid, user_uuid, client_id, change_sequence, deleted_at)
+    VALUES (OLD.uuid, OLD.app_uuid, OLD.user_id, OLD.client_id,
+        nextval('datasets_dataset_change_sequence_seq'), now());
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0018_queued_jobs_retry_at'),
+    ]
+
+    operations = [
+        # the existing rows have committed long ago, they receive 0 without rewriting the table
+        migrations.AddField(
+            model_name='dataset',
+            name='change_xid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='datasettombstone',
+            name='change_xid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RemoveIndex(
+            model_name='dataset',
+            name='dataset_app_user_change_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='dataset',
+            name='dataset_app_client_change_idx',
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'user', 'change_xid', 'change_sequence'],
+                name='dataset_app_user_xid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'client_id', 'change_xid', 'change_sequence'],
+                name='dataset_app_client_xid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datasettombstone',
+            index=models.Index(fields=['app_uuid', 'change_xid', 'change_sequence'], name='tombstone_app_xid_idx'),
+        ),
+        # datasets which have been created before 0008 receive their change_sequence from the trigger,
+        # databases which are already tracking changes have no such rows
+        migrations.RunSQL(CHANGE_TRACKING_SQL, REVERSE_CHANGE_TRACKING_SQL),
+    ]
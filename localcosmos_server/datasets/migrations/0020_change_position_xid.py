@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0019_dataset_change_xid'),
+    ]
+
+    operations = [
+        # exports and refreshes without change_xid are not used as the base of incremental archives
+        migrations.AddField(
+            model_name='datasetexportjob',
+            name='change_xid',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='darwincoreviewrefresh',
+            name='change_xid',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RemoveIndex(
+            model_name='dataset',
+            name='dataset_app_change_seq_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='datasettombstone',
+            name='tombstone_app_change_seq_idx',
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'change_xid', 'change_sequence'], name='dataset_app_xid_idx'),
+        ),
+    ]
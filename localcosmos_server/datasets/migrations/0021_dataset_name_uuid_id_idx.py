@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0020_change_position_xid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['app_uuid', 'name_uuid', 'id'], name='dataset_app_name_uuid_id_idx'),
+        ),
+    ]
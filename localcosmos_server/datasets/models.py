@@ -4,16 +4,17 @@ from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db import connection
+from django.db import connection, transaction
 from django.dispatch import receiver
 
-from django.contrib.gis.db.models.functions import Centroid
+from django.contrib.gis.db.models.functions import Centroid, Transform
 
 User = get_user_model()
 
 from django.contrib.gis.geos import GEOSGeometry
 
-from localcosmos_server.models import UserClients, App, TaxonomicRestriction
+from localcosmos_server.models import (UserClients, App, TaxonomicRestriction, QueuedJobAbstract,
+    QueuedJobManager, JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)
 
 from localcosmos_server.taxonomy.generic import ModelWithTaxon
 
@@ -21,11 +22,14 @@ from localcosmos_server.utils import datetime_from_cron
 
 from djangorestframework_camel_case.util import underscoreize
 
-from PIL import Image, ImageOps
+import uuid, json, math, os, shutil
 
-import uuid, json, os, shutil
+from datetime import timedelta
 
 from .json_schemas import OBSERVATION_FORM_SCHEMA
+from .expressions import RowValueComparison
+from localcosmos_server.image_renditions import (create_image_renditions, get_modern_image_formats,
+                                                  get_image_format_quality, MODERN_IMAGE_FORMATS)
 
 
 # a list of usable dataset validation classes
@@ -33,6 +37,11 @@ DATASET_VALIDATION_CLASSPATHS = getattr(settings, 'DATASET_VALIDATION_CLASSES',
 LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED = getattr(settings, 'LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED', False)
 
 
+# if True, creating a dataset only enqueues the awarding of achievements, see DatasetAchievementsJob
+def achievements_are_deferred():
+    return getattr(settings, 'LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS', False) == True
+
+
 def import_module(module):
     module = str(module)
     d = module.rfind(".")
@@ -92,6 +101,114 @@ class MetaData(models.Model):
     data = models.JSONField()
 
 
+class DatasetManager(models.Manager):
+
+    '''
+        insert many datasets of one app in a single transaction
+        - the redundant columns are computed in memory, there is no save() per dataset
+        - if the app has no validation routine, the datasets are marked as valid before the INSERT,
+          which spares one UPDATE per dataset
+        - validation and achievements run after the INSERT, as they do in Dataset.save()
+    '''
+    def bulk_create_datasets(self, app_uuid, datasets, batch_size=None):
+
+        app = App.objects.filter(uuid=app_uuid).first()
+
+        has_validation_routine = False
+        if app:
+            has_validation_routine = DatasetValidationRoutine.objects.filter(app=app).exists()
+
+        for dataset in datasets:
+            dataset.app_uuid = app_uuid
+            dataset.prepare_save()
+
+            if not has_validation_routine:
+                dataset.is_valid = True
+                dataset.is_published = True
+                dataset.validation_step = COMPLETED_VALIDATION_STEP
+
+        async_validation = getattr(settings, 'LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION', False)
+        async_achievements = LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED == True and achievements_are_deferred()
+
+        with transaction.atomic():
+            created_datasets = self.bulk_create(datasets, batch_size=batch_size)
+
+            if has_validation_routine and async_validation == True:
+                validation_jobs = [DatasetValidationJob(dataset=dataset) for dataset in created_datasets]
+                DatasetValidationJob.objects.bulk_create(validation_jobs, batch_size=batch_size)
+
+            if async_achievements == True:
+                achievements_jobs = [DatasetAchievementsJob(dataset=dataset) for dataset in created_datasets
+                                     if dataset.user_id is not None]
+                DatasetAchievementsJob.objects.bulk_create(achievements_jobs, batch_size=batch_size)
+
+        for dataset in created_datasets:
+
+            if has_validation_routine and async_validation == False:
+                dataset.validate()
+
+            if async_achievements == False:
+                dataset.award_achievements(app=app)
+
+        return created_datasets
+
+
+    '''
+        the datasets of an app closest to point, nearest first, within max_distance meters
+        - ST_DWithin bounds the search and ORDER BY coordinates <-> point is answered by the GiST index of
+          Dataset.coordinates (KNN), the query stops after limit rows instead of sorting the table
+        - coordinates are stored in EPSG:3857, where lengths are stretched by 1/cos(latitude). The radius is
+          scaled at the latitude of point, which is accurate for radii of up to some hundred kilometers
+        - taxon_nuid includes the descendants of the taxon
+        - exclude_pk leaves out one dataset, e.g. the dataset whose neighbours are queried
+        - the datasets are annotated with distance, the distance on the sphere in meters
+    '''
+    def nearby(self, point, app_uuid, max_distance, limit=20, taxon_source=None, taxon_nuid=None,
+               name_uuid=None, exclude_pk=None):
+
+        if point.srid != 3857:
+            point = point.transform(3857, clone=True)
+
+        wgs84_point = point.transform(4326, clone=True)
+
+        latitude = max(-MAX_NEARBY_LATITUDE, min(wgs84_point.y, MAX_NEARBY_LATITUDE))
+
+        projected_distance = max_distance / math.cos(math.radians(latitude))
+
+        queryset = self.filter(app_uuid=app_uuid, coordinates__dwithin=(point, projected_distance))
+
+        if taxon_source:
+            queryset = queryset.filter(taxon_source=taxon_source)
+
+        if taxon_nuid:
+            queryset = queryset.filter(taxon_nuid__startswith=taxon_nuid)
+
+        if name_uuid:
+            queryset = queryset.filter(name_uuid=name_uuid)
+
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+
+        queryset = queryset.annotate(
+            distance=models.Func(Transform('coordinates', 4326),
+                models.Value(wgs84_point, output_field=models.PointField(srid=4326)),
+                function='ST_DistanceSphere', output_field=models.FloatField()),
+        ).order_by(KNNDistance('coordinates', models.Value(point, output_field=models.PointField(srid=3857))))
+
+        return queryset[:limit]
+
+
+# the projected radius of nearby() grows without bounds towards the poles
+MAX_NEARBY_LATITUDE = 85
+
+
+# a <-> b, ordering by this expression lets postgis use the GiST index of a
+class KNNDistance(models.Func):
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = models.FloatField()
+
+
 '''
     Dataset
     - datasets have to be validated AFTER being saved, which means going through the validation routine
@@ -152,6 +269,14 @@ class Dataset(ModelWithTaxon):
     created_at = models.DateTimeField(editable=False) # timestamp when the dataset has been created on any of the clients
     last_modified = models.DateTimeField(null=True) # timestamp when the dataset has been alteres on any of the clients
 
+    # server side change counter, set by a database trigger on each insert and update - including queryset updates
+    # offline devices use it as their sync cursor, client timestamps cannot be used for this
+    change_sequence = models.BigIntegerField(null=True, editable=False)
+    # the id of the transaction which has written change_sequence, set by the same trigger. Sequence values are
+    # drawn when the row is written, not when the transaction commits, see get_change_watermark
+    change_xid = models.BigIntegerField(default=0, editable=False)
+
+    objects = DatasetManager()
 
     ###############################################################################################################
     # VALIDATION
@@ -170,36 +295,67 @@ class Dataset(ModelWithTaxon):
             return DatasetValidationRoutine.objects.filter(app=app).order_by('position')
         return []
 
+    # cached, ordered steps including their validator classes and taxonomic restrictions
+    @property
+    def compiled_validation_routine(self):
+        from localcosmos_server.datasets.validation.routine import get_compiled_validation_routine
+        return get_compiled_validation_routine(self.app_uuid)
+
     # validation begins at the index of self.validation_step in the routine
+    # the routine is walked iteratively: automatic validators move the dataset to the next step,
+    # human interaction validators keep the dataset at their step until a reviewer has decided
     def validate(self):
-        validation_routine = self.validation_routine
 
-        if self.validation_step != COMPLETED_VALIDATION_STEP:
+        while self.validation_step != COMPLETED_VALIDATION_STEP:
 
-            if len(validation_routine) > 0:
-
-                if self.validation_step:
-                    current_step = self.current_validation_step
-                    
-                else:
-                    current_step = validation_routine[0]
-                    self.validation_step = current_step.validation_class
-                    self.save()
-                
-                
-                ValidationClass = current_step.get_class()
-                validator = ValidationClass(current_step)
+            validation_routine = self.compiled_validation_routine
 
-                # on is_valid and is_invald, the validator set dataset.validation_step to the next step
-                # and recursively calls dataset.validate()
-                validator.validate(self)
-                
-            else:
+            if len(validation_routine) == 0:
                 self.is_valid = True
                 self.is_published = True
                 self.validation_step = COMPLETED_VALIDATION_STEP
+                self.save_validation_state()
+                break
+
+            if self.validation_step:
+                current_step = self.current_validation_step
+                
+            else:
+                current_step = validation_routine.first_step
+                self.validation_step = current_step.validation_class
+                self.save_validation_state()
+            
+            validator = validation_routine.get_validator(current_step)
+
+            validator.validate(self)
+
+            # the dataset is waiting for human interaction
+            if self.validation_step == current_step.validation_class:
+                break
+
 
-                self.save()
+    # validation only alters the validation columns
+    # a queryset update skips update_redundant_columns() which save() would run for each step
+    def save_validation_state(self):
+        Dataset.objects.filter(pk=self.pk).update(
+            validation_step=self.validation_step,
+            validation_errors=self.validation_errors,
+            is_valid=self.is_valid,
+            is_published=self.is_published,
+        )
+
+
+    # hand the dataset to the validation worker, see management command process_dataset_validation_jobs
+    def enqueue_validation(self):
+        job, created = DatasetValidationJob.objects.get_or_create(dataset=self, status=JOB_STATUS_QUEUED)
+        return job
+
+    # run the validation routine in this process or in the validation worker, according to the settings
+    def schedule_validation(self):
+        if getattr(settings, 'LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION', False) == True:
+            self.enqueue_validation()
+        else:
+            self.validate()
 
     @property
     def current_validation_status(self):
@@ -216,20 +372,28 @@ class Dataset(ModelWithTaxon):
         if not self.validation_step or self.validation_step == COMPLETED_VALIDATION_STEP:
             return None
         
-        validation_routine = self.validation_routine
-        validation_steps = list(validation_routine.values_list('validation_class', flat=True))
-        current_index = validation_steps.index(self.validation_step)
-        current_step = validation_routine[current_index]
-        return current_step
+        return self.compiled_validation_routine.get_step(self.validation_step)
     
 
     '''
     read the data column and update the redundant columns accordingly
     - this might become version specific if DatasetJSON spec or ObservationFormJSON spec change
     '''
-    def update_redundant_columns(self):
+    # the pre-parsed definition of the observation form, shared across datasets of the same form
+    @property
+    def observation_form_index(self):
+        from localcosmos_server.datasets.observation_form_cache import observation_form_cache
 
-        reported_values = self.data
+        if Dataset.observation_form.is_cached(self):
+            observation_form = self.observation_form
+        else:
+            observation_form = observation_form_cache.get_by_id(self.observation_form_id)
+            Dataset.observation_form.field.set_cached_value(self, observation_form)
+
+        return observation_form_cache.get_index(observation_form)
+
+
+    def update_redundant_columns(self):
 
         # never alter the user that is assigned
         # in rare cases the following can happen:
@@ -259,10 +423,23 @@ class Dataset(ModelWithTaxon):
                     if user_browser_client_id != self.client_id:
                         self.client_id = user_browser_client_id
 
-        
+        self.update_reference_columns()
+
+
+    # columns derived from the taxonomic, geographic and temporal reference fields of self.data
+    reference_columns = ['taxon_latname', 'taxon_author', 'taxon_source', 'taxon_include_descendants',
+                         'name_uuid', 'taxon_nuid', 'coordinates', 'geographic_reference', 'timestamp']
+
+    # only reads self.data and the observation form, see the management command backfill_dataset_columns
+    def update_reference_columns(self):
+
+        reported_values = self.data
+
         # update taxon
         # use the provided observation form json
-        taxon_field_uuid = self.observation_form.definition['taxonomicReference']
+        observation_form_index = self.observation_form_index
+
+        taxon_field_uuid = observation_form_index.taxonomic_reference
 
         if taxon_field_uuid in reported_values and type(reported_values[taxon_field_uuid]) == dict:
             taxon_json_camel = reported_values[taxon_field_uuid]
@@ -270,12 +447,22 @@ class Dataset(ModelWithTaxon):
 
             lazy_taxon = self.LazyTaxonClass(**taxon_json)
             self.set_taxon(lazy_taxon) 
+
+        # a missing reference clears the previous values, not via remove_taxon() which saves
+        else:
+            self.taxon = None
+            self.taxon_latname = None
+            self.taxon_author = None
+            self.taxon_source = None
+            self.taxon_include_descendants = False
+            self.taxon_nuid = None
+            self.name_uuid = None
         
         # update coordinates or geographic_reference
         # {"type": "Feature", "geometry": {"crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
         # "type": "Point", "coordinates": [8.703575134277346, 55.84336786584161]}, "properties": {"accuracy": 1}}
         # if it is a point, use coordinates. Otherwise use geographic_reference
-        geographic_reference_field_uuid = self.observation_form.definition['geographicReference']
+        geographic_reference_field_uuid = observation_form_index.geographic_reference
         if geographic_reference_field_uuid in self.data:
 
             reported_value = self.data[geographic_reference_field_uuid]
@@ -300,8 +487,12 @@ class Dataset(ModelWithTaxon):
                 self.geographic_reference = geos_geometry
                 self.coordinates = self.geographic_reference.centroid
 
+        else:
+            self.coordinates = None
+            self.geographic_reference = None
+
         # update temporal reference
-        temporal_reference_field_uuid = self.observation_form.definition['temporalReference']
+        temporal_reference_field_uuid = observation_form_index.temporal_reference
         
         if temporal_reference_field_uuid in self.data:
 
@@ -310,46 +501,42 @@ class Dataset(ModelWithTaxon):
             if reported_value['cron']['type'] == 'timestamp' and reported_value['cron']['format'] == 'unixtime':
                 self.timestamp = datetime_from_cron(reported_value)
 
+        else:
+            self.timestamp = None
 
-    def nearby(self):
 
-        queryset = []
-        if self.coordinates:
-            
-            # City.objects.raw('SELECT id, name, %s as point from myapp_city' % (connection.ops.select % 'point'))
+    # the datasets of the same app closest to this dataset, see DatasetManager.nearby
+    def nearby(self, max_distance=None, limit=20, **filters):
 
-            fields = Dataset._meta.concrete_fields
-            field_names = []
+        if not self.coordinates:
+            return []
 
-            # Relational Fields are not supported
-            for field in fields:
-                if isinstance(field, models.ForeignKey):
-                    #name = field.get_attname_column()[0]
-                    continue
-                if isinstance(field, models.fields.BaseSpatialField):
-                    name = connection.ops.select % field.name
-                else:
-                    name = field.name
+        if max_distance is None:
+            max_distance = getattr(settings, 'LOCALCOSMOS_SERVER_NEARBY_DATASETS_MAX_DISTANCE', 10000)
 
-                field_names.append(name)
+        queryset = Dataset.objects.nearby(self.coordinates, self.app_uuid, max_distance, limit=limit,
+                                          exclude_pk=self.pk, **filters)
 
-            fields_str = ','.join(field_names)
-            fields_str.rstrip(',')
-        
-            queryset = Dataset.objects.raw(
-                '''SELECT {fields}, user_id FROM datasets_dataset WHERE id != %s
-                    ORDER BY coordinates <-> st_setsrid(st_makepoint(%s,%s),3857);'''.format(
-                        fields=fields_str), [self.id, self.coordinates.x, self.coordinates.y])
-            
-        return queryset
+        return list(queryset)
 
+    # DatasetListListSerializer prefetches the first image of each dataset as prefetched_images
+    @property
+    def first_image(self):
+
+        if hasattr(self, 'prefetched_images'):
+            return self.prefetched_images[0] if self.prefetched_images else None
+
+        return DatasetImages.objects.filter(dataset=self).first()
+
+    # the image is not decoded, without a recorded rendition the original is returned
     @property
     def thumbnail(self):
-        image = DatasetImages.objects.filter(dataset=self).first()
+        image = self.first_image
 
         if image:
-            url = image.get_image_url(250, square=True)
-            return url
+            if image.has_rendition(250, square=True):
+                return image.get_rendition_url(250, square=True)
+            return image.image.url
         
         return None
 
@@ -358,13 +545,12 @@ class Dataset(ModelWithTaxon):
         if not self.data:
             raise ValueError('Dataset needs at least some data')
 
-    def save(self, *args, **kwargs):
+    # everything that has to happen before a dataset is written to the database
+    # also used by bulk inserts, which bypass save()
+    def prepare_save(self):
 
-        created = False
-        if not self.pk:
-            if not self.created_at:
-                self.created_at = timezone.now()
-            created = True
+        if not self.pk and not self.created_at:
+            self.created_at = timezone.now()
 
         # validate the JSON
         self.validate_requirements()
@@ -375,23 +561,57 @@ class Dataset(ModelWithTaxon):
         if settings.LOCALCOSMOS_SERVER_PUBLISH_INVALID_DATA == False:
             self.is_published = False
 
+
+    # everything that has to happen after a dataset has been inserted
+    # also used by bulk inserts, which bypass save()
+    def on_created(self, app=None):
+
         # this will run the validator
-        super().save(*args, **kwargs)
+        self.schedule_validation()
 
-        if created == True:
-            self.validate()
-            
-            # make it configurable in settings
-            if LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED == True:
+        self.award_achievements(app=app)
+
+
+    def award_achievements(self, app=None):
 
-                # avoid circular imports by importing the points awarder here, after the dataset is saved and validated
-                # Award achievements only for the initial dataset creation path.
-                from localcosmos_server.achievements.point_calculators.DatasetPointsAwarder import DatasetPointsAwarder
+        # make it configurable in settings
+        if LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED == True:
 
-                if self.user is not None:
+            if achievements_are_deferred():
+                if self.user_id is not None:
+                    DatasetAchievementsJob.objects.get_or_create(dataset=self, status=JOB_STATUS_QUEUED)
+            else:
+                self.award_achievements_now(app=app)
+
+
+    # used by the worker process_achievements_jobs
+    def award_achievements_now(self, app=None):
+
+        if LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED == True:
+
+            # avoid circular imports by importing the points awarder here, after the dataset is saved and validated
+            # Award achievements only for the initial dataset creation path.
+            from localcosmos_server.achievements.point_calculators.DatasetPointsAwarder import DatasetPointsAwarder
+
+            if self.user is not None:
+                if app is None:
                     app = self.get_app()
-                    if app is not None:
-                        DatasetPointsAwarder(app=app).award_points(user=self.user, dataset=self)
+                if app is not None:
+                    DatasetPointsAwarder(app=app).award_points(user=self.user, dataset=self)
+
+
+    def save(self, *args, **kwargs):
+
+        created = False
+        if not self.pk:
+            created = True
+
+        self.prepare_save()
+
+        super().save(*args, **kwargs)
+
+        if created == True:
+            self.on_created()
             
             
     def get_app(self):
@@ -408,6 +628,201 @@ class Dataset(ModelWithTaxon):
     class Meta:
         ordering = ['-pk']
         verbose_name = _('Dataset')
+        indexes = [
+            models.Index(fields=['app_uuid', 'change_xid', 'change_sequence'], name='dataset_app_xid_idx'),
+            # delta sync, see datasets.api.views.DatasetChanges
+            models.Index(fields=['app_uuid', 'user', 'change_xid', 'change_sequence'],
+                name='dataset_app_user_xid_idx'),
+            models.Index(fields=['app_uuid', 'client_id', 'change_xid', 'change_sequence'],
+                name='dataset_app_client_xid_idx'),
+            # keyset pagination, see datasets.api.pagination
+            models.Index(fields=['app_uuid', 'id'], name='dataset_app_id_idx'),
+            models.Index(fields=['app_uuid', 'timestamp', 'id'], name='dataset_app_timestamp_id_idx'),
+            models.Index(fields=['app_uuid', 'taxon_latname', 'id'], name='dataset_app_latname_id_idx'),
+            models.Index(fields=['app_uuid', 'name_uuid', 'id'], name='dataset_app_name_uuid_id_idx'),
+        ]
+
+
+
+class DatasetTombstoneManager(models.Manager):
+
+    # delete the tombstones which are older than the delta sync cursors, see DatasetChanges
+    def prune(self):
+
+        retention_days = getattr(settings, 'LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS', 90)
+        # one more day for the transactions which have been open while a cursor was issued
+        pruned_since = timezone.now() - timedelta(days=retention_days + 1)
+
+        deleted_count, deleted_per_model = self.filter(deleted_at__lt=pruned_since).delete()
+        return deleted_count
+
+
+'''
+    DatasetTombstone
+    - written by a database trigger when a dataset is deleted, see migrations 0008 and 0019
+    - lets offline devices remove datasets which have been deleted on the server or on another device
+    - change_sequence is drawn from the same sequence as Dataset.change_sequence
+    - pruned after LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS by the management command
+      prune_dataset_tombstones, delta sync cursors expire after the same number of days
+'''
+class DatasetTombstone(models.Model):
+
+    uuid = models.UUIDField()
+    app_uuid = models.UUIDField()
+    user_uuid = models.UUIDField(null=True)
+    client_id = models.CharField(max_length=255)
+
+    change_sequence = models.BigIntegerField()
+    change_xid = models.BigIntegerField(default=0)
+    deleted_at = models.DateTimeField()
+
+    objects = DatasetTombstoneManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['app_uuid', 'change_xid', 'change_sequence'], name='tombstone_app_xid_idx'),
+        ]
+
+
+'''
+    Upper bound of the changes which can be read safely, in transaction ids
+    - change_sequence is drawn when a row is written, a long transaction commits its lower sequence values after
+      readers have seen higher ones. Rows are only read if their transaction has committed before the oldest
+      transaction which is still running: change_xid < watermark
+    - the own transaction is included, a transaction reads its own changes
+'''
+def get_change_watermark():
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint, '
+            'pg_current_xact_id_if_assigned()::text::bigint')
+        snapshot_xmin, current_xid = cursor.fetchone()
+
+    if current_xid is not None:
+        return max(snapshot_xmin, current_xid + 1)
+
+    return snapshot_xmin
+
+
+'''
+    (change_xid, change_sequence) of the latest change of an app, including deleted datasets
+    - only changes of committed transactions, see get_change_watermark. All later changes have a higher
+      (change_xid, change_sequence), including the changes of transactions which are still running
+'''
+def get_app_change_position(app_uuid):
+
+    watermark = get_change_watermark()
+
+    positions = [(0, 0)]
+
+    for model in (Dataset, DatasetTombstone):
+        position = model.objects.filter(app_uuid=app_uuid, change_xid__lt=watermark).order_by(
+            '-change_xid', '-change_sequence').values_list('change_xid', 'change_sequence').first()
+
+        if position:
+            positions.append(position)
+
+    return max(positions)
+
+
+class DarwinCoreViewRefreshManager(models.Manager):
+
+    # number of dataset changes which are not yet contained in the materialized view
+    def get_pending_changes(self, app):
+
+        state = self.filter(app_uuid=app.uuid).first()
+
+        if not state:
+            return 0
+
+        changes = RowValueComparison(['change_xid', 'change_sequence'], '>',
+            [state.change_xid or 0, state.change_sequence or 0])
+
+        return Dataset.objects.filter(changes, app_uuid=app.uuid).count() + \
+            DatasetTombstone.objects.filter(changes, app_uuid=app.uuid).count()
+
+
+    def refresh(self, app):
+
+        from .darwin_core_sql import get_darwin_core_materialized_view_refresh_sql
+
+        # changes during the refresh may already be contained, they are refreshed again next time
+        change_xid, change_sequence = get_app_change_position(app.uuid)
+
+        with connection.cursor() as cursor:
+            cursor.execute(get_darwin_core_materialized_view_refresh_sql(app))
+
+        self.update_or_create(app_uuid=app.uuid, defaults={
+            'change_xid': change_xid,
+            'change_sequence': change_sequence,
+            'refreshed_at': timezone.now(),
+        })
+
+
+class UserDatasetCounterManager(models.Manager):
+
+    def get_dataset_count(self, user, app_uuid=None):
+
+        counters = self.filter(user=user)
+        if app_uuid:
+            counters = counters.filter(app_uuid=app_uuid)
+
+        return counters.aggregate(count=models.Sum('dataset_count'))['count'] or 0
+
+    # user uuid -> number of datasets, for lists of users
+    def get_dataset_counts(self, user_uuids, app_uuid=None):
+
+        counters = self.filter(user_id__in=user_uuids)
+        if app_uuid:
+            counters = counters.filter(app_uuid=app_uuid)
+
+        counts = counters.order_by().values('user_id').annotate(count=models.Sum('dataset_count'))
+
+        dataset_counts = {user_uuid: 0 for user_uuid in user_uuids}
+        for row in counts:
+            dataset_counts[row['user_id']] = row['count']
+
+        return dataset_counts
+
+
+'''
+    Number of datasets per user and app
+    - maintained by database triggers on datasets_dataset, see migration 0016: in the transaction of the INSERT,
+      the DELETE or the UPDATE of user_id or app_uuid. This includes bulk_create, bulk_update and
+      queryset.update(), e.g. anonymization and the assignment of anonymous datasets in ManageUserClient
+    - the number of datasets of a user across apps is the sum of the rows of the user
+    - the management command reconcile_user_dataset_counters recomputes the counters
+'''
+class UserDatasetCounter(models.Model):
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, to_field='uuid', related_name='dataset_counters')
+    app_uuid = models.UUIDField()
+
+    dataset_count = models.IntegerField(default=0)
+
+    objects = UserDatasetCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'app_uuid'], name='unique_user_dataset_counter'),
+        ]
+
+
+'''
+    Refresh state of the materialized darwin core view of an app, see darwin_core_sql.py
+    - exists while the materialized view exists, created and deleted by Enable/DisableDarwinCoreView
+    - (change_xid, change_sequence) is the latest change which is contained in the materialized view,
+      see get_app_change_position
+'''
+class DarwinCoreViewRefresh(models.Model):
+
+    app_uuid = models.UUIDField(unique=True)
+
+    change_xid = models.BigIntegerField(null=True)
+    change_sequence = models.BigIntegerField(null=True)
+    refreshed_at = models.DateTimeField(null=True)
+
+    objects = DarwinCoreViewRefreshManager()
 
 
 
@@ -447,6 +862,144 @@ class DatasetValidationRoutine(ModelWithTaxon):
 
 
 
+'''
+    Asynchronous validation
+    - if settings.LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION is True, creating a dataset only enqueues a job
+    - the jobs are processed by the management command process_dataset_validation_jobs
+'''
+class DatasetValidationJob(QueuedJobAbstract):
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='validation_jobs')
+
+    def __str__(self):
+        return 'Validation of {0} ({1})'.format(self.dataset_id, self.status)
+
+
+'''
+    Deferred achievements
+    - if settings.LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS is True, creating a dataset only enqueues a job,
+      the API responds right after the INSERT
+    - the jobs are processed by the management command process_achievements_jobs
+    - retried jobs do not award points twice: UserPoints are unique per rule and dataset
+'''
+class DatasetAchievementsJob(QueuedJobAbstract):
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='achievements_jobs')
+
+    def __str__(self):
+        return 'Achievements for {0} ({1})'.format(self.dataset_id, self.status)
+
+
+DATASET_EXPORT_FORMAT_CHOICES = (
+    ('csv', _('CSV')),
+    ('parquet', _('Parquet')),
+    ('geojson', _('GeoJSON (newline-delimited)')),
+    ('gpkg', _('GeoPackage')),
+    ('dwca', _('Darwin Core Archive')),
+)
+
+
+class DatasetExportJobManager(QueuedJobManager):
+
+    # delete finished, failed and cancelled exports including their files
+    def delete_expired(self):
+
+        retention_days = getattr(settings, 'LOCALCOSMOS_SERVER_DATASET_EXPORT_RETENTION_DAYS', 7)
+        expired_since = timezone.now() - timedelta(days=retention_days)
+
+        expired_jobs = self.filter(finished_at__lt=expired_since).exclude(
+            status__in=[JOB_STATUS_QUEUED, JOB_STATUS_RUNNING])
+
+        for job in expired_jobs:
+            job.delete_file()
+            job.delete()
+
+
+'''
+    Background exports
+    - an export job is created in the app admin, the export file is written by the management command
+      process_dataset_export_jobs, or within the request if LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS is False
+    - each job writes its own file, concurrent exports do not overwrite each other
+    - the file is written under a temporary name and renamed when complete
+    - finished exports are deleted after LOCALCOSMOS_SERVER_DATASET_EXPORT_RETENTION_DAYS
+'''
+class DatasetExportJob(QueuedJobAbstract):
+
+    exports_folder_name = 'exports'
+
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+
+    app_uuid = models.UUIDField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    export_format = models.CharField(max_length=50, choices=DATASET_EXPORT_FORMAT_CHOICES, default='csv')
+    filters = models.JSONField(default=dict, blank=True)
+
+    # scheme and host of the request which created the job, for absolute image urls
+    base_url = models.CharField(max_length=255, null=True, blank=True)
+
+    total_rows = models.IntegerField(null=True, blank=True)
+    rows_processed = models.IntegerField(default=0)
+
+    # the name of the export file inside the exports folder of the app, set when the file is complete
+    filename = models.CharField(max_length=255, null=True, blank=True)
+
+    cancel_requested = models.BooleanField(default=False)
+
+    # (change_xid, change_sequence) of the latest change contained in the export, for incremental exports
+    change_xid = models.BigIntegerField(null=True, blank=True)
+    change_sequence = models.BigIntegerField(null=True, blank=True)
+
+    objects = DatasetExportJobManager()
+
+    def get_app(self):
+        return App.objects.filter(uuid=self.app_uuid).first()
+
+    def get_exports_folder(self, app):
+        return os.path.join(app.media_base_path, self.exports_folder_name)
+
+    def get_filename(self, file_extension):
+        return 'datasets-{0}-{1}.{2}'.format(self.created_at.strftime('%Y%m%d-%H%M%S'), self.uuid.hex[:8],
+            file_extension)
+
+    def get_filepath(self, app, filename=None):
+        if filename is None:
+            filename = self.filename
+        return os.path.join(self.get_exports_folder(app), filename)
+
+    def get_url(self, app):
+        if self.filename:
+            return os.path.join(app.media_base_url, self.exports_folder_name, self.filename)
+        return None
+
+    @property
+    def progress(self):
+        if self.total_rows:
+            return int(min(self.rows_processed, self.total_rows) * 100 / self.total_rows)
+        return 0
+
+    # running jobs stop after their current chunk
+    def request_cancel(self):
+        if self.status == JOB_STATUS_QUEUED:
+            self.cancel_requested = True
+            self.save(update_fields=['cancel_requested'])
+            self.set_cancelled()
+        elif self.status == JOB_STATUS_RUNNING:
+            self.cancel_requested = True
+            self.save(update_fields=['cancel_requested'])
+
+    def delete_file(self):
+        if self.filename:
+            app = self.get_app()
+            if app:
+                filepath = self.get_filepath(app)
+                if os.path.isfile(filepath):
+                    os.remove(filepath)
+
+    def __str__(self):
+        return 'Export {0} ({1})'.format(self.uuid, self.status)
+
+
 # Dataset Images have to be compatible with GenericForms
 # - reference the field uuid
 # - supply 1x 2x 4x image sizes
@@ -473,6 +1026,23 @@ def dataset_image_path(instance, filename):
     return 'datasets/{0}/images/{1}/{2}'.format(str(instance.dataset.uuid), instance.field_uuid, filename)
 
 
+# (size, square) of the resized images which are created when an image is uploaded
+DATASET_IMAGE_RENDITIONS = [(size, False) for size in sorted(IMAGE_SIZES['all'].values(), reverse=True)] + [
+    (250, True)]
+
+
+'''
+    DatasetImages
+    - the resized images (renditions) are created from one decode of the uploaded image, see image_renditions.py
+    - if settings.LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS is True, the upload only enqueues a job,
+      processed by the management command process_dataset_image_rendition_jobs
+    - renditions is the manifest of the resized images which exist:
+      [{'size': 250, 'square': True, 'format': 'JPEG', 'width': 250, 'height': 250, 'bytes': 10422}, ...]
+      urls of recorded renditions are computed without touching the disk,
+      the management command repair_image_renditions reconciles the manifest with the files
+    - the renditions are also saved in modern formats (webp, avif), their entries have the key image_format,
+      see image_renditions.py
+'''
 class DatasetImages(models.Model):
 
     resized_folder_name = 'resized'
@@ -481,6 +1051,8 @@ class DatasetImages(models.Model):
     field_uuid = models.UUIDField()
     image = models.ImageField(max_length=255, upload_to=dataset_image_path)
 
+    renditions = models.JSONField(null=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     @property
@@ -495,23 +1067,22 @@ class DatasetImages(models.Model):
     def app_uuid(self):
         return self.dataset.app_uuid
 
+    # the folder is created by create_image_renditions
     @property
     def resized_folder(self):
-
         folder_path = os.path.dirname(self.image.path)
-        
-        resized_folder = os.path.join(folder_path, self.resized_folder_name)
-        if not os.path.isdir(resized_folder):
-            os.makedirs(resized_folder)
-
-        return resized_folder
+        return os.path.join(folder_path, self.resized_folder_name)
 
 
-    def get_resized_filename(self, size, square=False):
+    # image_format: one of MODERN_IMAGE_FORMATS, None is the format of the original
+    def get_resized_filename(self, size, square=False, image_format=None):
 
         filename = os.path.basename(self.image.path)
         blankname, ext = os.path.splitext(filename)
 
+        if image_format:
+            ext = MODERN_IMAGE_FORMATS[image_format][2]
+
         if square:
             filename = '{0}-{1}-square{2}'.format(blankname, size, ext)
         else:
@@ -519,24 +1090,38 @@ class DatasetImages(models.Model):
         return filename
 
 
-    def get_image_url(self, size, square=False):
+    def has_rendition(self, size, square=False, image_format=None):
 
-        filename = self.get_resized_filename(size, square=square)
+        if self.renditions:
+            for rendition in self.renditions:
+                if (rendition['size'] == size and rendition['square'] == square
+                        and rendition.get('image_format', None) == image_format):
+                    return True
 
-        resized_path = os.path.join(self.resized_folder, filename)
+        return False
 
-        if not os.path.isfile(resized_path):
 
-            max_size = (size, size)
+    def get_resized_path(self, size, square=False, image_format=None):
+        filename = self.get_resized_filename(size, square=square, image_format=image_format)
+        return os.path.join(self.resized_folder, filename)
 
-            image = Image.open(self.image.path)
 
-            if square:
-                image = ImageOps.fit(image, max_size, Image.BICUBIC)
-            else:
-                image.thumbnail(max_size)
+    # the manifest decides which renditions exist, the disk is not checked and the image is not decoded
+    # sizes without a recorded rendition fall back to the original: images uploaded before renditions were
+    # recorded until process_dataset_image_rendition_jobs --missing has run, images whose job has not been
+    # processed yet and sizes which are not in DATASET_IMAGE_RENDITIONS
+    def get_image_url(self, size, square=False):
+
+        if self.has_rendition(size, square=square):
+            return self.get_rendition_url(size, square=square)
 
-            image.save(resized_path, image.format)
+        return self.image.url
+
+
+    # the url of a resized image, without checking or creating the file
+    def get_rendition_url(self, size, square=False, image_format=None):
+
+        filename = self.get_resized_filename(size, square=square, image_format=image_format)
 
         image_url = os.path.join(os.path.dirname(self.image.url), self.resized_folder_name, filename)
 
@@ -549,13 +1134,20 @@ class DatasetImages(models.Model):
         return absolute_url
 
 
-    def image_urls(self, request=None):
+    # the urls are computed from the manifest without touching the disk,
+    # the resized images are created by the upload views or the rendition jobs, see schedule_renditions
+    # sizes without a recorded rendition fall back to the original, see get_image_url
+    # image_format: a modern format, sizes without a recorded rendition in this format fall back to the original
+    def image_urls(self, request=None, image_format=None):
 
         image_urls = {}
         
         for size_name, image_size in IMAGE_SIZES['all'].items():
-            # create the resized image, respecting which side is the longer one
-            image_url = self.get_image_url(image_size)
+            if image_format and self.has_rendition(image_size, image_format=image_format):
+                image_url = self.get_rendition_url(image_size, image_format=image_format)
+            else:
+                image_url = self.get_image_url(image_size)
+
             if request != None:
                 image_url = self.prepend_host(request, image_url)
             image_urls[size_name] = image_url
@@ -563,6 +1155,68 @@ class DatasetImages(models.Model):
         return image_urls 
 
 
+    # the urls of the recorded renditions in modern formats: {image_format: {size_name: url}}
+    def image_format_urls(self, request=None):
+
+        image_format_urls = {}
+
+        for image_format in MODERN_IMAGE_FORMATS.keys():
+
+            image_urls = {}
+
+            for size_name, image_size in IMAGE_SIZES['all'].items():
+                if self.has_rendition(image_size, image_format=image_format):
+                    image_url = self.get_rendition_url(image_size, image_format=image_format)
+
+                    if request != None:
+                        image_url = self.prepend_host(request, image_url)
+                    image_urls[size_name] = image_url
+
+            if image_urls:
+                image_format_urls[image_format] = image_urls
+
+        return image_format_urls
+
+
+    # [(size, square, target_path)] for create_image_renditions
+    def get_rendition_targets(self):
+        return [(size, square, self.get_resized_path(size, square=square))
+            for size, square in DATASET_IMAGE_RENDITIONS]
+
+
+    # keyword arguments of create_image_renditions
+    def get_rendition_options(self):
+        return {
+            'image_formats': get_modern_image_formats(),
+            'quality': get_image_format_quality(),
+        }
+
+
+    # renditions: the manifest entries returned by create_image_renditions
+    def set_renditions(self, renditions):
+
+        self.renditions = renditions
+
+        # bypasses the pre_save receiver, the image has not changed
+        DatasetImages.objects.filter(pk=self.pk).update(renditions=self.renditions)
+
+
+    # decodes the image once for all renditions
+    def create_renditions(self):
+        renditions = create_image_renditions(self.image.path, self.get_rendition_targets(),
+            **self.get_rendition_options())
+        self.set_renditions(renditions)
+
+
+    # called by the upload views
+    def schedule_renditions(self):
+
+        if getattr(settings, 'LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS', False) == True:
+            DatasetImageRenditionJob.objects.create(dataset_image=self)
+        else:
+            self.create_renditions()
+
+
     def __str__(self):
         if self.dataset.taxon_latname:
             return self.dataset.taxon_latname
@@ -611,6 +1265,22 @@ def auto_delete_image_file_on_change(sender, instance, **kwargs):
         if os.path.isdir(old_resized_images_folder):
             shutil.rmtree(old_resized_images_folder)
 
+        instance.renditions = None
+
+
+'''
+    Deferred renditions
+    - if settings.LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS is True, uploading an image only enqueues a job
+    - the jobs are processed by the management command process_dataset_image_rendition_jobs
+    - until the job has been processed, get_image_url creates the renditions on demand
+'''
+class DatasetImageRenditionJob(QueuedJobAbstract):
+
+    dataset_image = models.ForeignKey(DatasetImages, on_delete=models.CASCADE, related_name='rendition_jobs')
+
+    def __str__(self):
+        return 'Renditions of {0} ({1})'.format(self.dataset_image_id, self.status)
+
 '''
     USER Geometry
     max 3 per user
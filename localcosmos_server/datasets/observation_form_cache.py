@@ -0,0 +1,154 @@
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from localcosmos_server.datasets.models import ObservationForm
+from localcosmos_server.datasets.api.observation_form_validators import CompiledObservationForm
+
+from collections import OrderedDict
+
+import threading
+
+'''
+    ObservationForm cache
+    - an ObservationForm never changes for a given (uuid, version), its definition can be kept in memory
+    - ObservationFormIndex is a pre-parsed lookup of the definition: fields by uuid, field classes and
+      the uuids of the reference fields, and the compiled validator of the form
+    - the cache is a bounded LRU, keyed by (schema_name, uuid, version), entries are removed if a form is
+      saved or deleted
+'''
+class ObservationFormIndex:
+
+    def __init__(self, observation_form):
+
+        definition = observation_form.definition
+
+        self.fields = definition['fields']
+        self.fields_by_uuid = {field['uuid']: field for field in self.fields}
+        self.field_classes = {field['uuid']: field['fieldClass'] for field in self.fields}
+
+        self.taxonomic_reference = definition.get('taxonomicReference', None)
+        self.geographic_reference = definition.get('geographicReference', None)
+        self.temporal_reference = definition.get('temporalReference', None)
+
+        self.picture_field_uuids = [field['uuid'] for field in self.fields if field['fieldClass'] == 'PictureField']
+
+        self.definition = definition
+        self._compiled_form = None
+
+    def get_field(self, field_uuid):
+        return self.fields_by_uuid.get(field_uuid, None)
+
+    # compiled on first use, exports only need the lookups
+    @property
+    def compiled_form(self):
+        if self._compiled_form is None:
+            self._compiled_form = CompiledObservationForm(self.definition)
+        return self._compiled_form
+
+
+class ObservationFormCache:
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+
+        # (schema_name, uuid, version) -> (ObservationForm, ObservationFormIndex)
+        self.entries = OrderedDict()
+        # (schema_name, pk) -> (schema_name, uuid, version)
+        self.keys_by_id = {}
+
+    def get_schema_name(self):
+        # on localcosmos.org, django-tenants sets connection.schema_name
+        return getattr(connection, 'schema_name', None)
+
+    def get_cache_key(self, uuid, version):
+        return (self.get_schema_name(), str(uuid), int(version))
+
+    def get_entry(self, cache_key):
+        with self.lock:
+            entry = self.entries.get(cache_key, None)
+            if entry is not None:
+                self.entries.move_to_end(cache_key)
+            return entry
+
+    def add(self, observation_form):
+
+        cache_key = self.get_cache_key(observation_form.uuid, observation_form.version)
+        entry = (observation_form, ObservationFormIndex(observation_form))
+
+        with self.lock:
+            self.entries[cache_key] = entry
+            self.entries.move_to_end(cache_key)
+            self.keys_by_id[(cache_key[0], observation_form.pk)] = cache_key
+
+            while len(self.entries) > self.maxsize:
+                removed_key, removed_entry = self.entries.popitem(last=False)
+                self.keys_by_id.pop((removed_key[0], removed_entry[0].pk), None)
+
+        return entry
+
+    # returns None if the form does not exist, misses are not cached
+    def get(self, uuid, version):
+
+        entry = self.get_entry(self.get_cache_key(uuid, version))
+
+        if entry is None:
+            observation_form = ObservationForm.objects.filter(uuid=uuid, version=version).first()
+            if not observation_form:
+                return None
+            entry = self.add(observation_form)
+
+        return entry[0]
+
+    def get_by_id(self, pk):
+
+        with self.lock:
+            cache_key = self.keys_by_id.get((self.get_schema_name(), pk), None)
+
+        entry = None
+        if cache_key is not None:
+            entry = self.get_entry(cache_key)
+
+        if entry is None:
+            observation_form = ObservationForm.objects.filter(pk=pk).first()
+            if not observation_form:
+                return None
+            entry = self.add(observation_form)
+
+        return entry[0]
+
+    def get_index(self, observation_form):
+
+        entry = self.get_entry(self.get_cache_key(observation_form.uuid, observation_form.version))
+
+        if entry is None:
+            entry = self.add(observation_form)
+
+        return entry[1]
+
+    def remove(self, observation_form):
+
+        cache_key = self.get_cache_key(observation_form.uuid, observation_form.version)
+
+        with self.lock:
+            self.entries.pop(cache_key, None)
+            self.keys_by_id.pop((cache_key[0], observation_form.pk), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_id.clear()
+
+
+observation_form_cache = ObservationFormCache()
+
+
+def get_compiled_observation_form(observation_form):
+    return observation_form_cache.get_index(observation_form).compiled_form
+
+
+@receiver(post_save, sender=ObservationForm)
+@receiver(post_delete, sender=ObservationForm)
+def remove_observation_form_from_cache(sender, instance, **kwargs):
+    observation_form_cache.remove(instance)
@@ -0,0 +1,72 @@
+from localcosmos_server.datasets.dataset_export import TypedDatasetExport
+
+
+# pyarrow is an optional dependency, it is only required for parquet exports
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError('pyarrow is required for parquet exports: pip install localcosmos_server[parquet]') from exc
+
+    return pyarrow
+
+
+'''
+    Export the datasets of an app as parquet
+    - the typed columns, see TypedDatasetExport
+    - each chunk of datasets is written as one row group, memory does not grow with the number of datasets
+'''
+class DatasetParquetExport(TypedDatasetExport):
+
+    file_extension = 'parquet'
+
+    compression = 'snappy'
+
+    def get_arrow_type(self, pyarrow, type_name):
+
+        if type_name == 'timestamp':
+            return pyarrow.timestamp('us', tz='UTC')
+        elif type_name == 'list':
+            return pyarrow.list_(pyarrow.string())
+
+        return getattr(pyarrow, type_name)()
+
+
+    # progress_callback(rows_processed) is called after each row group
+    def write_file(self, filepath, progress_callback=None):
+
+        pyarrow = import_pyarrow()
+
+        columns, fields_by_observation_form = self.get_typed_layout()
+
+        schema = pyarrow.schema([(column_name, self.get_arrow_type(pyarrow, type_name))
+            for column_name, type_name in columns])
+
+        has_picture_fields = self.has_picture_fields(fields_by_observation_form)
+
+        rows_processed = 0
+
+        with pyarrow.parquet.ParquetWriter(filepath, schema, compression=self.compression) as writer:
+
+            for chunk in self.iterate_chunks():
+
+                image_urls_map = {}
+                if has_picture_fields:
+                    image_urls_map = self.get_image_urls_map(chunk)
+
+                column_values = {column_name: [] for column_name, type_name in columns}
+
+                for dataset in chunk:
+                    form_fields = fields_by_observation_form[dataset.observation_form_id]
+                    row = self.get_typed_row(dataset, form_fields, image_urls=image_urls_map.get(dataset.pk, {}))
+
+                    for column_name, type_name in columns:
+                        column_values[column_name].append(self.coerce_value(row.get(column_name), type_name))
+
+                writer.write_table(pyarrow.Table.from_pydict(column_values, schema=schema))
+
+                rows_processed += len(chunk)
+
+                if progress_callback is not None:
+                    progress_callback(rows_processed)
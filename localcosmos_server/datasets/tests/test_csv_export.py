@@ -11,6 +11,8 @@ from localcosmos_server.tests.common import (test_settings, TEST_IMAGE_PATH, TES
 
 from localcosmos_server.datasets.csv_export import DatasetCSVExport
 
+import csv
+
 class TestDatasetCSVExport(WithMedia, WithObservationForm, WithApp, WithUser, TestCase):
     
     def setUp(self):
@@ -66,4 +68,80 @@ class TestDatasetCSVExport(WithMedia, WithObservationForm, WithApp, WithUser, Te
         request = self.get_request()
         exporter = DatasetCSVExport(request, self.app)
         
-        exporter.write_csv()
\ No newline at end of file
+        exporter.write_csv()
+        with open(exporter.filepath, 'r', newline='') as csvfile:
+            rows = list(csv.reader(csvfile, delimiter='|'))
+
+        # header and one row per dataset
+        self.assertEqual(len(rows), 2)
+
+        columns = rows[0]
+        self.assertEqual(columns[:4], ['client_id', 'username', 'name', 'platform'])
+        self.assertEqual(len(columns), len(set(columns)))
+        self.assertEqual(rows[1][0], dataset.client_id)
+
+        for field in observation_form.definition['fields']:
+            if field['fieldClass'] != 'PointJSONField':
+                self.assertIn(field['definition']['label'], columns)
+
+
+    @test_settings
+    def test_stream_csv(self):
+
+        observation_form = self.create_observation_form(
+            observation_form_json=self.observation_form_point_json)
+
+        for i in range(0, 3):
+            self.create_dataset(observation_form=observation_form)
+
+        request = self.get_request()
+        exporter = DatasetCSVExport(request, self.app)
+        exporter.chunk_size = 2
+
+        exporter.write_csv()
+
+        with open(exporter.filepath, 'r', newline='') as csvfile:
+            csv_content = csvfile.read()
+
+        self.assertEqual(''.join(exporter.stream_csv()), csv_content)
+        self.assertEqual(len(csv_content.splitlines()), 4)
+
+        url = reverse('datasets:stream_datasets_csv', kwargs={'app_uid': self.app.uid})
+        self.assertEqual(url, '/app-admin/{0}/datasets/csv/stream/'.format(self.app.uid))
+
+
+    @test_settings
+    def test_image_urls(self):
+
+        observation_form = self.create_observation_form(
+            observation_form_json=self.observation_form_point_json)
+
+        image_field_uuid = self.get_image_field_uuid(observation_form)
+        image_label = [field['definition']['label'] for field in observation_form.definition['fields']
+                       if field['uuid'] == image_field_uuid][0]
+
+        dataset = self.create_dataset(observation_form=observation_form)
+        dataset_image = self.create_dataset_image(dataset)
+
+        # a dataset without images must not list the images of other datasets
+        dataset_2 = self.create_dataset(observation_form=observation_form)
+
+        request = self.get_request()
+        exporter = DatasetCSVExport(request, self.app)
+
+        rows = list(exporter.iterate_rows())
+        image_column = rows[0].index(image_label)
+
+        # newest first
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][image_column], None)
+        self.assertTrue(rows[2][image_column].endswith(dataset_image.image.url))
+
+        # layout, datasets and images, independent of the number of datasets
+        for i in range(0, 3):
+            self.create_dataset_image(self.create_dataset(observation_form=observation_form))
+
+        with self.assertNumQueries(3):
+            rows = list(exporter.iterate_rows())
+
+        self.assertEqual(len(rows), 6)
@@ -0,0 +1,154 @@
+from django.test import TestCase
+from django.test import RequestFactory
+from django.urls import reverse
+
+from localcosmos_server.tests.mixins import WithUser, WithApp, WithMedia, WithObservationForm
+
+from localcosmos_server.tests.common import test_settings
+
+from localcosmos_server.datasets.models import Dataset
+from localcosmos_server.datasets.geo_export import (DatasetGeoJSONExport, DatasetGeoPackageExport,
+    GEOPACKAGE_APPLICATION_ID)
+
+import json, os, sqlite3
+
+
+class WithGeoExport(WithMedia, WithObservationForm, WithApp, WithUser):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def get_request(self):
+        url_kwargs = {
+            'app_uid': self.app.uid,
+        }
+        url = reverse('datasets:create_download_datasets_csv', kwargs=url_kwargs)
+        return self.factory.get(url)
+
+    def get_filepath(self, exporter):
+        exports_dir = os.path.join(self.app.media_base_path, 'exports')
+        os.makedirs(exports_dir, exist_ok=True)
+        return os.path.join(exports_dir, 'datasets.{0}'.format(exporter.file_extension))
+
+    def create_datasets(self, count=3):
+        observation_form = self.create_observation_form(
+            observation_form_json=self.observation_form_point_json)
+
+        return [self.create_dataset(observation_form=observation_form) for i in range(0, count)]
+
+
+class TestDatasetGeoJSONExport(WithGeoExport, TestCase):
+
+    @test_settings
+    def test_write_file(self):
+
+        datasets = self.create_datasets()
+
+        exporter = DatasetGeoJSONExport(self.get_request(), self.app)
+        exporter.chunk_size = 2
+
+        progress = []
+        filepath = self.get_filepath(exporter)
+        exporter.write_file(filepath, progress_callback=progress.append)
+
+        self.assertEqual(progress, [2, 3])
+
+        with open(filepath, 'r') as geojson_file:
+            features = [json.loads(line) for line in geojson_file]
+
+        self.assertEqual(len(features), 3)
+
+        # newest first
+        feature = features[0]
+        self.assertEqual(feature['type'], 'Feature')
+        self.assertEqual(feature['geometry']['type'], 'Point')
+        self.assertEqual(feature['properties']['uuid'], str(datasets[-1].uuid))
+
+        longitude, latitude = feature['geometry']['coordinates']
+        self.assertAlmostEqual(longitude, feature['properties']['longitude'], places=5)
+        self.assertAlmostEqual(latitude, feature['properties']['latitude'], places=5)
+
+
+    @test_settings
+    def test_stream_geojson(self):
+
+        self.create_datasets(count=2)
+
+        exporter = DatasetGeoJSONExport(self.get_request(), self.app)
+        lines = list(exporter.stream_geojson())
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith('\n'))
+
+        url = reverse('datasets:stream_datasets_geojson', kwargs={'app_uid': self.app.uid})
+        self.assertEqual(url, '/app-admin/{0}/datasets/geojson/stream/'.format(self.app.uid))
+
+
+    @test_settings
+    def test_invalid_numbers(self):
+
+        dataset = self.create_datasets(count=1)[0]
+
+        integer_field_uuid = '1b35044c-2f26-4d92-85ff-b56a667a1741'
+        decimal_field_uuid = 'a3217a33-4c76-4d34-befd-d2f5195d1d66'
+
+        # values reported by old app versions are not validated again
+        dataset.data[integer_field_uuid] = 'many'
+        dataset.data[decimal_field_uuid] = {'value': 1}
+        Dataset.objects.filter(pk=dataset.pk).update(data=dataset.data)
+
+        exporter = DatasetGeoJSONExport(self.get_request(), self.app)
+        feature = json.loads(list(exporter.stream_geojson())[0])
+
+        self.assertIsNone(feature['properties']['Integer'])
+        self.assertIsNone(feature['properties']['Dezifest'])
+
+        self.assertEqual(exporter.typed_IntegerField('12'), 12)
+        self.assertEqual(exporter.typed_DecimalField('1.5'), 1.5)
+
+
+    @test_settings
+    def test_typed_BooleanField(self):
+
+        exporter = DatasetGeoJSONExport(self.get_request(), self.app)
+
+        for value in [True, 'true', 'True', '1', 1]:
+            self.assertIs(exporter.typed_BooleanField(value), True)
+
+        for value in [False, 'false', 'FALSE', '0', 0]:
+            self.assertIs(exporter.typed_BooleanField(value), False)
+
+        for value in [None, '', 'yes', 2, 1.5, [], {'value': True}]:
+            self.assertIsNone(exporter.typed_BooleanField(value))
+
+
+class TestDatasetGeoPackageExport(WithGeoExport, TestCase):
+
+    @test_settings
+    def test_write_file(self):
+
+        datasets = self.create_datasets()
+
+        exporter = DatasetGeoPackageExport(self.get_request(), self.app)
+        exporter.chunk_size = 2
+
+        filepath = self.get_filepath(exporter)
+        exporter.write_file(filepath)
+
+        connection = sqlite3.connect(filepath)
+
+        try:
+            self.assertEqual(connection.execute('PRAGMA application_id').fetchone()[0], GEOPACKAGE_APPLICATION_ID)
+
+            contents = connection.execute('SELECT table_name, data_type, srs_id FROM gpkg_contents').fetchall()
+            self.assertEqual(contents, [('observations', 'features', 4326)])
+
+            rows = connection.execute('SELECT geom, uuid FROM observations ORDER BY fid').fetchall()
+        finally:
+            connection.close()
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][1], str(datasets[-1].uuid))
+        # GeoPackage binary header followed by WKB
+        self.assertEqual(rows[0][0][:2], b'GP')
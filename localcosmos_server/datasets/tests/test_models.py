@@ -31,6 +31,11 @@ from localcosmos_server.utils import timestamp_from_utc_with_offset
 
 from PIL import Image
 
+from django.test import override_settings
+from localcosmos_server.datasets.models import DatasetImageRenditionJob, DATASET_IMAGE_RENDITIONS
+
+from unittest import mock
+
 import uuid, os, json
 
 
@@ -39,6 +44,15 @@ database_srid = SpatialReference(3857)
 trans_4326_to_3857 = CoordTransform(mercator_srid, database_srid)
 
 
+TEST_TAXON_KWARGS = {
+    "taxon_source": "taxonomy.sources.col",
+    "name_uuid": "eb53f49f-1f80-4505-9d56-74216ac4e548",
+    "taxon_nuid": "006002009001005001001",
+    "taxon_latname": "Abies alba",
+    "taxon_author" : "Linnaeus",
+}
+
+
 # add all available validation routines,no taxonomic restricitons
 class WithValidationRoutine:
 
@@ -404,6 +418,9 @@ class TestDataset(WithValidationRoutine, WithObservationForm, WithApp, WithUser,
         self.assertEqual(nearby_dataset.pk, dataset_2.pk)
         self.assertEqual(nearby_dataset.user, user)
 
+        dataset.coordinates = None
+        self.assertEqual(dataset.nearby(), [])
+
 
     @test_settings
     def test_validate_requirements(self):
@@ -483,14 +500,30 @@ class TestDatasetWithMedia(WithMedia, WithObservationForm, WithApp, WithUser, Te
 
         dataset_image.save()
 
+        # the original until the renditions have been created
+        thumbnail = dataset.thumbnail
+        self.assertEqual(thumbnail, dataset_image.image.url)
+
+        dataset_image.create_renditions()
+
         thumbnail = dataset.thumbnail
         self.assertTrue(thumbnail.endswith('.jpg'))
 
         sized_url = dataset_image.get_image_url(250, square=True)
+        self.assertEqual(thumbnail, sized_url)
         sized = sized_url.replace('/media/', '')
         path = os.path.join(settings.MEDIA_ROOT, sized)
         image = Image.open(path)
         self.assertEqual(image.size, (250, 250))
+
+        # the prefetched first image of DatasetListListSerializer is used without a query
+        dataset_image.refresh_from_db()
+        dataset.prefetched_images = [dataset_image]
+        with self.assertNumQueries(0):
+            self.assertEqual(dataset.thumbnail, sized_url)
+
+        dataset.prefetched_images = []
+        self.assertEqual(dataset.thumbnail, None)
     
 
 class TestDatasetValidationRoutine(WithValidationRoutine, WithApp, TestCase):
@@ -543,6 +576,175 @@ class TestDatasetValidationRoutine(WithValidationRoutine, WithApp, TestCase):
         
         
 
+from localcosmos_server.datasets.validation.routine import (get_compiled_validation_routine,
+    clear_compiled_validation_routines)
+
+class TestCompiledValidationRoutine(WithValidationRoutine, WithApp, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        clear_compiled_validation_routines()
+
+    @test_settings
+    def test_get_compiled_validation_routine(self):
+
+        self.create_validation_routine()
+
+        compiled_routine = get_compiled_validation_routine(self.app.uuid)
+
+        steps = list(DatasetValidationRoutine.objects.filter(app=self.app).order_by('position'))
+        self.assertEqual(compiled_routine.steps, steps)
+        self.assertEqual(compiled_routine.first_step, steps[0])
+
+        for index, step in enumerate(steps):
+            self.assertEqual(compiled_routine.get_step(step.validation_class), step)
+
+            next_validation_step = compiled_routine.get_next_validation_step(step.validation_class)
+            if index + 1 < len(steps):
+                self.assertEqual(next_validation_step, steps[index+1].validation_class)
+            else:
+                self.assertEqual(next_validation_step, 'completed')
+
+        # cached
+        with self.assertNumQueries(0):
+            cached_routine = get_compiled_validation_routine(self.app.uuid)
+            for step in cached_routine:
+                list(step.taxonomic_restrictions.all())
+
+        self.assertEqual(cached_routine, compiled_routine)
+
+
+    @test_settings
+    def test_invalidation(self):
+
+        compiled_routine = get_compiled_validation_routine(self.app.uuid)
+        self.assertEqual(len(compiled_routine), 0)
+
+        self.create_validation_routine()
+
+        compiled_routine = get_compiled_validation_routine(self.app.uuid)
+        self.assertEqual(len(compiled_routine), len(DATASET_VALIDATION_CHOICES))
+
+        step = compiled_routine.first_step
+
+        restriction = TaxonomicRestriction(
+            taxon = LazyAppTaxon(**TEST_TAXON_KWARGS),
+            content_type = ContentType.objects.get_for_model(step),
+            object_id = step.id,
+        )
+        restriction.save()
+
+        compiled_routine = get_compiled_validation_routine(self.app.uuid)
+        self.assertEqual(len(compiled_routine.first_step.taxonomic_restrictions.all()), 1)
+
+        DatasetValidationRoutine.objects.get(pk=step.pk).delete()
+
+        compiled_routine = get_compiled_validation_routine(self.app.uuid)
+        self.assertEqual(len(compiled_routine), len(DATASET_VALIDATION_CHOICES) - 1)
+
+
+from localcosmos_server.datasets.observation_form_cache import observation_form_cache, get_compiled_observation_form
+
+class TestObservationFormCache(WithObservationForm, WithApp, WithUser, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        observation_form_cache.clear()
+
+    @test_settings
+    def test_get(self):
+
+        observation_form = self.create_observation_form()
+
+        cached_form = observation_form_cache.get(observation_form.uuid, observation_form.version)
+        self.assertEqual(cached_form, observation_form)
+
+        with self.assertNumQueries(0):
+            cached_form = observation_form_cache.get(str(observation_form.uuid), observation_form.version)
+            cached_form_by_id = observation_form_cache.get_by_id(observation_form.pk)
+
+        self.assertEqual(cached_form, observation_form)
+        self.assertEqual(cached_form_by_id, observation_form)
+
+        self.assertEqual(observation_form_cache.get(uuid.uuid4(), 1), None)
+
+
+    @test_settings
+    def test_get_index(self):
+
+        observation_form = self.create_observation_form()
+        definition = observation_form.definition
+
+        index = observation_form_cache.get_index(observation_form)
+
+        self.assertEqual(index.taxonomic_reference, definition['taxonomicReference'])
+        self.assertEqual(index.geographic_reference, definition['geographicReference'])
+        self.assertEqual(index.temporal_reference, definition['temporalReference'])
+
+        for field in definition['fields']:
+            self.assertEqual(index.get_field(field['uuid']), field)
+            self.assertEqual(index.field_classes[field['uuid']], field['fieldClass'])
+
+
+    @test_settings
+    def test_dataset_observation_form_index(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset = Dataset.objects.get(pk=dataset.pk)
+        index = dataset.observation_form_index
+        self.assertEqual(index, observation_form_cache.get_index(observation_form))
+
+        # datasets of the same form share the cached definition
+        dataset = Dataset.objects.get(pk=dataset.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(dataset.observation_form_index, index)
+            self.assertEqual(dataset.observation_form, observation_form)
+
+
+    @test_settings
+    def test_invalidation(self):
+
+        observation_form = self.create_observation_form()
+        index = observation_form_cache.get_index(observation_form)
+
+        observation_form.save()
+        self.assertFalse(observation_form_cache.get_index(observation_form) is index)
+
+        index = observation_form_cache.get_index(observation_form)
+
+        observation_form.delete()
+        self.assertEqual(observation_form_cache.get(observation_form.uuid, observation_form.version), None)
+
+
+    @test_settings
+    def test_compiled_form(self):
+
+        observation_form = self.create_observation_form()
+
+        compiled_form = get_compiled_observation_form(observation_form)
+        self.assertTrue(compiled_form is observation_form_cache.get_index(observation_form).compiled_form)
+        self.assertTrue(get_compiled_observation_form(observation_form) is compiled_form)
+
+        # a saved form is compiled again
+        observation_form.save()
+        self.assertFalse(get_compiled_observation_form(observation_form) is compiled_form)
+
+
+    @test_settings
+    def test_tenants(self):
+
+        observation_form = self.create_observation_form()
+        index = observation_form_cache.get_index(observation_form)
+
+        # the same (uuid, version) in another schema is a different form
+        with mock.patch.object(observation_form_cache, 'get_schema_name', return_value='other_tenant'):
+            self.assertFalse(observation_form_cache.get_index(observation_form) is index)
+
+        self.assertTrue(observation_form_cache.get_index(observation_form) is index)
+
+
 class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestCase):
 
     test_image_filename = 'test_image.jpg'
@@ -581,10 +783,14 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
         dataset_image = self.create_dataset_image(dataset)
 
         folder = dataset_image.resized_folder
-        self.assertTrue(os.path.isdir(folder))
-
         self.assertTrue(folder.startswith(settings.MEDIA_ROOT))
 
+        # the folder is created with the renditions, not on access
+        self.assertFalse(os.path.isdir(folder))
+
+        dataset_image.create_renditions()
+        self.assertTrue(os.path.isdir(folder))
+
         
 
     @test_settings
@@ -614,6 +820,14 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
         dataset = self.create_dataset(observation_form=observation_form)
         dataset_image = self.create_dataset_image(dataset, image_path=LARGE_TEST_IMAGE_PATH)
 
+        # the image is not decoded when a url is requested
+        with mock.patch('localcosmos_server.datasets.models.create_image_renditions') as create_image_renditions:
+            self.assertEqual(dataset_image.get_image_url(250), dataset_image.image.url)
+            self.assertEqual(dataset_image.get_image_url(250, square=True), dataset_image.image.url)
+            create_image_renditions.assert_not_called()
+
+        dataset_image.create_renditions()
+
         for size in [250, 500]:
 
             sized_url = dataset_image.get_image_url(size)
@@ -630,6 +844,14 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
             square_image = Image.open(path)
             self.assertEqual(square_image.size, (size, size))
 
+        # recorded renditions are served without touching the disk
+        with mock.patch('localcosmos_server.datasets.models.os.path.isfile') as isfile:
+            with mock.patch('localcosmos_server.datasets.models.os.path.isdir') as isdir:
+                dataset_image.get_image_url(250)
+                dataset_image.image_urls()
+                isfile.assert_not_called()
+                isdir.assert_not_called()
+
 
 
     @test_settings
@@ -645,6 +867,121 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
             self.assertIn(size_name, image_urls)
 
 
+    @test_settings
+    def test_create_renditions(self):
+
+        observation_form=self.create_observation_form()
+        dataset = self.create_dataset(observation_form=observation_form)
+        dataset_image = self.create_dataset_image(dataset, image_path=LARGE_TEST_IMAGE_PATH)
+
+        self.assertIsNone(dataset_image.renditions)
+
+        dataset_image.create_renditions()
+
+        dataset_image.refresh_from_db()
+
+        # the renditions in modern formats are recorded next to the originals
+        originals = [rendition for rendition in dataset_image.renditions if 'image_format' not in rendition]
+        self.assertEqual(len(originals), len(DATASET_IMAGE_RENDITIONS))
+
+        original = Image.open(dataset_image.image.path)
+
+        for size, square in DATASET_IMAGE_RENDITIONS:
+
+            self.assertTrue(dataset_image.has_rendition(size, square=square))
+
+            image = Image.open(dataset_image.get_resized_path(size, square=square))
+            self.assertEqual(image.format, original.format)
+
+            if square == True:
+                self.assertEqual(image.size, (size, size))
+            else:
+                self.assertEqual(max(image.size), min(size, max(original.size)))
+
+        # recorded renditions are not created again
+        with mock.patch('localcosmos_server.datasets.models.create_image_renditions') as create_image_renditions:
+            dataset_image.image_urls()
+            dataset.thumbnail
+            create_image_renditions.assert_not_called()
+
+
+    @test_settings
+    def test_image_urls_without_renditions(self):
+
+        observation_form=self.create_observation_form()
+        dataset = self.create_dataset(observation_form=observation_form)
+        dataset_image = self.create_dataset_image(dataset, image_path=LARGE_TEST_IMAGE_PATH)
+
+        self.assertIsNone(dataset_image.renditions)
+
+        # no urls of resized images which do not exist
+        image_urls = dataset_image.image_urls()
+
+        for size_name, image_size in IMAGE_SIZES['all'].items():
+            self.assertEqual(image_urls[size_name], dataset_image.image.url)
+
+        dataset_image.create_renditions()
+
+        image_urls = dataset_image.image_urls()
+
+        for size_name, image_size in IMAGE_SIZES['all'].items():
+            self.assertEqual(image_urls[size_name], dataset_image.get_rendition_url(image_size))
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS=['webp'])
+    def test_create_renditions_image_formats(self):
+
+        observation_form=self.create_observation_form()
+        dataset = self.create_dataset(observation_form=observation_form)
+        dataset_image = self.create_dataset_image(dataset, image_path=LARGE_TEST_IMAGE_PATH)
+
+        dataset_image.create_renditions()
+
+        dataset_image.refresh_from_db()
+        self.assertEqual(len(dataset_image.renditions), 2 * len(DATASET_IMAGE_RENDITIONS))
+
+        for size, square in DATASET_IMAGE_RENDITIONS:
+
+            self.assertTrue(dataset_image.has_rendition(size, square=square, image_format='webp'))
+
+            image = Image.open(dataset_image.get_resized_path(size, square=square, image_format='webp'))
+            self.assertEqual(image.format, 'WEBP')
+
+            original_image = Image.open(dataset_image.get_resized_path(size, square=square))
+            self.assertEqual(image.size, original_image.size)
+
+        image_urls = dataset_image.image_urls(image_format='webp')
+        image_format_urls = dataset_image.image_format_urls()
+
+        self.assertEqual(image_format_urls, {'webp': image_urls})
+
+        for size_name, image_url in image_urls.items():
+            self.assertTrue(image_url.endswith('.webp'))
+
+        # without modern renditions the urls of the originals are returned
+        dataset_image.set_renditions([rendition for rendition in dataset_image.renditions
+            if 'image_format' not in rendition])
+
+        self.assertEqual(dataset_image.image_urls(image_format='webp'),
+            dataset_image.image_urls())
+        self.assertEqual(dataset_image.image_format_urls(), {})
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS=True)
+    def test_schedule_renditions(self):
+
+        observation_form=self.create_observation_form()
+        dataset = self.create_dataset(observation_form=observation_form)
+        dataset_image = self.create_dataset_image(dataset, image_path=LARGE_TEST_IMAGE_PATH)
+
+        dataset_image.schedule_renditions()
+
+        self.assertIsNone(dataset_image.renditions)
+        self.assertTrue(DatasetImageRenditionJob.objects.filter(dataset_image=dataset_image).exists())
+
+
     @test_settings
     def test_str(self):
 
@@ -668,7 +1005,7 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
 
         self.assertEqual(image_text, 'Picea abies')
 
-        image_urls = dataset_image.image_urls()
+        dataset_image.create_renditions()
 
         image_path = dataset_image.image.path
         self.assertTrue(os.path.isfile(image_path))
@@ -697,7 +1034,7 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
 
         self.assertTrue(os.path.isfile(image_path))
 
-        image_urls = dataset_image.image_urls()
+        dataset_image.create_renditions()
         self.assertTrue(os.path.isdir(thumbnails_folder))
 
         # change the image
@@ -709,7 +1046,47 @@ class TestDatasetImages(WithObservationForm, WithApp, WithUser, WithMedia, TestC
 
         self.assertFalse(os.path.isfile(image_path))
         self.assertFalse(os.path.isdir(thumbnails_folder))
+        self.assertIsNone(dataset_image.renditions)
+
+
+
+from localcosmos_server.datasets.models import UserDatasetCounter
+
+class TestUserDatasetCounter(WithObservationForm, WithApp, WithUser, TestCase):
+
+    @test_settings
+    def test_counters(self):
+
+        user = self.create_user()
+        observation_form = self.create_observation_form()
+
+        self.assertEqual(user.dataset_count(), 0)
+
+        dataset = self.create_dataset(observation_form, user=user)
+        dataset_2 = self.create_dataset(observation_form, user=user)
+        anonymous_dataset = self.create_dataset(observation_form)
+
+        self.assertEqual(user.dataset_count(), 2)
+        self.assertEqual(user.dataset_count(app_uuid=self.app.uuid), 2)
+        self.assertEqual(user.dataset_count(app_uuid=uuid.uuid4()), 0)
+
+        # reassignment, e.g. ManageUserClient.update_datasets
+        anonymous_dataset.user = user
+        anonymous_dataset.save()
+        self.assertEqual(user.dataset_count(), 3)
+
+        # saving without changing the user does not count twice
+        dataset.save()
+        self.assertEqual(user.dataset_count(), 3)
+
+        dataset_2.delete()
+        self.assertEqual(user.dataset_count(), 2)
+
+        user.anonymize_datasets()
+        self.assertEqual(user.dataset_count(), 0)
 
+        counts = UserDatasetCounter.objects.get_dataset_counts([user.uuid])
+        self.assertEqual(counts, {user.uuid: 0})
 
 
 class TestUserGeometry(WithUser, TestCase):
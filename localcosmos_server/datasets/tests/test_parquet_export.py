@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.test import RequestFactory
+from django.urls import reverse
+
+from localcosmos_server.tests.mixins import WithUser, WithApp, WithMedia, WithObservationForm
+
+from localcosmos_server.tests.common import test_settings
+
+from localcosmos_server.datasets.parquet_export import DatasetParquetExport
+
+import os, unittest
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestDatasetParquetExport(WithMedia, WithObservationForm, WithApp, WithUser, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def get_request(self):
+        url_kwargs = {
+            'app_uid': self.app.uid,
+        }
+        url = reverse('datasets:create_download_datasets_csv', kwargs=url_kwargs)
+        request = self.factory.get(url, {'format': 'parquet'})
+        return request
+
+
+    @test_settings
+    def test_write_file(self):
+
+        observation_form = self.create_observation_form(
+            observation_form_json=self.observation_form_point_json)
+
+        for i in range(0, 3):
+            self.create_dataset(observation_form=observation_form)
+
+        request = self.get_request()
+        exporter = DatasetParquetExport(request, self.app)
+        exporter.chunk_size = 2
+
+        progress = []
+
+        exports_dir = os.path.join(self.app.media_base_path, 'exports')
+        os.makedirs(exports_dir, exist_ok=True)
+        filepath = os.path.join(exports_dir, 'datasets.parquet')
+        exporter.write_file(filepath, progress_callback=progress.append)
+
+        self.assertEqual(progress, [2, 3])
+
+        parquet_file = pyarrow.parquet.ParquetFile(filepath)
+
+        # one row group per chunk
+        self.assertEqual(parquet_file.metadata.num_rows, 3)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+
+        schema = parquet_file.schema_arrow
+        self.assertTrue(pyarrow.types.is_timestamp(schema.field('timestamp').type))
+        self.assertTrue(pyarrow.types.is_floating(schema.field('longitude').type))
+        self.assertTrue(pyarrow.types.is_floating(schema.field('latitude').type))
+
+        for field in observation_form.definition['fields']:
+            if field['fieldClass'] == 'PictureField':
+                column_type = schema.field(field['definition']['label']).type
+                self.assertTrue(pyarrow.types.is_list(column_type))
+
+        # analytic readers only read the columns they need
+        table = pyarrow.parquet.read_table(filepath, columns=['uuid', 'latitude'])
+        self.assertEqual(table.num_columns, 2)
+        self.assertIsNotNone(table.column('latitude')[0].as_py())
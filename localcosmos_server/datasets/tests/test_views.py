@@ -1,6 +1,7 @@
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
 from django.conf import settings
+from django.test import override_settings
 
 from localcosmos_server.datasets.views import (ListDatasets, HumanInteractionValidationView, EditDataset,
             AjaxSaveDataset, AjaxLoadFormFieldImages, LargeModalImage, ShowDatasetValidationRoutine,
@@ -13,7 +14,10 @@ from localcosmos_server.tests.mixins import (WithObservationForm, WithApp, WithU
 
 from localcosmos_server.tests.common import test_settings, DataCreator
 
-from localcosmos_server.datasets.models import DatasetValidationRoutine
+from localcosmos_server.datasets.models import DatasetValidationRoutine, DatasetExportJob
+from localcosmos_server.models import JOB_STATUS_FINISHED, JOB_STATUS_QUEUED, JOB_STATUS_CANCELLED
+
+from unittest import mock
 
 import os, json
 
@@ -39,6 +43,10 @@ class TestListDatasets(CommonSetUp, WithObservationForm, WithUser, WithApp, Test
 
         self.assertEqual(len(context['datasets']), 1)
 
+        with mock.patch('localcosmos_server.datasets.export_jobs.find_spec', return_value=None):
+            context = view.get_context_data()
+            self.assertFalse(context['parquet_export_available'])
+
 
 class TestHumanInteractionValidationView(CommonSetUp, WithValidationRoutine, WithObservationForm, WithUser,
                                          WithApp, TestCase):
@@ -1008,4 +1016,102 @@ class TestDownloadDatasetsCSV(CommonSetUp, WithObservationForm, WithUser, WithAp
         self.assertEqual(response.status_code, 200)
 
         #self.assertTrue(os.path.isfile(response['X-Sendfile']))
+
+
+    @test_settings
+    def test_get_job(self):
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+
+        url_kwargs = {
+            'app_uid' : self.app.uid,
+        }
+        url = reverse('datasets:download_datasets_csv', kwargs=url_kwargs)
+        response = self.client.get(url, {'job': str(job.uuid)}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['job'], job)
+        self.assertFalse(response.context['ready'])
+        self.assertIsNone(response.context['csv_url'])
+
+
+class TestCreateDownloadDatasetsCSV(CommonSetUp, WithObservationForm, WithUser, WithApp, WithMedia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.observation_form = self.create_observation_form()
+        self.dataset = self.create_dataset(self.observation_form)
+
+    @test_settings
+    def test_get(self):
+
+        url_kwargs = {
+            'app_uid' : self.app.uid,
+        }
+        url = reverse('datasets:create_download_datasets_csv', kwargs=url_kwargs)
+        response = self.client.get(url, {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+
+        job = DatasetExportJob.objects.get(app_uuid=self.app.uuid)
+        self.assertEqual(job.status, JOB_STATUS_FINISHED)
+        self.assertTrue(response.context['ready'])
+        self.assertEqual(response.context['csv_url'], job.get_url(self.app))
+        self.assertTrue(os.path.isfile(job.get_filepath(self.app)))
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS=True)
+    def test_get_async(self):
+
+        url_kwargs = {
+            'app_uid' : self.app.uid,
+        }
+        url = reverse('datasets:create_download_datasets_csv', kwargs=url_kwargs)
+        response = self.client.get(url, {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+
+        job = DatasetExportJob.objects.get(app_uuid=self.app.uuid)
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertFalse(response.context['ready'])
+
+    # without pyarrow the parquet format is not offered
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS=True)
+    def test_get_unavailable_format(self):
+
+        url_kwargs = {
+            'app_uid' : self.app.uid,
+        }
+        url = reverse('datasets:create_download_datasets_csv', kwargs=url_kwargs)
+
+        with mock.patch('localcosmos_server.datasets.export_jobs.find_spec', return_value=None):
+            response = self.client.get(url, {'format': 'parquet'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+
+        job = DatasetExportJob.objects.get(app_uuid=self.app.uuid)
+        self.assertEqual(job.export_format, 'csv')
+
+
+class TestCancelDatasetExportJob(CommonSetUp, WithUser, WithApp, TestCase):
+
+    @test_settings
+    def test_post(self):
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+
+        url_kwargs = {
+            'app_uid' : self.app.uid,
+            'job_uuid' : job.uuid,
+        }
+        url = reverse('datasets:cancel_dataset_export_job', kwargs=url_kwargs)
+        response = self.client.post(url, {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+
+        job.refresh_from_db()
+        self.assertTrue(job.cancel_requested)
+        self.assertEqual(job.status, JOB_STATUS_CANCELLED)
         
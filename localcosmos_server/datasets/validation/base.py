@@ -18,22 +18,16 @@ class DatasetValidatorBase:
 
 
     def set_dataset_validation_step_to_next(self, dataset):
-        validation_routine = dataset.validation_routine
-        validation_steps = list(validation_routine.values_list('validation_class', flat=True))
+        validation_routine = dataset.compiled_validation_routine
 
-        index_count = len(validation_steps) -1
+        next_step = validation_routine.get_next_validation_step(self.validation_routine_step.validation_class)
 
-        next_index = validation_steps.index(self.validation_routine_step.validation_class) + 1
-
-        if next_index <= index_count:
-            next_step = validation_steps[next_index]
-        else:
-            next_step = 'completed'
+        if next_step == 'completed':
             if not dataset.validation_errors:
                 dataset.is_valid = True
             
         dataset.validation_step = next_step
-        dataset.save()
+        dataset.save_validation_state()
 
 
     def check_taxonomic_restriction(self, dataset):
@@ -70,12 +64,19 @@ class DatasetValidatorBase:
         self.errors.append(error_obj)
 
 
+    # automatic validators run inside Dataset.validate(), which continues with the next step by itself
+    # human interaction validators are called by a reviewer and have to resume the routine
+    def continue_validation(self, dataset):
+        if self.is_automatic == False:
+            dataset.schedule_validation()
+
+
     def on_valid(self, dataset):
         # set to the next step
         self.set_dataset_validation_step_to_next(dataset)
 
         # continue validation
-        dataset.validate()
+        self.continue_validation(dataset)
 
     def on_invalid(self, dataset):
 
@@ -90,7 +91,7 @@ class DatasetValidatorBase:
         self.set_dataset_validation_step_to_next(dataset)
 
         # continue validation
-        dataset.validate()
+        self.continue_validation(dataset)
 
 
 
@@ -0,0 +1,109 @@
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.contenttypes.models import ContentType
+
+from localcosmos_server.models import TaxonomicRestriction
+from localcosmos_server.datasets.models import DatasetValidationRoutine, COMPLETED_VALIDATION_STEP
+
+import time
+
+'''
+    CompiledValidationRoutine
+    - the ordered validation steps of one app, their validator classes and a next-step map
+    - taxonomic restrictions of the steps are prefetched
+    - compiled routines are cached in-process and invalidated by signals if steps or restrictions change
+    - the timeout covers changes made by other processes, e.g. the admin changes the routine while a
+      validation worker is running
+'''
+class CompiledValidationRoutine:
+
+    def __init__(self, app_uuid, steps):
+
+        self.app_uuid = app_uuid
+        self.steps = list(steps)
+
+        self.validation_classes = [step.validation_class for step in self.steps]
+        self.steps_by_class = {step.validation_class: step for step in self.steps}
+        self.validator_classes = {step.validation_class: step.get_class() for step in self.steps}
+
+        self.next_steps = {}
+        for index, validation_class in enumerate(self.validation_classes):
+            next_index = index + 1
+            if next_index < len(self.validation_classes):
+                self.next_steps[validation_class] = self.validation_classes[next_index]
+            else:
+                self.next_steps[validation_class] = COMPLETED_VALIDATION_STEP
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    @property
+    def first_step(self):
+        if self.steps:
+            return self.steps[0]
+        return None
+
+    def get_step(self, validation_class):
+        return self.steps_by_class[validation_class]
+
+    def get_next_validation_step(self, validation_class):
+        return self.next_steps[validation_class]
+
+    def get_validator(self, step):
+        ValidationClass = self.validator_classes[step.validation_class]
+        return ValidationClass(step)
+
+
+CACHE_TIMEOUT = 60
+
+# (schema name, app uuid) -> (expiry timestamp, CompiledValidationRoutine)
+_compiled_routines = {}
+
+
+def get_cache_key(app_uuid):
+    # on localcosmos.org, django-tenants sets connection.schema_name
+    schema_name = getattr(connection, 'schema_name', None)
+    return (schema_name, str(app_uuid))
+
+
+def compile_validation_routine(app_uuid):
+    steps = DatasetValidationRoutine.objects.filter(app__uuid=app_uuid).order_by('position').prefetch_related(
+        'taxonomic_restrictions')
+    return CompiledValidationRoutine(app_uuid, steps)
+
+
+def get_compiled_validation_routine(app_uuid):
+
+    cache_key = get_cache_key(app_uuid)
+    now = time.monotonic()
+
+    cached = _compiled_routines.get(cache_key, None)
+
+    if cached is None or cached[0] < now:
+        compiled_routine = compile_validation_routine(app_uuid)
+        _compiled_routines[cache_key] = (now + CACHE_TIMEOUT, compiled_routine)
+        return compiled_routine
+
+    return cached[1]
+
+
+def clear_compiled_validation_routines():
+    _compiled_routines.clear()
+
+
+@receiver(post_save, sender=DatasetValidationRoutine)
+@receiver(post_delete, sender=DatasetValidationRoutine)
+def invalidate_on_step_change(sender, instance, **kwargs):
+    clear_compiled_validation_routines()
+
+
+@receiver(post_save, sender=TaxonomicRestriction)
+@receiver(post_delete, sender=TaxonomicRestriction)
+def invalidate_on_restriction_change(sender, instance, **kwargs):
+    routine_content_type = ContentType.objects.get_for_model(DatasetValidationRoutine)
+    if instance.content_type_id == routine_content_type.id:
+        clear_compiled_validation_routines()
@@ -1,28 +1,35 @@
 from django.conf import settings
-from django.views.generic import TemplateView, FormView
+from django.views.generic import TemplateView, FormView, View
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse, Http404
 from django.utils.encoding import smart_str
 from django.urls import reverse
-from django.db import connection
+from django.db import connection, transaction
+from django.utils import timezone
 
 from localcosmos_server.app_admin.view_mixins import AdminOnlyMixin
 
 from localcosmos_server.decorators import ajax_required
 from localcosmos_server.generic_views import AjaxDeleteView
 
-from localcosmos_server.models import LocalcosmosUser
+from localcosmos_server.models import LocalcosmosUser, JOB_STATUS_FINISHED, JOB_STATUS_RUNNING
 
 from .forms import DatasetValidationRoutineForm, ObservationForm, AddDatasetImageForm, DatasetsFilterForm
 
-from .models import Dataset, DatasetValidationRoutine, DATASET_VALIDATION_CLASSES, DatasetImages
+from .models import (Dataset, DatasetValidationRoutine, DATASET_VALIDATION_CLASSES, DatasetImages,
+                     DatasetExportJob, DarwinCoreViewRefresh, get_app_change_position)
 
 from .csv_export import DatasetCSVExport
+from .geo_export import DatasetGeoJSONExport
+from .export_jobs import process_export_job, is_export_format_available
 
 from .darwin_core_sql import (get_darwin_core_view_create_sql, get_darwin_core_view_drop_sql,
-                              get_darwin_core_view_exists_sql, get_darwin_core_view_name)
+                              get_darwin_core_view_exists_sql, get_darwin_core_view_name,
+                              get_darwin_core_materialized_view_create_sql,
+                              get_darwin_core_materialized_view_drop_sql,
+                              get_darwin_core_materialized_view_exists_sql)
 
 import json
 
@@ -61,6 +68,7 @@ class ListDatasets(FormView):
         context = super().get_context_data(**kwargs)
         context['datasets'] = self.get_queryset()
         context['filter_url'] = reverse('datasets:list_datasets', kwargs={'app_uid':self.request.app.uid})
+        context['parquet_export_available'] = is_export_format_available('parquet')
         return context
 
 
@@ -322,35 +330,59 @@ class DeleteDatasetImage(AjaxDeleteView):
 
 
 
+'''
+    exports run as DatasetExportJob, ?format= selects one of DATASET_EXPORT_CLASSES, default is csv
+    - formats whose optional dependency is not installed fall back to csv, see is_export_format_available
+    - the modal shows the progress of the job and polls DownloadDatasetsCSV until the file is ready
+    - without LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS the job is processed within the request
+'''
 class CreateDownloadDatasetsCSV(TemplateView):
     
     template_name = 'datasets/ajax/download_datasets_csv.html'
+
+    export_format = 'csv'
+
+    def get_export_format(self):
+        export_format = self.request.GET.get('format', self.export_format)
+        if is_export_format_available(export_format):
+            return export_format
+        return self.export_format
+
+    def create_export_job(self):
+
+        user = None
+        if self.request.user.is_authenticated:
+            user = self.request.user
+
+        job = DatasetExportJob.objects.create(
+            app_uuid = self.request.app.uuid,
+            user = user,
+            export_format = self.get_export_format(),
+            base_url = '{0}://{1}'.format(self.request.scheme, self.request.get_host()),
+        )
+
+        return job
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['csv_file'] = None
-        context['ready'] = False
+        context['job'] = self.job
+        context['ready'] = self.job.status == JOB_STATUS_FINISHED
+        context['csv_url'] = self.job.get_url(self.request.app)
         
         return context 
     
     def get(self, request, *args, **kwargs):
         
-        # this could run in a thread
-        csv_export = DatasetCSVExport(self.request, self.request.app)
-        csv_export.write_csv()
+        self.job = self.create_export_job()
 
-        # couldnt get X-Sendfile to work with django, wsgi and nginx
-        '''        
-        response = HttpResponse(content_type='application/force-download')
-        response['Content-Disposition'] = 'attachment; filename=datasets.csv'
-        
-        filepath = smart_str('http://{0}{1}'.format(request.get_host(), csv_export.url))
-        
-        response['X-Sendfile'] = filepath
-        response['X-Accel-Redirect'] = filepath
-        # It's usually a good idea to set the 'Content-Length' header too.
-        # You can also set any other required headers: Cache-Control, etc.
-        '''
+        if getattr(settings, 'LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS', False) == False:
+            # there is no worker which could retry the job
+            self.job.status = JOB_STATUS_RUNNING
+            self.job.started_at = timezone.now()
+            self.job.attempts = self.job.max_attempts
+            self.job.save(update_fields=['status', 'started_at', 'attempts'])
+
+            process_export_job(self.job)
         
         context = self.get_context_data(**kwargs)
         return self.render_to_response(context)
@@ -359,13 +391,23 @@ class CreateDownloadDatasetsCSV(TemplateView):
 class DownloadDatasetsCSV(TemplateView):
     
     template_name = 'datasets/ajax/download_datasets_csv_button.html'
+
+    def get_job(self):
+
+        jobs = DatasetExportJob.objects.filter(app_uuid=self.request.app.uuid)
+
+        if 'job' in self.request.GET:
+            return jobs.filter(uuid=self.request.GET['job']).first()
+
+        return jobs.order_by('-pk').first()
     
     def get_context_data(self, **kwargs):
-        csv_export = DatasetCSVExport(self.request, self.request.app)
-        
+        job = self.get_job()
+
         context = super().get_context_data(**kwargs)
-        context['ready'] = True
-        context['csv_url'] = csv_export.url
+        context['job'] = job
+        context['ready'] = job is not None and job.status == JOB_STATUS_FINISHED
+        context['csv_url'] = job.get_url(self.request.app) if job else None
         return context
 
     @method_decorator(ajax_required)
@@ -374,6 +416,51 @@ class DownloadDatasetsCSV(TemplateView):
         return self.render_to_response(context)
 
 
+class CancelDatasetExportJob(View):
+
+    @method_decorator(ajax_required)
+    def post(self, request, *args, **kwargs):
+
+        job = DatasetExportJob.objects.filter(app_uuid=request.app.uuid, uuid=kwargs['job_uuid']).first()
+
+        if not job:
+            raise Http404('Export does not exist')
+
+        job.request_cancel()
+
+        return JsonResponse({'success': True})
+
+
+'''
+    stream the csv directly to the client, without writing a file
+'''
+class StreamDatasetsCSV(View):
+
+    def get(self, request, *args, **kwargs):
+
+        csv_export = DatasetCSVExport(self.request, self.request.app)
+
+        response = StreamingHttpResponse(csv_export.stream_csv(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename=datasets.csv'
+
+        return response
+
+
+'''
+    stream the datasets as newline-delimited GeoJSON, without writing a file
+'''
+class StreamDatasetsGeoJSON(View):
+
+    def get(self, request, *args, **kwargs):
+
+        geojson_export = DatasetGeoJSONExport(self.request, self.request.app)
+
+        response = StreamingHttpResponse(geojson_export.stream_geojson(), content_type='application/geo+json-seq')
+        response['Content-Disposition'] = 'attachment; filename=datasets.geojsonl'
+
+        return response
+
+
 class AddDatasetImage(FormView):
 
     template_name = 'datasets/validation/ajax/add_dataset_image.html'
@@ -406,6 +493,7 @@ class AddDatasetImage(FormView):
         )
 
         dataset_image.save()
+        dataset_image.schedule_renditions()
 
         context = self.get_context_data(**self.kwargs)
         context['success'] = True
@@ -446,15 +534,23 @@ class ManageDarwinCoreView(AdminOnlyMixin, TemplateView):
 
     template_name = 'datasets/darwin_core.html'
     
-    def darwin_core_view_exists(self):
-        schema_name = self.get_db_schema_name()
-        exists_sql = get_darwin_core_view_exists_sql(self.request.app, schema_name)
+    def query_exists(self, exists_sql):
         with connection.cursor() as cursor:
             cursor.execute(exists_sql)
             result = cursor.fetchone()
             if result[0] == True:
                 return True
         return False
+
+    def darwin_core_view_exists(self):
+        schema_name = self.get_db_schema_name()
+        exists_sql = get_darwin_core_view_exists_sql(self.request.app, schema_name)
+        return self.query_exists(exists_sql)
+
+    def darwin_core_materialized_view_exists(self):
+        schema_name = self.get_db_schema_name()
+        exists_sql = get_darwin_core_materialized_view_exists_sql(self.request.app, schema_name)
+        return self.query_exists(exists_sql)
     
     def get_db_schema_name(self):
         if settings.LOCALCOSMOS_PRIVATE == True:
@@ -466,13 +562,18 @@ class ManageDarwinCoreView(AdminOnlyMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs) 
-        context['darwin_core_view_exists'] = self.darwin_core_view_exists()
+        materialized = self.darwin_core_materialized_view_exists()
+        context['darwin_core_view_materialized'] = materialized
+        context['darwin_core_view_exists'] = materialized or self.darwin_core_view_exists()
         context['darwin_core_view_name'] = get_darwin_core_view_name(self.request.app)
+        context['darwin_core_view_refresh'] = DarwinCoreViewRefresh.objects.filter(
+            app_uuid=self.request.app.uuid).first()
         context['db_schema_name'] = self.get_db_schema_name() 
         return context
 
 
 # asynchroneously create a darwin core database view
+# POST materialized=1 creates a materialized view, which is refreshed by refresh_darwin_core_views
 class EnableDarwinCoreView(ManageDarwinCoreView):
     
     template_name = 'datasets/ajax/darwin_core_state.html'
@@ -485,11 +586,31 @@ class EnableDarwinCoreView(ManageDarwinCoreView):
         create_sql = get_darwin_core_view_create_sql(self.request.app)
         with connection.cursor() as cursor:
             cursor.execute(create_sql)
-            
+
+    # a plain view and a materialized view can not have the same name
+    def create_materialized_database_view(self):
+        app = self.request.app
+        with transaction.atomic():
+            # changes during the creation may already be contained, they are refreshed again next time
+            change_xid, change_sequence = get_app_change_position(app.uuid)
+
+            with connection.cursor() as cursor:
+                cursor.execute(get_darwin_core_view_drop_sql(app))
+                cursor.execute(get_darwin_core_materialized_view_create_sql(app))
+
+            DarwinCoreViewRefresh.objects.update_or_create(app_uuid=app.uuid, defaults={
+                'change_xid': change_xid,
+                'change_sequence': change_sequence,
+                'refreshed_at': timezone.now(),
+            })
             
     def get_context_data(self, **kwargs):
         if self.request.method == 'POST':
-            self.create_database_view()
+            if self.request.POST.get('materialized', None) == '1':
+                if not self.darwin_core_materialized_view_exists():
+                    self.create_materialized_database_view()
+            elif not self.darwin_core_materialized_view_exists():
+                self.create_database_view()
         context = super().get_context_data(**kwargs) 
         return context
     
@@ -508,9 +629,15 @@ class DisableDarwinCoreView(ManageDarwinCoreView):
         return super().dispatch(request, *args, **kwargs)
     
     def drop_database_view(self):
-        drop_sql = get_darwin_core_view_drop_sql(self.request.app)
+        if self.darwin_core_materialized_view_exists():
+            drop_sql = get_darwin_core_materialized_view_drop_sql(self.request.app)
+        else:
+            drop_sql = get_darwin_core_view_drop_sql(self.request.app)
+
         with connection.cursor() as cursor:
             cursor.execute(drop_sql)
+
+        DarwinCoreViewRefresh.objects.filter(app_uuid=self.request.app.uuid).delete()
             
     def get_context_data(self, **kwargs):
         if self.request.method == 'POST':
@@ -0,0 +1,241 @@
+from django.conf import settings
+
+from PIL import Image, ImageOps
+
+import math, os
+
+
+'''
+    Renditions of one image from a single decode
+    - the source is decoded once, at the smallest scale which still covers the largest rendition:
+      JPEGs are decoded at a reduced scale (draft mode), other formats are reduced by an integer factor
+      with Image.reduce
+    - each rendition is computed from the next larger one, largest first
+    - square renditions are cropped from the smallest rendition which covers them
+    - plain functions of file paths: they are run in the upload request or in the processes of the worker
+      process_dataset_image_rendition_jobs, they never touch the database
+'''
+
+# the box of the longer side size, keeping the aspect ratio of width, height
+def get_bounding_box(width, height, size):
+
+    if width >= height:
+        return (size, max(1, round(height * size / width)))
+
+    return (max(1, round(width * size / height)), size)
+
+
+# the length of the longer side the source has to be decoded at
+def get_required_size(width, height, renditions):
+
+    required_size = 0
+
+    for size, square, target_path in renditions:
+        if square == True:
+            # the shorter side has to cover the square
+            size = math.ceil(size * max(width, height) / max(1, min(width, height)))
+
+        required_size = max(required_size, size)
+
+    return required_size
+
+
+def open_reduced(image_path, renditions):
+
+    # only reads the header
+    image = Image.open(image_path)
+    image_format = image.format
+
+    width, height = image.size
+
+    size = get_required_size(width, height, renditions)
+
+    if max(width, height) > size:
+
+        if image_format == 'JPEG':
+            # the decoded image is at least as large as the requested box
+            image.draft(None, get_bounding_box(width, height, size))
+        # reducing would average the indices of palette images
+        elif image.mode not in ['P', '1']:
+            factor = max(width, height) // size
+            if factor > 1:
+                image = image.reduce(factor)
+
+    image.load()
+
+    return image, image_format
+
+
+# format, dimensions and byte size of an image file, only the header is read
+def read_image_metadata(image_path):
+
+    with Image.open(image_path) as image:
+        width, height = image.size
+        image_format = image.format
+
+    return {
+        'format': image_format,
+        'width': width,
+        'height': height,
+        'bytes': os.path.getsize(image_path),
+    }
+
+
+'''
+    Modern formats
+    - renditions are also saved as webp and avif, next to the rendition in the format of the original:
+      test_image-250.jpg, test_image-250.webp, test_image-250.avif
+    - settings.LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS: the formats in the order of preference,
+      formats the installed Pillow can not write are skipped
+    - settings.LOCALCOSMOS_SERVER_IMAGE_FORMAT_QUALITY: the quality per format, e.g. {'webp': 80, 'avif': 60}
+    - clients request a format with the Accept header or ?image_format=, see get_preferred_image_format
+'''
+# image format -> (Pillow format, mime type, file extension)
+MODERN_IMAGE_FORMATS = {
+    'avif': ('AVIF', 'image/avif', '.avif'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+
+
+def get_modern_image_formats():
+
+    # registers the plugins of all formats
+    Image.init()
+
+    image_formats = getattr(settings, 'LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS', ['avif', 'webp'])
+
+    return [image_format for image_format in image_formats if image_format in MODERN_IMAGE_FORMATS
+            and MODERN_IMAGE_FORMATS[image_format][0] in Image.SAVE]
+
+
+# {format: quality}, the keys are lowercase Pillow formats: jpeg, png, webp, avif
+def get_image_format_quality():
+    return getattr(settings, 'LOCALCOSMOS_SERVER_IMAGE_FORMAT_QUALITY', {'webp': 80, 'avif': 60})
+
+
+def get_modern_format_path(path, image_format):
+    return '{0}{1}'.format(os.path.splitext(path)[0], MODERN_IMAGE_FORMATS[image_format][2])
+
+
+# None: the format of the original
+def get_preferred_image_format(request):
+
+    image_formats = get_modern_image_formats()
+
+    requested_format = request.GET.get('image_format', None)
+
+    if requested_format:
+        if requested_format in image_formats:
+            return requested_format
+        return None
+
+    accept = request.META.get('HTTP_ACCEPT', '')
+
+    for image_format in image_formats:
+        if MODERN_IMAGE_FORMATS[image_format][1] in accept:
+            return image_format
+
+    return None
+
+
+def save_image(image, path, pil_format, quality={}):
+
+    save_kwargs = {}
+
+    if pil_format.lower() in quality:
+        save_kwargs['quality'] = quality[pil_format.lower()]
+
+    image.save(path, pil_format, **save_kwargs)
+
+
+'''
+    save image in the format of the original and in image_formats, returns the manifest entries
+    the entries of modern formats have the key image_format
+'''
+def save_rendition(image, target_path, original_format, image_formats=[], quality={}):
+
+    save_image(image, target_path, original_format, quality=quality)
+
+    saved = [get_rendition_metadata(image, original_format, target_path)]
+
+    for image_format in image_formats:
+
+        pil_format = MODERN_IMAGE_FORMATS[image_format][0]
+
+        if pil_format == original_format:
+            continue
+
+        modern_image = image
+        if modern_image.mode not in ['RGB', 'RGBA']:
+            modern_image = modern_image.convert('RGBA' if 'A' in modern_image.getbands() or
+                'transparency' in modern_image.info else 'RGB')
+
+        modern_path = get_modern_format_path(target_path, image_format)
+        save_image(modern_image, modern_path, pil_format, quality=quality)
+
+        saved.append(dict(image_format=image_format, **get_rendition_metadata(modern_image, pil_format,
+            modern_path)))
+
+    return saved
+
+
+def get_rendition_metadata(image, image_format, target_path):
+    return {
+        'format': image_format,
+        'width': image.size[0],
+        'height': image.size[1],
+        'bytes': os.path.getsize(target_path),
+    }
+
+
+# renditions: [(size, square, target_path)]
+# returns the renditions which have been written: [{'size', 'square', 'format', 'width', 'height', 'bytes'}]
+# image_formats: modern formats which are saved in addition to the format of the original
+def create_image_renditions(image_path, renditions, image_formats=[], quality={}):
+
+    if not renditions:
+        return []
+
+    for folder in set([os.path.dirname(target_path) for size, square, target_path in renditions]):
+        os.makedirs(folder, exist_ok=True)
+
+    image, image_format = open_reduced(image_path, renditions)
+
+    created = []
+
+    resized_images = []
+
+    # largest first, each size from the previous one
+    resized = image
+    for size, square, target_path in sorted(renditions, key=lambda rendition: rendition[0], reverse=True):
+
+        if square == True:
+            continue
+
+        resized = resized.copy()
+        resized.thumbnail((size, size), Image.BICUBIC)
+
+        resized_images.append(resized)
+
+        for metadata in save_rendition(resized, target_path, image_format, image_formats=image_formats,
+                quality=quality):
+            created.append(dict(size=size, square=square, **metadata))
+
+    for size, square, target_path in renditions:
+
+        if square == False:
+            continue
+
+        # the smallest image covering the square
+        source = image
+        for resized in resized_images:
+            if min(resized.size) >= size:
+                source = resized
+
+        square_image = ImageOps.fit(source, (size, size), Image.BICUBIC)
+
+        for metadata in save_rendition(square_image, target_path, image_format, image_formats=image_formats,
+                quality=quality):
+            created.append(dict(size=size, square=square, **metadata))
+
+    return created
@@ -0,0 +1,254 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connections
+from django.db.models import Min, Max
+
+from localcosmos_server.datasets.models import Dataset
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django, json, os, uuid
+
+# tolerance for comparing geometries, srid 3857 is in meters
+GEOMETRY_TOLERANCE = 0.001
+
+
+def values_differ(old_value, new_value):
+
+    if isinstance(old_value, GEOSGeometry) or isinstance(new_value, GEOSGeometry):
+        if old_value is None or new_value is None:
+            return old_value is not new_value
+
+        # geometries are stored in srid 3857, but computed in the srid reported by the client
+        if old_value.srid and new_value.srid and old_value.srid != new_value.srid:
+            new_value = new_value.transform(old_value.srid, clone=True)
+
+        return not old_value.equals_exact(new_value, tolerance=GEOMETRY_TOLERANCE)
+
+    if isinstance(old_value, uuid.UUID) or isinstance(new_value, uuid.UUID):
+        return str(old_value) != str(new_value)
+
+    return old_value != new_value
+
+
+# runs in the worker processes, has to be a module level function
+def backfill_chunk(start_pk, end_pk, app_uuid=None, dry_run=False):
+
+    datasets = Dataset.objects.filter(pk__gte=start_pk, pk__lt=end_pk).order_by('pk')
+
+    if app_uuid:
+        datasets = datasets.filter(app_uuid=app_uuid)
+
+    changed_datasets = []
+    diffs = []
+    errors = []
+    processed_count = 0
+
+    for dataset in datasets.iterator(chunk_size=500):
+
+        processed_count += 1
+
+        old_values = {column: getattr(dataset, column) for column in Dataset.reference_columns}
+
+        try:
+            dataset.update_reference_columns()
+        except Exception as e:
+            errors.append((dataset.pk, str(e)))
+            continue
+
+        changed_columns = []
+        for column in Dataset.reference_columns:
+            new_value = getattr(dataset, column)
+            if values_differ(old_values[column], new_value):
+                changed_columns.append((column, str(old_values[column]), str(new_value)))
+
+        if changed_columns:
+            changed_datasets.append(dataset)
+            diffs.append((dataset.pk, changed_columns))
+
+    # bulk_update does not call save(): no validation, no achievements, no signals
+    if changed_datasets and not dry_run:
+        Dataset.objects.bulk_update(changed_datasets, Dataset.reference_columns)
+
+    return {
+        'start_pk': start_pk,
+        'end_pk': end_pk,
+        'processed_count': processed_count,
+        'diffs': diffs,
+        'errors': errors,
+    }
+
+
+def close_db_connections():
+    # forked processes must not share the database connections of the parent
+    connections.close_all()
+
+
+# runs once in each worker process
+# with the spawn or forkserver start method (macOS, Windows) the worker starts without the configured django
+def init_worker(settings_module):
+
+    if not settings.configured:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+        django.setup()
+
+    close_db_connections()
+
+
+'''
+    Recompute the redundant reference columns of datasets
+    - taxon, coordinates, geographic_reference and timestamp are derived from Dataset.data, see
+      Dataset.update_reference_columns
+    - datasets are processed in primary key ranges of --chunk-size, the ranges are distributed across --workers
+      processes and written with bulk_update
+    - with --checkpoint, the primary key up to which all chunks are done is stored in a json file,
+      a new run with the same file resumes from there
+    - the checkpoint does not advance past a dataset which failed, the failed primary keys are stored in the
+      checkpoint and a resumed run retries them
+    - --dry-run lists the changed columns without writing them
+'''
+class Command(BaseCommand):
+
+    help = 'Recompute the taxon, geographic and temporal columns of datasets from their data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-uuid', type=str, default=None,
+            help='Only process the datasets of this app.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+            help='Number of primary keys per chunk.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+            help='Number of worker processes. 1 processes all chunks in this process.')
+        parser.add_argument('--checkpoint', type=str, default=None,
+            help='Path of a json file for resuming an interrupted run.')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Print the changes without writing them.')
+
+
+    def read_checkpoint(self, checkpoint_path):
+        if checkpoint_path and os.path.isfile(checkpoint_path):
+            with open(checkpoint_path, 'r') as checkpoint_file:
+                return json.load(checkpoint_file)['completed_pk']
+        return None
+
+    def write_checkpoint(self, checkpoint_path, completed_pk, failed_pks):
+        if checkpoint_path:
+            checkpoint = {
+                'completed_pk': completed_pk,
+                'failed_pks': sorted(failed_pks),
+            }
+            tmp_path = '{0}.tmp'.format(checkpoint_path)
+            with open(tmp_path, 'w') as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+            os.replace(tmp_path, checkpoint_path)
+
+
+    def get_chunks(self, options):
+
+        datasets = Dataset.objects.all()
+        if options['app_uuid']:
+            datasets = datasets.filter(app_uuid=options['app_uuid'])
+
+        pk_range = datasets.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+
+        if pk_range['min_pk'] is None:
+            return []
+
+        start_pk = pk_range['min_pk']
+
+        completed_pk = self.read_checkpoint(options['checkpoint'])
+        if completed_pk is not None:
+            self.stdout.write('Resuming after pk {0}'.format(completed_pk))
+            start_pk = max(start_pk, completed_pk + 1)
+
+        chunk_size = options['chunk_size']
+
+        return [(pk, min(pk + chunk_size, pk_range['max_pk'] + 1))
+                for pk in range(start_pk, pk_range['max_pk'] + 1, chunk_size)]
+
+
+    def handle(self, *args, **options):
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size has to be at least 1')
+
+        chunks = self.get_chunks(options)
+
+        self.stdout.write('Processing {0} chunks'.format(len(chunks)))
+
+        # chunks complete out of order, the checkpoint is the end of the completed prefix
+        # or the primary key before the first failed dataset
+        pending_starts = [chunk[0] for chunk in chunks]
+        completed = {}
+        failed_pks = []
+        checkpoint_blocked = False
+        completed_pk = self.read_checkpoint(options['checkpoint'])
+
+        processed_count = 0
+        changed_count = 0
+
+        for result in self.run_chunks(chunks, options):
+
+            processed_count += result['processed_count']
+            changed_count += len(result['diffs'])
+
+            for pk, changed_columns in result['diffs']:
+                if options['dry_run'] == True:
+                    for column, old_value, new_value in changed_columns:
+                        self.stdout.write('Dataset {0}: {1}: {2} -> {3}'.format(pk, column, old_value,
+                            new_value))
+
+            for pk, error in result['errors']:
+                self.stderr.write('Dataset {0}: {1}'.format(pk, error))
+                failed_pks.append(pk)
+
+            first_failed_pk = min((pk for pk, error in result['errors']), default=None)
+            completed[result['start_pk']] = (result['end_pk'], first_failed_pk)
+
+            if not options['dry_run']:
+                checkpoint_changed = first_failed_pk is not None
+
+                while not checkpoint_blocked and pending_starts and pending_starts[0] in completed:
+                    end_pk, chunk_failed_pk = completed.pop(pending_starts.pop(0))
+
+                    if chunk_failed_pk is not None:
+                        completed_pk = chunk_failed_pk - 1
+                        checkpoint_blocked = True
+                    else:
+                        completed_pk = end_pk - 1
+
+                    checkpoint_changed = True
+
+                if checkpoint_changed:
+                    self.write_checkpoint(options['checkpoint'], completed_pk, failed_pks)
+
+        action = 'Found' if options['dry_run'] == True else 'Updated'
+        self.stdout.write('{0} {1} changed datasets, {2} datasets processed'.format(action, changed_count,
+            processed_count))
+
+        if failed_pks:
+            self.stderr.write('{0} datasets failed'.format(len(failed_pks)))
+
+
+    def run_chunks(self, chunks, options):
+
+        kwargs = {
+            'app_uuid': options['app_uuid'],
+            'dry_run': options['dry_run'],
+        }
+
+        if options['workers'] <= 1:
+            for start_pk, end_pk in chunks:
+                yield backfill_chunk(start_pk, end_pk, **kwargs)
+            return
+
+        close_db_connections()
+
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker,
+                                 initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)) as executor:
+
+            futures = [executor.submit(backfill_chunk, start_pk, end_pk, **kwargs)
+                       for start_pk, end_pk in chunks]
+
+            for future in as_completed(futures):
+                yield future.result()
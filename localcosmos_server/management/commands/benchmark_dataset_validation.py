@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from localcosmos_server.models import App
+from localcosmos_server.datasets.models import Dataset
+from localcosmos_server.datasets.api.serializers import DatasetSerializer
+from localcosmos_server.datasets.observation_form_cache import observation_form_cache
+
+import time
+
+
+'''
+    Benchmark the validation of dataset POST requests
+    - the existing datasets of an app are used as request payloads
+    - each payload is validated with DatasetSerializer, compiling the observation form on each request
+      and using the cached compiled observation forms
+    - the database is only read
+'''
+class Command(BaseCommand):
+
+    help = 'Compare the dataset validation throughput of DatasetSerializer with and without cached observation forms.'
+
+    # (label, clear the observation form cache before each payload)
+    modes = (
+        ('uncached', True),
+        ('cached', False),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_uid', type=str)
+        parser.add_argument('--count', type=int, default=1000,
+            help='Maximum number of datasets used as payloads.')
+        parser.add_argument('--rounds', type=int, default=3,
+            help='The best round is reported.')
+
+
+    def handle(self, *args, **options):
+
+        app = App.objects.filter(uid=options['app_uid']).first()
+
+        if not app:
+            raise CommandError('App {0} does not exist'.format(options['app_uid']))
+
+        datasets = Dataset.objects.filter(app_uuid=app.uuid).select_related('observation_form')
+        payloads = [self.get_payload(dataset) for dataset in datasets[:options['count']]]
+
+        if not payloads:
+            raise CommandError('App {0} has no datasets'.format(options['app_uid']))
+
+        observation_form_cache.clear()
+
+        for label, clear_cache in self.modes:
+
+            durations = []
+
+            for round in range(0, options['rounds']):
+                durations.append(self.validate_payloads(app, payloads, clear_cache=clear_cache))
+
+            duration = min(durations)
+            throughput = len(payloads) / duration
+
+            self.stdout.write('{0}: {1} datasets in {2:.3f}s, {3:.0f} datasets/s'.format(label, len(payloads),
+                duration, throughput))
+
+
+    def get_payload(self, dataset):
+        payload = {
+            'observation_form' : {
+                'uuid': str(dataset.observation_form.uuid),
+                'version': dataset.observation_form.version,
+            },
+            'data': dataset.data,
+            'client_id': dataset.client_id,
+            'platform': dataset.platform,
+        }
+        return payload
+
+
+    def validate_payloads(self, app, payloads, clear_cache=False):
+
+        start = time.perf_counter()
+
+        for payload in payloads:
+            if clear_cache == True:
+                observation_form_cache.clear()
+
+            serializer = DatasetSerializer(app.uuid, data=payload)
+            if not serializer.is_valid():
+                self.stderr.write(str(serializer.errors))
+
+        return time.perf_counter() - start
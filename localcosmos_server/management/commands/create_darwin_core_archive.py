@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from localcosmos_server.models import App, JOB_STATUS_RUNNING, JOB_STATUS_FINISHED, JOB_STATUS_FAILED
+from localcosmos_server.datasets.models import DatasetExportJob
+from localcosmos_server.datasets.export_jobs import process_export_job
+
+'''
+    Create a Darwin Core Archive of an app, e.g. daily for publishing on GBIF
+    - the archive is created as DatasetExportJob and written by process_dataset_export_jobs,
+      with --now it is written by this command. The job is then created as running, workers do not claim it
+    - with --incremental, the archive is built from the last finished archive and the datasets which changed
+      since then. Without a previous archive, a full archive is created
+'''
+class Command(BaseCommand):
+
+    help = 'Create a Darwin Core Archive from the Darwin Core view of an app.'
+
+    export_format = 'dwca'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_uid', type=str)
+        parser.add_argument('--incremental', action='store_true',
+            help='Only read the datasets which changed since the last archive.')
+        parser.add_argument('--now', action='store_true',
+            help='Write the archive in this process instead of queueing it.')
+
+
+    def get_previous_export(self, app):
+        return DatasetExportJob.objects.filter(app_uuid=app.uuid, export_format=self.export_format,
+            status=JOB_STATUS_FINISHED, change_xid__isnull=False).order_by('-finished_at').first()
+
+
+    def handle(self, *args, **options):
+
+        app = App.objects.filter(uid=options['app_uid']).first()
+
+        if not app:
+            raise CommandError('App {0} does not exist'.format(options['app_uid']))
+
+        filters = {}
+
+        if options['incremental'] == True:
+            previous_export = self.get_previous_export(app)
+            if previous_export:
+                filters['previous_export'] = str(previous_export.uuid)
+                self.stdout.write('Building on archive {0}'.format(previous_export.uuid))
+            else:
+                self.stdout.write('No previous archive, creating a full archive')
+
+        job = DatasetExportJob(
+            app_uuid=app.uuid,
+            export_format=self.export_format,
+            filters=filters,
+        )
+
+        if options['now'] == False:
+            job.save()
+            self.stdout.write('Queued archive {0}'.format(job.uuid))
+            return
+
+        # a running job is not claimed by process_dataset_export_jobs
+        job.status = JOB_STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.attempts = 1
+        job.save()
+
+        process_export_job(job)
+
+        if job.status == JOB_STATUS_FINISHED:
+            self.stdout.write('Created archive {0}: {1}'.format(job.uuid, job.get_filepath(app)))
+        elif job.status == JOB_STATUS_FAILED:
+            raise CommandError('Archive {0} failed: {1}'.format(job.uuid, job.error))
+        else:
+            self.stderr.write('Archive {0} is {1}, it will be retried by process_dataset_export_jobs'.format(
+                job.uuid, job.status))
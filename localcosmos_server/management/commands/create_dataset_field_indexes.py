@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from localcosmos_server.models import App
+from localcosmos_server.datasets.models import Dataset, ObservationForm
+from localcosmos_server.datasets.field_filters import (get_field_index, get_data_gin_index,
+                                                       CONTAINMENT_FIELD_CLASSES)
+
+'''
+    Create the indexes for filtering the datasets of an app by observation form fields
+    - fields are filterable if their definition has isFilterable: true
+    - numeric and text fields get a partial expression index on (app_uuid, data->>'<field_uuid>')
+    - BooleanField and MultipleChoiceField filters use jsonb containment, covered by one GIN index on Dataset.data
+    - indexes are created concurrently, existing indexes are skipped
+'''
+class Command(BaseCommand):
+
+    help = 'Create database indexes for the filterable observation form fields of an app.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_uid', type=str)
+        parser.add_argument('--dry-run', action='store_true',
+            help='Only list the indexes which would be created.')
+
+
+    def get_filterable_fields(self, app):
+
+        observation_form_ids = Dataset.objects.filter(app_uuid=app.uuid).values(
+            'observation_form_id').distinct()
+
+        fields = {}
+
+        for observation_form in ObservationForm.objects.filter(pk__in=observation_form_ids):
+            for field in observation_form.definition['fields']:
+                if field['definition'].get('isFilterable', False) == True:
+                    fields[field['uuid']] = field
+
+        return list(fields.values())
+
+
+    def handle(self, *args, **options):
+
+        app = App.objects.filter(uid=options['app_uid']).first()
+
+        if not app:
+            raise CommandError('App {0} does not exist'.format(options['app_uid']))
+
+        indexes = []
+
+        fields = self.get_filterable_fields(app)
+
+        for field in fields:
+            index = get_field_index(field)
+            if index:
+                indexes.append(index)
+
+        if any(field['fieldClass'] in CONTAINMENT_FIELD_CLASSES for field in fields):
+            indexes.append(get_data_gin_index())
+
+        with connection.cursor() as cursor:
+            existing_indexes = connection.introspection.get_constraints(cursor, Dataset._meta.db_table)
+
+        for index in indexes:
+
+            if index.name in existing_indexes:
+                self.stdout.write('Index {0} already exists'.format(index.name))
+                continue
+
+            if options['dry_run'] == True:
+                self.stdout.write('Would create index {0}'.format(index.name))
+                continue
+
+            self.stdout.write('Creating index {0}'.format(index.name))
+
+            # CREATE INDEX CONCURRENTLY can not run inside a transaction
+            with connection.schema_editor(atomic=False) as schema_editor:
+                schema_editor.add_index(Dataset, index, concurrently=True)
+
+        if not indexes:
+            self.stdout.write('App {0} has no filterable fields'.format(app.uid))
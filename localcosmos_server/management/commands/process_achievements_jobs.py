@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from localcosmos_server.models import App
+from localcosmos_server.datasets.models import Dataset, DatasetAchievementsJob
+
+import time, traceback
+
+'''
+    Achievements worker
+    - processes the jobs enqueued by Dataset.award_achievements() if LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS is True
+    - several workers can run in parallel, each job is claimed by exactly one worker
+    - the points of one dataset are awarded in one transaction, a failed job awards nothing
+    - the outcome does not depend on the lag of the queue: "first dataset" conditions only consider datasets
+      created before the dataset of the job, see DatasetPointsAwarder
+    - successfully processed jobs are deleted, failed jobs are retried up to DatasetAchievementsJob.max_attempts
+    - jobs of crashed workers are handed to the queue again every --requeue-interval seconds
+'''
+class Command(BaseCommand):
+
+    help = 'Process queued achievements jobs of datasets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+            help='Number of jobs claimed at once.')
+        parser.add_argument('--sleep', type=float, default=5,
+            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+            help='Exit as soon as the queue is empty.')
+        parser.add_argument('--requeue-interval', type=float, default=300,
+            help='Seconds between the checks for jobs of crashed workers.')
+
+
+    def handle(self, *args, **options):
+
+        requeued_at = None
+
+        while True:
+
+            if requeued_at is None or time.monotonic() - requeued_at >= options['requeue_interval']:
+                DatasetAchievementsJob.objects.requeue_stale()
+                requeued_at = time.monotonic()
+
+            processed_count = self.process_batch(options['batch_size'])
+
+            if processed_count == 0:
+                if options['once'] == True:
+                    break
+
+                time.sleep(options['sleep'])
+
+
+    def process_batch(self, batch_size):
+
+        jobs = DatasetAchievementsJob.objects.claim(batch_size=batch_size)
+
+        datasets = Dataset.objects.select_related('user').in_bulk([job.dataset_id for job in jobs])
+
+        app_uuids = set([dataset.app_uuid for dataset in datasets.values()])
+        apps = {app.uuid: app for app in App.objects.filter(uuid__in=app_uuids)}
+
+        for job in jobs:
+
+            dataset = datasets.get(job.dataset_id, None)
+
+            # the dataset has been deleted after the job has been claimed
+            if dataset is None:
+                continue
+
+            app = apps.get(dataset.app_uuid, None)
+
+            try:
+                if app is not None:
+                    with transaction.atomic():
+                        dataset.award_achievements_now(app=app)
+            except Exception:
+                job.set_failed(traceback.format_exc())
+                self.stderr.write('Awarding achievements for dataset {0} failed'.format(dataset.uuid))
+            else:
+                job.delete()
+
+        return len(jobs)
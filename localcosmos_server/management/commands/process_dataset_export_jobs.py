@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from localcosmos_server.models import JOB_STATUS_FAILED
+from localcosmos_server.datasets.models import DatasetExportJob
+from localcosmos_server.datasets.export_jobs import process_export_job
+
+from datetime import timedelta
+
+import time
+
+'''
+    Export worker
+    - writes the export files of the jobs created in the app admin
+    - progress is stored after each chunk of datasets, cancelled jobs stop after their current chunk
+    - expired export files are deleted, see LOCALCOSMOS_SERVER_DATASET_EXPORT_RETENTION_DAYS
+    - jobs of crashed workers are handed to the queue again every --requeue-interval seconds
+'''
+class Command(BaseCommand):
+
+    help = 'Process queued dataset export jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sleep', type=float, default=5,
+            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+            help='Exit as soon as the queue is empty.')
+        parser.add_argument('--requeue-interval', type=float, default=300,
+            help='Seconds between the checks for jobs of crashed workers.')
+
+
+    def handle(self, *args, **options):
+
+        requeued_at = None
+
+        while True:
+
+            if requeued_at is None or time.monotonic() - requeued_at >= options['requeue_interval']:
+                # exports of large apps can run for a long time
+                DatasetExportJob.objects.requeue_stale(timeout=timedelta(hours=12))
+                requeued_at = time.monotonic()
+
+            DatasetExportJob.objects.delete_expired()
+
+            # exports are long running, claim one job at a time
+            jobs = DatasetExportJob.objects.claim(batch_size=1)
+
+            for job in jobs:
+                self.stdout.write('Processing export {0}'.format(job.uuid))
+                process_export_job(job)
+
+                if job.status == JOB_STATUS_FAILED:
+                    self.stderr.write('Export {0} failed'.format(job.uuid))
+
+            if not jobs:
+                if options['once'] == True:
+                    break
+
+                time.sleep(options['sleep'])
@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand
+
+from localcosmos_server.models import JOB_STATUS_QUEUED, JOB_STATUS_RUNNING
+from localcosmos_server.datasets.models import DatasetImages, DatasetImageRenditionJob
+from localcosmos_server.image_renditions import create_image_renditions
+
+from concurrent.futures import ProcessPoolExecutor
+
+import time, traceback
+
+'''
+    Renditions worker
+    - processes the jobs enqueued by DatasetImages.schedule_renditions()
+      if LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS is True
+    - the images of a batch are decoded and resized in a pool of --processes processes,
+      the database is only accessed by the main process
+    - --missing enqueues the images whose renditions have not been recorded, e.g. images uploaded before
+      renditions were recorded
+    - several workers can run in parallel, each job is claimed by exactly one worker
+    - successfully processed jobs are deleted, failed jobs are retried up to DatasetImageRenditionJob.max_attempts
+    - jobs of crashed workers are handed to the queue again every --requeue-interval seconds
+'''
+class Command(BaseCommand):
+
+    help = 'Create the resized images of uploaded dataset images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+            help='Number of jobs claimed at once.')
+        parser.add_argument('--processes', type=int, default=None,
+            help='Number of processes resizing images, defaults to the number of CPUs.')
+        parser.add_argument('--sleep', type=float, default=5,
+            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+            help='Exit as soon as the queue is empty.')
+        parser.add_argument('--missing', action='store_true',
+            help='Enqueue the images without recorded renditions before processing the queue.')
+        parser.add_argument('--requeue-interval', type=float, default=300,
+            help='Seconds between the checks for jobs of crashed workers.')
+
+
+    def handle(self, *args, **options):
+
+        if options['missing'] == True:
+            self.enqueue_missing()
+
+        requeued_at = None
+
+        with ProcessPoolExecutor(max_workers=options['processes']) as executor:
+
+            while True:
+
+                if requeued_at is None or time.monotonic() - requeued_at >= options['requeue_interval']:
+                    DatasetImageRenditionJob.objects.requeue_stale()
+                    requeued_at = time.monotonic()
+
+                processed_count = self.process_batch(executor, options['batch_size'])
+
+                if processed_count == 0:
+                    if options['once'] == True:
+                        break
+
+                    time.sleep(options['sleep'])
+
+
+    def enqueue_missing(self):
+
+        pending_image_ids = DatasetImageRenditionJob.objects.filter(
+            status__in=[JOB_STATUS_QUEUED, JOB_STATUS_RUNNING]).values('dataset_image_id')
+
+        dataset_images = DatasetImages.objects.filter(renditions__isnull=True).exclude(
+            pk__in=pending_image_ids).values_list('pk', flat=True)
+
+        jobs = [DatasetImageRenditionJob(dataset_image_id=dataset_image_id) for dataset_image_id in dataset_images]
+        DatasetImageRenditionJob.objects.bulk_create(jobs, batch_size=1000)
+
+        self.stdout.write('Enqueued {0} images'.format(len(jobs)))
+
+
+    def process_batch(self, executor, batch_size):
+
+        jobs = DatasetImageRenditionJob.objects.claim(batch_size=batch_size)
+
+        dataset_images = DatasetImages.objects.in_bulk([job.dataset_image_id for job in jobs])
+
+        futures = []
+
+        for job in jobs:
+
+            dataset_image = dataset_images.get(job.dataset_image_id, None)
+
+            # the image has been deleted after the job has been claimed
+            if dataset_image is None:
+                continue
+
+            future = executor.submit(create_image_renditions, dataset_image.image.path,
+                dataset_image.get_rendition_targets(), **dataset_image.get_rendition_options())
+
+            futures.append((job, dataset_image, future))
+
+        for job, dataset_image, future in futures:
+
+            try:
+                renditions = future.result()
+                dataset_image.set_renditions(renditions)
+            except Exception:
+                job.set_failed(traceback.format_exc())
+                self.stderr.write('Creating the renditions of dataset image {0} failed'.format(dataset_image.pk))
+            else:
+                job.delete()
+
+        return len(jobs)
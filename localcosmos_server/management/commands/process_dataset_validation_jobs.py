@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+from localcosmos_server.datasets.models import Dataset, DatasetValidationJob
+
+import time, traceback
+
+'''
+    Validation worker
+    - processes the jobs enqueued by Dataset.enqueue_validation()
+    - several workers can run in parallel, each job is claimed by exactly one worker
+    - successfully processed jobs are deleted, failed jobs are retried up to DatasetValidationJob.max_attempts,
+      with an increasing delay, see QueuedJobAbstract.set_failed
+    - jobs of crashed workers are handed to the queue again every --requeue-interval seconds
+'''
+class Command(BaseCommand):
+
+    help = 'Process queued dataset validation jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+            help='Number of jobs claimed at once.')
+        parser.add_argument('--sleep', type=float, default=5,
+            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+            help='Exit as soon as the queue is empty.')
+        parser.add_argument('--requeue-interval', type=float, default=300,
+            help='Seconds between the checks for jobs of crashed workers.')
+
+
+    def handle(self, *args, **options):
+
+        requeued_at = None
+
+        while True:
+
+            if requeued_at is None or time.monotonic() - requeued_at >= options['requeue_interval']:
+                DatasetValidationJob.objects.requeue_stale()
+                requeued_at = time.monotonic()
+
+            processed_count = self.process_batch(options['batch_size'])
+
+            if processed_count == 0:
+                if options['once'] == True:
+                    break
+
+                time.sleep(options['sleep'])
+
+
+    def process_batch(self, batch_size):
+
+        jobs = DatasetValidationJob.objects.claim(batch_size=batch_size)
+
+        datasets = Dataset.objects.in_bulk([job.dataset_id for job in jobs])
+
+        for job in jobs:
+
+            dataset = datasets.get(job.dataset_id, None)
+
+            # the dataset has been deleted after the job has been claimed
+            if dataset is None:
+                continue
+
+            try:
+                dataset.validate()
+            except Exception:
+                job.set_failed(traceback.format_exc())
+                self.stderr.write('Validation of dataset {0} failed'.format(dataset.uuid))
+            else:
+                job.delete()
+
+        return len(jobs)
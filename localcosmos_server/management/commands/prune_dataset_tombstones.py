@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from localcosmos_server.datasets.models import DatasetTombstone
+
+'''
+    Delete the tombstones of deleted datasets which are older than
+    LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS
+    - offline devices learn about deleted datasets from the tombstones, see DatasetChanges
+    - delta sync cursors expire after the same number of days, devices with an expired cursor start a full sync
+    - run it daily
+'''
+class Command(BaseCommand):
+
+    help = 'Delete expired tombstones of deleted datasets.'
+
+    def handle(self, *args, **options):
+
+        deleted_count = DatasetTombstone.objects.prune()
+        self.stdout.write('Deleted {0} tombstones'.format(deleted_count))
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from localcosmos_server.datasets.models import Dataset, UserDatasetCounter
+
+'''
+    Recompute the per user and app dataset counters from the datasets table
+    - the counters are maintained by database triggers, this command repairs counters which have drifted,
+      e.g. after restoring a partial backup
+    - the counters table is locked while reconciling, concurrent dataset writes wait
+    - --dry-run lists the differences without writing them
+'''
+class Command(BaseCommand):
+
+    help = 'Recompute the dataset counters of users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-uuid', type=str, default=None,
+            help='Only reconcile the counters of this app.')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Print the differences without writing them.')
+
+
+    def handle(self, *args, **options):
+
+        with transaction.atomic():
+
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {0} IN EXCLUSIVE MODE'.format(UserDatasetCounter._meta.db_table))
+
+            datasets = Dataset.objects.filter(user__isnull=False)
+            counters = UserDatasetCounter.objects.all()
+
+            if options['app_uuid']:
+                datasets = datasets.filter(app_uuid=options['app_uuid'])
+                counters = counters.filter(app_uuid=options['app_uuid'])
+
+            actual_counts = {}
+            for row in datasets.order_by().values('user_id', 'app_uuid').annotate(count=Count('pk')):
+                actual_counts[(row['user_id'], row['app_uuid'])] = row['count']
+
+            changed_counters = []
+            deleted_counter_ids = []
+
+            for counter in counters:
+
+                key = (counter.user_id, counter.app_uuid)
+                actual_count = actual_counts.pop(key, 0)
+
+                if counter.dataset_count != actual_count:
+                    self.stdout.write('User {0}, app {1}: {2} -> {3}'.format(counter.user_id, counter.app_uuid,
+                        counter.dataset_count, actual_count))
+
+                    if actual_count == 0:
+                        deleted_counter_ids.append(counter.pk)
+                    else:
+                        counter.dataset_count = actual_count
+                        changed_counters.append(counter)
+
+            # datasets without a counter
+            new_counters = []
+            for (user_uuid, app_uuid), actual_count in actual_counts.items():
+                self.stdout.write('User {0}, app {1}: missing -> {2}'.format(user_uuid, app_uuid, actual_count))
+                new_counters.append(UserDatasetCounter(user_id=user_uuid, app_uuid=app_uuid,
+                    dataset_count=actual_count))
+
+            if options['dry_run'] == False:
+                UserDatasetCounter.objects.bulk_update(changed_counters, ['dataset_count'])
+                UserDatasetCounter.objects.filter(pk__in=deleted_counter_ids).delete()
+                UserDatasetCounter.objects.bulk_create(new_counters)
+
+        action = 'Found' if options['dry_run'] == True else 'Fixed'
+        self.stdout.write('{0} {1} wrong counters'.format(action,
+            len(changed_counters) + len(deleted_counter_ids) + len(new_counters)))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from localcosmos_server.models import App
+from localcosmos_server.datasets.models import DarwinCoreViewRefresh
+
+'''
+    Refresh the materialized darwin core views, see EnableDarwinCoreView
+    - a view is only refreshed if at least --min-changes datasets have been created, changed or deleted since
+      its last refresh. Run frequently, e.g. every few minutes, the views are refreshed after batches of writes
+    - REFRESH MATERIALIZED VIEW CONCURRENTLY does not block readers of the view
+'''
+class Command(BaseCommand):
+
+    help = 'Refresh the materialized Darwin Core views of apps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-uid', type=str, default=None,
+            help='Only refresh the view of this app.')
+        parser.add_argument('--min-changes', type=int, default=1,
+            help='Minimum number of changed datasets since the last refresh.')
+
+
+    def get_apps(self, options):
+
+        app_uuids = DarwinCoreViewRefresh.objects.values_list('app_uuid', flat=True)
+        apps = App.objects.filter(uuid__in=app_uuids).order_by('pk')
+
+        if options['app_uid']:
+            apps = apps.filter(uid=options['app_uid'])
+
+            if not apps.exists():
+                raise CommandError('App {0} has no materialized Darwin Core view'.format(options['app_uid']))
+
+        return apps
+
+
+    def handle(self, *args, **options):
+
+        for app in self.get_apps(options):
+
+            pending_changes = DarwinCoreViewRefresh.objects.get_pending_changes(app)
+
+            if pending_changes < options['min_changes']:
+                self.stdout.write('{0}: {1} changes, not refreshed'.format(app.uid, pending_changes))
+                continue
+
+            DarwinCoreViewRefresh.objects.refresh(app)
+            self.stdout.write('{0}: refreshed, {1} changes'.format(app.uid, pending_changes))
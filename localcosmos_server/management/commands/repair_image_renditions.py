@@ -0,0 +1,156 @@
+from django.core.management.base import BaseCommand
+
+from localcosmos_server.models import ServerImageStore, ContentImageProcessing
+from localcosmos_server.datasets.models import DatasetImages, DATASET_IMAGE_RENDITIONS
+from localcosmos_server.image_renditions import read_image_metadata, get_modern_image_formats, MODERN_IMAGE_FORMATS
+
+import os
+
+'''
+    Reconcile the rendition manifests with the files on disk
+    - DatasetImages.renditions: entries whose file is missing are removed, renditions which exist on disk but
+      are not recorded are added. --create-missing recreates the missing renditions from the original
+    - ServerImageStore.renditions: entries whose thumbnail is missing are removed, thumbnails on disk are added.
+      Missing thumbnails are created again on demand by ContentImageProcessing.image_url
+    - only manifests which differ from the disk are written
+'''
+class Command(BaseCommand):
+
+    help = 'Reconcile the manifests of resized images with the files on disk.'
+
+    chunk_size = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--create-missing', action='store_true',
+            help='Create the missing renditions of dataset images.')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Only report the differences.')
+
+
+    def handle(self, *args, **options):
+
+        self.dry_run = options['dry_run']
+
+        self.repair_dataset_images(options['create_missing'])
+        self.repair_image_stores()
+
+
+    def repair_dataset_images(self, create_missing):
+
+        repaired_count = 0
+        created_count = 0
+
+        image_formats = get_modern_image_formats()
+
+        for dataset_image in DatasetImages.objects.all().iterator(chunk_size=self.chunk_size):
+
+            if not dataset_image.image or not os.path.isfile(dataset_image.image.path):
+                continue
+
+            resized_folder = os.path.join(os.path.dirname(dataset_image.image.path),
+                dataset_image.resized_folder_name)
+
+            renditions = []
+            is_complete = True
+
+            # same order as create_image_renditions: the format of the original, then the modern formats
+            for size, square in DATASET_IMAGE_RENDITIONS:
+
+                resized_filename = dataset_image.get_resized_filename(size, square=square)
+
+                for image_format in [None] + image_formats:
+
+                    filename = dataset_image.get_resized_filename(size, square=square, image_format=image_format)
+
+                    # the original already is in this format
+                    if image_format and filename == resized_filename:
+                        continue
+
+                    resized_path = os.path.join(resized_folder, filename)
+
+                    if os.path.isfile(resized_path):
+                        rendition = dict(size=size, square=square)
+                        if image_format:
+                            rendition['image_format'] = image_format
+                        rendition.update(read_image_metadata(resized_path))
+                        renditions.append(rendition)
+                    else:
+                        is_complete = False
+
+            if not is_complete and create_missing == True:
+                created_count += 1
+                if not self.dry_run:
+                    dataset_image.create_renditions()
+                continue
+
+            if renditions != (dataset_image.renditions or []):
+                repaired_count += 1
+                if not self.dry_run:
+                    dataset_image.set_renditions(renditions)
+
+        self.stdout.write('Dataset images: repaired {0} manifests, created the renditions of {1} images'.format(
+            repaired_count, created_count))
+
+
+    # thumbnail filenames: {blankname}-{crop_hash}-{feature_hash}-{size}{ext}, see get_thumb_filename
+    # source_ext: the extension of the original, thumbnails with a different modern extension get image_format
+    def parse_thumb_filename(self, blankname, thumbname, source_ext=None):
+
+        thumb_blankname, ext = os.path.splitext(thumbname)
+
+        if not thumb_blankname.startswith('{0}-'.format(blankname)):
+            return None
+
+        parts = thumb_blankname[len(blankname)+1:].split('-')
+
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+
+        rendition = {
+            'size': int(parts[2]),
+            'crop_hash': parts[0],
+            'feature_hash': parts[1],
+        }
+
+        if ext != source_ext:
+            for image_format, (pil_format, mime_type, format_ext) in MODERN_IMAGE_FORMATS.items():
+                if ext == format_ext:
+                    rendition['image_format'] = image_format
+
+        return rendition
+
+
+    def repair_image_stores(self):
+
+        repaired_count = 0
+
+        for image_store in ServerImageStore.objects.all().iterator(chunk_size=self.chunk_size):
+
+            if not image_store.source_image:
+                continue
+
+            image_path = image_store.source_image.path
+
+            if image_path.endswith('.svg'):
+                continue
+
+            blankname, source_ext = os.path.splitext(os.path.basename(image_path))
+            thumbfolder = os.path.join(os.path.dirname(image_path), ContentImageProcessing.thumbnails_folder_name)
+
+            renditions = {}
+
+            if os.path.isdir(thumbfolder):
+                for thumbname in os.listdir(thumbfolder):
+
+                    rendition = self.parse_thumb_filename(blankname, thumbname, source_ext=source_ext)
+
+                    if rendition is not None:
+                        rendition.update(read_image_metadata(os.path.join(thumbfolder, thumbname)))
+                        renditions[thumbname] = rendition
+
+            if renditions != (image_store.renditions or {}):
+                repaired_count += 1
+                if not self.dry_run:
+                    ServerImageStore.objects.filter(pk=image_store.pk).update(renditions=renditions)
+
+        self.stdout.write('Image stores: repaired {0} manifests'.format(repaired_count))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localcosmos_server', '0009_alter_servercontentimage_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverimagestore',
+            name='renditions',
+            field=models.JSONField(null=True),
+        ),
+    ]
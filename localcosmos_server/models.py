@@ -6,6 +6,7 @@ from django.db.models import Q
 from django.utils import timezone
 from django.urls import reverse
 from django.db import transaction
+from django.db.models.functions import Coalesce
 
 from django.templatetags.static import static
 
@@ -17,6 +18,8 @@ from django.contrib.contenttypes.fields import GenericRelation, GenericForeignKe
 
 from localcosmos_server.slugifier import create_unique_slug
 from localcosmos_server.utils import generate_md5, get_content_instance_app
+from localcosmos_server.image_renditions import (read_image_metadata, save_rendition, get_modern_image_formats,
+                                                  get_image_format_quality, MODERN_IMAGE_FORMATS)
 
 from content_licencing.models import ContentLicenceRegistry
 
@@ -202,9 +205,10 @@ class LocalcosmosUser(ServerContentImageMixin, AbstractUser):
 
         Dataset.objects.bulk_update(datasets, ['user'])
 
-    def dataset_count(self):
-        from localcosmos_server.datasets.models import Dataset
-        return Dataset.objects.filter(user=self).count()
+    # read from the denormalized counters, see UserDatasetCounter
+    def dataset_count(self, app_uuid=None):
+        from localcosmos_server.datasets.models import UserDatasetCounter
+        return UserDatasetCounter.objects.get_dataset_count(self, app_uuid=app_uuid)
 
     # do not alter the delete method
     def delete(self, using=None, keep_parents=False):
@@ -753,6 +757,9 @@ class ServerImageStore(ImageStoreAbstract):
     
     source_image = models.ImageField(upload_to=get_image_store_path)
 
+    # manifest of the thumbnails, see ContentImageProcessing.record_renditions
+    renditions = models.JSONField(null=True)
+
 
 class ContentImageAbstract(models.Model):
 
@@ -815,35 +822,96 @@ class ContentImageAbstract(models.Model):
         abstract=True
 
 
-import hashlib
+# jsonb || jsonb, merges objects and appends to arrays in the database
+class JSONConcat(models.Func):
+    arg_joiner = ' || '
+    template = '%(expressions)s'
+    output_field = models.JSONField()
+
+
+import hashlib, math
 from PIL import Image
+
+'''
+    Thumbnails of content images
+    - the thumbnails of an image store are recorded in a manifest, ImageStore.renditions:
+      {thumbname: {'size', 'crop_hash', 'feature_hash', 'format', 'width', 'height', 'bytes'}}
+    - urls of recorded thumbnails are computed without touching the disk,
+      the management command repair_image_renditions reconciles the manifests with the files
+    - image stores without a renditions field (app_kit) check the disk as before
+'''
 class ContentImageProcessing:
 
-    def get_thumb_filename(self, size=400):
+    thumbnails_folder_name = 'thumbnails'
+
+    def get_crop_hash(self):
+        if self.crop_parameters:
+            return hashlib.md5(self.crop_parameters.encode('utf-8')).hexdigest()
+        return 'uncropped'
+
+    def get_feature_hash(self):
+        if self.features:
+            features_str = json.dumps(self.features)
+            return hashlib.md5(features_str.encode('utf-8')).hexdigest()
+        return 'nofeatures'
+
+    # image_format: one of MODERN_IMAGE_FORMATS, None is the format of the original
+    def get_thumb_filename(self, size=400, image_format=None):
 
         if self.image_store.source_image:
             filename = os.path.basename(self.image_store.source_image.path)
             blankname, ext = os.path.splitext(filename)
 
-            suffix = 'uncropped'
-            if self.crop_parameters:
-                suffix = hashlib.md5(
-                    self.crop_parameters.encode('utf-8')).hexdigest()
-
-            feature_suffix = 'nofeatures'
-            if self.features:
-                features_str = json.dumps(self.features)
-                feature_suffix = hashlib.md5(
-                    features_str.encode('utf-8')).hexdigest()
+            if image_format:
+                ext = MODERN_IMAGE_FORMATS[image_format][2]
 
             thumbname = '{0}-{1}-{2}-{3}{4}'.format(
-                blankname, suffix, feature_suffix, size, ext)
+                blankname, self.get_crop_hash(), self.get_feature_hash(), size, ext)
             return thumbname
 
         else:
             return 'noimage.png'
 
 
+    def get_thumb_url(self, thumbname):
+        return os.path.join(os.path.dirname(self.image_store.source_image.url), self.thumbnails_folder_name,
+            thumbname)
+
+
+    def has_rendition_manifest(self):
+        return hasattr(self.image_store, 'renditions')
+
+
+    def has_rendition(self, thumbname):
+        renditions = getattr(self.image_store, 'renditions', None)
+        return renditions is not None and thumbname in renditions
+
+
+    # renditions: [(thumbname, size, thumbpath, metadata)]
+    # metadata is returned by save_rendition, without it the header of the file is read
+    def record_renditions(self, renditions):
+
+        recorded = {}
+
+        for thumbname, size, thumbpath, metadata in renditions:
+
+            if metadata is None:
+                metadata = read_image_metadata(thumbpath)
+
+            recorded[thumbname] = dict(size=size, crop_hash=self.get_crop_hash(),
+                feature_hash=self.get_feature_hash(), **metadata)
+
+        # concurrent requests may record thumbnails of the same image store
+        self.image_store.__class__.objects.filter(pk=self.image_store.pk).update(
+            renditions=JSONConcat(Coalesce('renditions', models.Value({}, output_field=models.JSONField())),
+                models.Value(recorded, output_field=models.JSONField())))
+
+        if self.image_store.renditions is None:
+            self.image_store.renditions = {}
+
+        self.image_store.renditions.update(recorded)
+
+
     def plot_features(self, pil_image):
         raise NotImplementedError('Plotting Features not supported by LC Server')
 
@@ -929,58 +997,279 @@ class ContentImageProcessing:
         return cropped_canvas
 
 
-    def image_url(self, size=400, force=False):
+    # the crop box in coordinates of the original image: (left, top, right, bottom)
+    # crop_parameters: {"x":253,"y":24,"width":454,"height":454,"rotate":0,"scaleX":1,"scaleY":1}
+    def get_crop_box(self, original_width, original_height):
 
-        if self.image_store.source_image.path.endswith('.svg'):
-            thumburl = self.image_store.source_image.url
+        if self.crop_parameters:
+            crop_parameters = json.loads(self.crop_parameters)
+
+            return (
+                crop_parameters['x'],
+                crop_parameters['y'],
+                crop_parameters['x'] + crop_parameters['width'],
+                crop_parameters['y'] + crop_parameters['height'],
+            )
+
+        return (0, 0, original_width, original_height)
+
+
+    '''
+        the results of get_in_memory_processed_image for several sizes, without a canvas of the size of the original
+        - the crop box is mapped onto the source, a canvas is only created for the crop box if it extends past
+          the edges of the original. As in get_in_memory_processed_image, the part of the box inside the square
+          around the original is white
+        - the source is decoded and cropped once, JPEGs at the smallest scale which still covers the largest
+          thumbnail (draft mode). The thumbnails are computed from this intermediate, largest first
+        - JPEGs are opaque, they are processed as RGB instead of RGBA
+        - returns ({size: image}, format of the original)
+    '''
+    def get_lean_processed_images(self, image_path, sizes):
+
+        # only reads the header
+        image = Image.open(image_path)
+        image_format = image.format
 
+        original_width, original_height = image.size
+
+        larger_original_side = max(original_width, original_height)
+
+        box = self.get_crop_box(original_width, original_height)
+        box_width = box[2] - box[0]
+        box_height = box[3] - box[1]
+
+        # the bounds of the thumbnail of each size, see get_in_memory_processed_image
+        thumbnail_sizes = {}
+        for size in sizes:
+
+            thumbnail_size = min(size, larger_original_side)
+
+            if self.crop_parameters:
+                thumbnail_sizes[size] = (thumbnail_size, thumbnail_size)
+            else:
+                thumbnail_sizes[size] = (thumbnail_size, original_height * original_width / thumbnail_size)
+
+        scale = max([min(1, width / box_width, height / box_height) for width, height in thumbnail_sizes.values()])
+
+        if image_format == 'JPEG':
+            mode = 'RGB'
+            fill_color = (255, 255, 255)
+            outside_color = (0, 0, 0)
+
+            if scale < 1:
+                image.draft(None, (math.ceil(original_width * scale), math.ceil(original_height * scale)))
         else:
+            mode = 'RGBA'
+            fill_color = (255, 255, 255, 255)
+            outside_color = (0, 0, 0, 0)
+
+        # the decoded image may be smaller than the original
+        factor = original_width / image.size[0]
+
+        left, top, right, bottom = [int(round(coordinate / factor)) for coordinate in box]
+        width, height = image.size
+
+        inner_box = (max(left, 0), max(top, 0), min(right, width), min(bottom, height))
+        has_inner_box = inner_box[2] > inner_box[0] and inner_box[3] > inner_box[1]
+
+        if inner_box == (left, top, right, bottom):
+            cropped_image = image.crop(inner_box)
+            if cropped_image.mode != mode:
+                cropped_image = cropped_image.convert(mode)
+
+        else:
+            cropped_image = Image.new(mode, (right - left, bottom - top), outside_color)
+
+            # the square around the original is white
+            square_size = larger_original_side / factor
+            square_left = -int((larger_original_side - original_width) / 2 / factor)
+            square_top = -int((larger_original_side - original_height) / 2 / factor)
+
+            white_box = (
+                max(left, square_left) - left,
+                max(top, square_top) - top,
+                min(right, square_left + int(square_size)) - left,
+                min(bottom, square_top + int(square_size)) - top,
+            )
+
+            if white_box[2] > white_box[0] and white_box[3] > white_box[1]:
+                cropped_image.paste(fill_color, white_box)
+
+            if has_inner_box:
+                inner_image = image.crop(inner_box)
+                if inner_image.mode != mode:
+                    inner_image = inner_image.convert(mode)
+
+                cropped_image.paste(inner_image, (inner_box[0] - left, inner_box[1] - top))
+
+        processed_images = {}
+
+        # largest first, each size from the previous one
+        resized_image = cropped_image
+        for size in sorted(sizes, reverse=True):
+
+            resized_image = resized_image.copy()
+            resized_image.thumbnail(thumbnail_sizes[size], Image.LANCZOS)
+
+            processed_image = resized_image
+            if image_format != 'PNG':
+                processed_image = processed_image.convert('RGB')
+
+            processed_images[size] = processed_image
+
+        return processed_images, image_format
+
+
+    def get_lean_processed_image(self, image_path, size):
+        processed_images, image_format = self.get_lean_processed_images(image_path, [size])
+        return processed_images[size], image_format
+
+
+    # features are plotted onto the full canvas of get_in_memory_processed_image
+    # the source is decoded once for all sizes
+    def get_processed_images(self, image_path, sizes):
+
+        if self.features:
+            original_image = Image.open(image_path)
+
+            processed_images = {}
+            for size in sizes:
+                processed_images[size] = self.get_in_memory_processed_image(original_image, size)
+
+            return processed_images, original_image.format
+
+        return self.get_lean_processed_images(image_path, sizes)
+
+
+    def get_processed_image(self, image_path, size):
+        processed_images, image_format = self.get_processed_images(image_path, [size])
+        return processed_images[size], image_format
+
+
+    '''
+        the thumbnail urls of several sizes: {size: url}
+        - recorded thumbnails are not checked on disk
+        - the missing thumbnails are created from one decode of the source, see get_processed_images
+    '''
+    # image_format: a modern format, sizes without a recorded thumbnail in this format fall back to the original
+    def get_image_urls(self, sizes, force=False, image_format=None):
+
+        image_format_requested = image_format
+
+        if self.image_store.source_image.path.endswith('.svg'):
+            source_url = self.image_store.source_image.url
+            return {size: source_url for size in sizes}
+
+        thumbnames = {size: self.get_thumb_filename(size) for size in sizes}
+
+        missing_sizes = [size for size in sizes if force == True or not self.has_rendition(thumbnames[size])]
+
+        if missing_sizes:
 
             image_path = self.image_store.source_image.path
             folder_path = os.path.dirname(image_path)
 
-            thumbname = self.get_thumb_filename(size)
-
-            thumbfolder = os.path.join(folder_path, 'thumbnails')
+            thumbfolder = os.path.join(folder_path, self.thumbnails_folder_name)
             if not os.path.isdir(thumbfolder):
                 os.makedirs(thumbfolder)
 
-            thumbpath = os.path.join(thumbfolder, thumbname)
+            thumbpaths = {size: os.path.join(thumbfolder, thumbnames[size]) for size in missing_sizes}
+
+            create_sizes = [size for size in missing_sizes if force == True or not os.path.isfile(thumbpaths[size])]
+
+            has_rendition_manifest = self.has_rendition_manifest()
+
+            # only recorded thumbnails in modern formats are served
+            image_formats = []
+            if has_rendition_manifest:
+                image_formats = get_modern_image_formats()
+
+            renditions = [(thumbnames[size], size, thumbpaths[size], None) for size in missing_sizes
+                          if size not in create_sizes]
+
+            if create_sizes:
+
+                processed_images, original_format = self.get_processed_images(image_path, create_sizes)
+
+                for size, processed_image in processed_images.items():
+
+                    saved = save_rendition(processed_image, thumbpaths[size], original_format,
+                        image_formats=image_formats, quality=get_image_format_quality())
+
+                    for metadata in saved:
+                        image_format = metadata.get('image_format', None)
+                        thumbname = self.get_thumb_filename(size, image_format=image_format)
+                        renditions.append((thumbname, size, os.path.join(thumbfolder, thumbname), metadata))
 
-            if not os.path.isfile(thumbpath) or force == True:
+            if has_rendition_manifest:
+                self.record_renditions(renditions)
 
-                original_image = Image.open(self.image_store.source_image.path)
+        urls = {}
 
-                processed_image = self.get_in_memory_processed_image(
-                    original_image, size)
+        for size in sizes:
 
-                processed_image.save(thumbpath, original_image.format)
+            thumbname = thumbnames[size]
 
-            thumburl = os.path.join(os.path.dirname(
-                self.image_store.source_image.url), 'thumbnails', thumbname)
+            if image_format_requested:
+                modern_thumbname = self.get_thumb_filename(size, image_format=image_format_requested)
+                if self.has_rendition(modern_thumbname):
+                    thumbname = modern_thumbname
 
-        return thumburl
+            urls[size] = self.get_thumb_url(thumbname)
+
+        return urls
+
+
+    def image_url(self, size=400, force=False, image_format=None):
+        return self.get_image_urls([size], force=force, image_format=image_format)[size]
     
     
-    def image_urls(self, image_sizes=['regular', 'large']):
+    def image_urls(self, image_sizes=['regular', 'large'], image_format=None):
         
-        image_urls = {}
+        size_names = {}
         
         for image_sizes_key in image_sizes:
             for size_name, size in IMAGE_SIZES[image_sizes_key].items():
-                
-                image_url = self.image_url(size)
-                
-                image_urls[size_name] = image_url
+                size_names[size_name] = size
+
+        urls = self.get_image_urls(set(size_names.values()), image_format=image_format)
+
+        image_urls = {size_name: urls[size] for size_name, size in size_names.items()}
         
         return image_urls
 
 
-    def srcset(self, request=None, force=False):
+    # the urls of the recorded thumbnails in modern formats: {image_format: {size_name: url}}
+    def image_format_urls(self, image_sizes=['regular', 'large']):
+
+        # creates the missing thumbnails
+        self.image_urls(image_sizes=image_sizes)
+
+        image_format_urls = {}
+
+        for image_format in MODERN_IMAGE_FORMATS.keys():
+
+            image_urls = {}
+
+            for image_sizes_key in image_sizes:
+                for size_name, size in IMAGE_SIZES[image_sizes_key].items():
+                    thumbname = self.get_thumb_filename(size, image_format=image_format)
+                    if self.has_rendition(thumbname):
+                        image_urls[size_name] = self.get_thumb_url(thumbname)
+
+            if image_urls:
+                image_format_urls[image_format] = image_urls
+
+        return image_format_urls
+
+
+    def srcset(self, request=None, force=False, image_format=None):
+
+        urls = self.get_image_urls([200, 400], force=force, image_format=image_format)
         
         srcset = {
-            '1x' : self.image_url(size=200, force=force),
-            '2x' : self.image_url(size=400, force=force),
+            '1x' : urls[200],
+            '2x' : urls[400],
         }
 
         if request:
@@ -1236,4 +1525,114 @@ class ExternalMediaAbstract(models.Model):
 
 
 class ServerExternalMedia(ExternalMediaAbstract):
-    pass
\ No newline at end of file
+    pass
+
+
+'''--------------------------------------------------------------------------------------------------------------
+    BACKGROUND JOBS
+    - jobs are stored in the database and processed by management commands (workers)
+    - several workers can run in parallel: SELECT ... FOR UPDATE SKIP LOCKED hands each job to exactly one worker
+--------------------------------------------------------------------------------------------------------------'''
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_FINISHED = 'finished'
+JOB_STATUS_FAILED = 'failed'
+JOB_STATUS_CANCELLED = 'cancelled'
+
+JOB_STATUS_CHOICES = (
+    (JOB_STATUS_QUEUED, _('Queued')),
+    (JOB_STATUS_RUNNING, _('Running')),
+    (JOB_STATUS_FINISHED, _('Finished')),
+    (JOB_STATUS_FAILED, _('Failed')),
+    (JOB_STATUS_CANCELLED, _('Cancelled')),
+)
+
+
+class QueuedJobManager(models.Manager):
+
+    # mark up to batch_size queued jobs as running and return them
+    # jobs locked by other workers and failed jobs whose retry_at has not been reached are skipped
+    def claim(self, batch_size=10, **filters):
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            queryset = self.select_for_update(skip_locked=True).filter(
+                models.Q(retry_at__isnull=True) | models.Q(retry_at__lte=now), status=JOB_STATUS_QUEUED, **filters)
+            jobs = list(queryset.order_by('pk')[:batch_size])
+
+            for job in jobs:
+                job.status = JOB_STATUS_RUNNING
+                job.started_at = now
+                job.attempts = job.attempts + 1
+
+            self.bulk_update(jobs, ['status', 'started_at', 'attempts'])
+
+        return jobs
+
+    # jobs of a crashed worker remain 'running' forever, hand them to the queue again
+    # the crash counts as a failed attempt: jobs without attempts left fail, the others are retried with the
+    # delay of QueuedJobAbstract.set_failed, a job which kills its worker is not requeued forever
+    def requeue_stale(self, timeout=timedelta(hours=1)):
+
+        now = timezone.now()
+        error = 'The worker stopped while processing the job'
+
+        stale_jobs = self.filter(status=JOB_STATUS_RUNNING, started_at__lt=now - timeout)
+
+        stale_jobs.filter(attempts__gte=self.model.max_attempts).update(status=JOB_STATUS_FAILED, error=error,
+            finished_at=now)
+
+        requeued_count = 0
+
+        for attempts in range(0, self.model.max_attempts):
+            retry_at = now + self.model.retry_delay * (2 ** max(attempts - 1, 0))
+            requeued_count += stale_jobs.filter(attempts=attempts).update(status=JOB_STATUS_QUEUED, error=error,
+                retry_at=retry_at)
+
+        return requeued_count
+
+
+class QueuedJobAbstract(models.Model):
+
+    # a job which failed this often is not retried anymore
+    max_attempts = 3
+
+    # a failed job is retried after retry_delay, doubled with every further attempt
+    retry_delay = timedelta(minutes=1)
+
+    status = models.CharField(max_length=50, choices=JOB_STATUS_CHOICES, default=JOB_STATUS_QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    retry_at = models.DateTimeField(null=True, blank=True)
+
+    objects = QueuedJobManager()
+
+    def set_finished(self):
+        self.status = JOB_STATUS_FINISHED
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'finished_at'])
+
+    def set_failed(self, error):
+        self.error = error
+
+        if self.attempts < self.max_attempts:
+            self.status = JOB_STATUS_QUEUED
+            self.retry_at = timezone.now() + self.retry_delay * (2 ** max(self.attempts - 1, 0))
+        else:
+            self.status = JOB_STATUS_FAILED
+            self.finished_at = timezone.now()
+
+        self.save(update_fields=['status', 'error', 'finished_at', 'retry_at'])
+
+    def set_cancelled(self):
+        self.status = JOB_STATUS_CANCELLED
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'finished_at'])
+
+    class Meta:
+        abstract = True
@@ -107,4 +107,40 @@ LOCALCOSMOS_ENABLE_GOOGLE_CLOUD_API = False
 LOGIN_REDIRECT_URL = '/server/control-panel/'
 
 
-LOCALCOSMOS_SERVER_PUBLISH_INVALID_DATA = True
\ No newline at end of file
+LOCALCOSMOS_SERVER_PUBLISH_INVALID_DATA = True
+
+# if True, creating a dataset only enqueues its validation
+# run the management command process_dataset_validation_jobs to process the queue
+LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION = False
+
+# if True, creating a dataset only enqueues the awarding of achievements
+# run the management command process_achievements_jobs to process the queue
+LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS = False
+
+# if True, dataset exports are only enqueued in the app admin
+# run the management command process_dataset_export_jobs to process the queue
+LOCALCOSMOS_SERVER_ASYNC_DATASET_EXPORTS = False
+
+# export files are deleted after this number of days
+LOCALCOSMOS_SERVER_DATASET_EXPORT_RETENTION_DAYS = 7
+
+# tombstones of deleted datasets are kept for this number of days, delta sync cursors expire after it
+# run the management command prune_dataset_tombstones to delete expired tombstones
+LOCALCOSMOS_SERVER_DATASET_TOMBSTONE_RETENTION_DAYS = 90
+
+# if True, uploading a dataset image only enqueues the creation of its resized images
+# run the management command process_dataset_image_rendition_jobs to process the queue
+LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS = False
+
+# resized images are also saved in these formats, in the order of preference
+# formats the installed Pillow can not write are skipped, an empty list disables modern formats
+LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS = ['avif', 'webp']
+
+# the quality of resized images per format
+LOCALCOSMOS_SERVER_IMAGE_FORMAT_QUALITY = {
+    'webp': 80,
+    'avif': 60,
+}
+
+# the largest radius in meters of the nearby datasets api, also the default radius of Dataset.nearby()
+LOCALCOSMOS_SERVER_NEARBY_DATASETS_MAX_DISTANCE = 10000
@@ -6,6 +6,7 @@ from localcosmos_server.template_content.models import (LocalizedTemplateContent
 from content_licencing.models import ContentLicenceRegistry
 
 from localcosmos_server.template_content.utils import get_component_image_type, get_published_image_type
+from localcosmos_server.image_renditions import get_preferred_image_format
 
 # do not replace camelCase with underscore_case without adapting app_kit's ContentImageBuilder.build_licence
 class LocalizedTemplateContentSerializer(serializers.ModelSerializer):
@@ -108,7 +109,7 @@ class LocalizedTemplateContentSerializer(serializers.ModelSerializer):
             image_data = []
             for content_image in content_images:
 
-                serializer = ContentImageSerializer(content_image)
+                serializer = ContentImageSerializer(content_image, context=self.context)
                 image_data.append(serializer.data)
 
             return image_data
@@ -118,7 +119,7 @@ class LocalizedTemplateContentSerializer(serializers.ModelSerializer):
 
             if content_image:
 
-                serializer = ContentImageSerializer(content_image)
+                serializer = ContentImageSerializer(content_image, context=self.context)
                 image_data = serializer.data
                 return image_data
 
@@ -376,13 +377,25 @@ class ContentLicenceSerializer(serializers.ModelSerializer):
 class ContentImageSerializer(serializers.Serializer):
     
     imageUrl = serializers.SerializerMethodField()
+    imageFormats = serializers.SerializerMethodField()
     title = serializers.SerializerMethodField()
     text = serializers.SerializerMethodField()
     altText = serializers.SerializerMethodField()
     licence = serializers.SerializerMethodField()
 
+    # webp/avif if the client accepts it, see get_preferred_image_format
     def get_imageUrl(self, content_image):
-        return content_image.image_urls()
+
+        image_format = None
+
+        request = self.context.get('request', None)
+        if request is not None:
+            image_format = get_preferred_image_format(request)
+
+        return content_image.image_urls(image_format=image_format)
+
+    def get_imageFormats(self, content_image):
+        return content_image.image_format_urls()
 
     def get_licence(self, content_image):
 
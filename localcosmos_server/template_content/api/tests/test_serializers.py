@@ -163,6 +163,7 @@ class LTCPreviewTestsMixin:
                 '2x': content_image.image_url(size=500),
                 '4x': content_image.image_url(size=1000),
             },
+            'imageFormats': content_image.image_format_urls(),
             'title': None,
             'text': None,
             'altText': None,
@@ -209,6 +210,7 @@ class LTCPreviewTestsMixin:
                 '2x': content_image.image_url(size=500),
                 '4x': content_image.image_url(size=1000),
             },
+            'imageFormats': content_image.image_format_urls(),
             'title': None,
             'text': None,
             'altText': None,
@@ -285,6 +287,7 @@ class LTCPreviewTestsMixin:
                     '2x': content_image.image_url(size=500),
                     '4x': content_image.image_url(size=1000),
                 },
+                'imageFormats': content_image.image_format_urls(),
                 'title': None,
                 'text': None,
                 'altText': None,
@@ -364,6 +367,7 @@ class LTCPreviewTestsMixin:
                             '2x': multi_component_image.image_url(size=500),
                             '4x': multi_component_image.image_url(size=1000),
                         },
+                        'imageFormats': multi_component_image.image_format_urls(),
                         'title': None,
                         'text': None,
                         'altText': None,
@@ -394,6 +398,7 @@ class LTCPreviewTestsMixin:
                         '2x': component_image.image_url(size=500),
                         '4x': component_image.image_url(size=1000),
                     },
+                    'imageFormats': component_image.image_format_urls(),
                     'title': None,
                     'text': None,
                     'altText': None,
@@ -412,6 +417,7 @@ class LTCPreviewTestsMixin:
                     '2x': content_image.image_url(size=500),
                     '4x': content_image.image_url(size=1000),
                 },
+                'imageFormats': content_image.image_format_urls(),
                 'title': None,
                 'text': None,
                 'altText': None,
@@ -430,6 +436,7 @@ class LTCPreviewTestsMixin:
                         '2x': content_image_multiple.image_url(size=500),
                         '4x': content_image_multiple.image_url(size=1000),
                     },
+                    'imageFormats': content_image_multiple.image_format_urls(),
                     'title': None,
                     'text': None,
                     'altText': None,
@@ -461,6 +468,7 @@ class LTCPreviewTestsMixin:
                             '2x': stream_item_image.image_url(size=500),
                             '4x': stream_item_image.image_url(size=1000),
                         },
+                        'imageFormats': stream_item_image.image_format_urls(),
                         'title': None,
                         'text': None,
                         'altText': None,
@@ -825,6 +833,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                 '2x': content_image.image_url(size=500),
                 '4x': content_image.image_url(size=1000),
             },
+            'imageFormats': content_image.image_format_urls(),
             'title': None,
             'text': None,
             'altText': None,
@@ -873,6 +882,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                 '2x': content_image.image_url(size=500),
                 '4x': content_image.image_url(size=1000),
             },
+            'imageFormats': content_image.image_format_urls(),
             'title': None,
             'text': None,
             'altText': None,
@@ -951,6 +961,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                     '2x': content_image.image_url(size=500),
                     '4x': content_image.image_url(size=1000),
                 },
+                'imageFormats': content_image.image_format_urls(),
                 'title': None,
                 'text': None,
                 'altText': None,
@@ -1032,6 +1043,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                             '2x': multi_component_image.image_url(size=500),
                             '4x': multi_component_image.image_url(size=1000),
                         },
+                        'imageFormats': multi_component_image.image_format_urls(),
                         'title': None,
                         'text': None,
                         'altText': None,
@@ -1062,6 +1074,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                         '2x': component_image.image_url(size=500),
                         '4x': component_image.image_url(size=1000),
                     },
+                    'imageFormats': component_image.image_format_urls(),
                     'title': None,
                     'text': None,
                     'altText': None,
@@ -1080,6 +1093,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                     '2x': content_image.image_url(size=500),
                     '4x': content_image.image_url(size=1000),
                 },
+                'imageFormats': content_image.image_format_urls(),
                 'title': None,
                 'text': None,
                 'altText': None,
@@ -1098,6 +1112,7 @@ class TestPublishedLocalizedTemplateContentSerializer(LTCPreviewTestsMixin, With
                         '2x': content_image_multiple.image_url(size=500),
                         '4x': content_image_multiple.image_url(size=1000),
                     },
+                    'imageFormats': content_image_multiple.image_format_urls(),
                     'title': None,
                     'text': None,
                     'altText': None,
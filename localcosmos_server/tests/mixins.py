@@ -2,6 +2,7 @@ from django.conf import settings
 from django.test import RequestFactory, Client
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 
 from django.contrib.contenttypes.models import ContentType
 
@@ -17,6 +18,8 @@ from localcosmos_server.tests.common import (powersetdic, TEST_MEDIA_ROOT, TEST_
 
 from django.utils import timezone
 
+from io import StringIO
+
 import os, shutil, json
 
 from localcosmos_server.datasets.models import ObservationForm, Dataset
@@ -496,4 +499,28 @@ class ViewTestMixin:
         view.request = request
         view.kwargs = self.get_url_kwargs()
 
-        return view
\ No newline at end of file
+        return view
+
+'''
+    runs command_name with get_command_args() followed by the arguments of the test, returns stdout
+'''
+class CommandTestMixin:
+
+    command_name = None
+
+    command_args = []
+
+    def get_command_args(self):
+        return list(self.command_args)
+
+    def call_command(self, *args, **kwargs):
+        out = StringIO()
+        call_command(
+            self.command_name,
+            *self.get_command_args(),
+            *args,
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs,
+        )
+        return out.getvalue()
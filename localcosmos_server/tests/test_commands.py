@@ -1,17 +1,42 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from localcosmos_server.tests.mixins import (WithObservationForm, WithApp, WithUser)
+from localcosmos_server.tests.mixins import (WithObservationForm, WithApp, WithUser, CommandTestMixin,
+    WithValidationRoutine, WithMedia, WithServerContentImage)
 
 from io import StringIO
 
 from django.core.management import call_command
 
-from localcosmos_server.datasets.models import ObservationForm, Dataset
+from localcosmos_server.datasets.models import (ObservationForm, Dataset, DatasetValidationJob,
+    DATASET_VALIDATION_CHOICES, DatasetAchievementsJob, DatasetExportJob, DarwinCoreViewRefresh, UserDatasetCounter,
+    DatasetTombstone, DatasetImageRenditionJob, DATASET_IMAGE_RENDITIONS)
 
-from localcosmos_server.models import App
+from localcosmos_server.models import (App, JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_FAILED,
+    JOB_STATUS_FINISHED, JOB_STATUS_CANCELLED, ServerImageStore)
 
 from localcosmos_server.management.commands.create_test_datasets import DATASET_COUNT
 
+from django.utils import timezone
+
+from datetime import timedelta
+
+from unittest import mock
+
+from localcosmos_server.tests.common import test_settings
+
+from localcosmos_server.datasets.field_filters import get_field_index_name, DATA_GIN_INDEX_NAME
+
+import json, os, tempfile, zipfile
+
+from localcosmos_server.achievements.factor_types import FACTOR_DATASET_CREATED, FACTOR_IS_FIRST_DATASET_FOR_USER
+
+from localcosmos_server.achievements.models import PointRule, PointRuleCondition, UserPoints
+
+from django.db import connection
+
+from localcosmos_server.datasets.darwin_core_sql import (get_darwin_core_view_create_sql,
+    get_darwin_core_materialized_view_create_sql, get_darwin_core_view_name)
+
 class TestCreateTestData(WithObservationForm, WithApp, WithUser, TestCase):
 
     def call_command(self, *args, **kwargs):
@@ -47,3 +72,831 @@ class TestCreateTestData(WithObservationForm, WithApp, WithUser, TestCase):
             self.assertTrue(ds.taxon_latname is not None)
             #print(ds.taxon_latname)
 
+
+
+class TestProcessDatasetValidationJobs(CommandTestMixin, WithValidationRoutine, WithObservationForm, WithApp, WithUser,
+    TestCase):
+
+    command_name = 'process_dataset_validation_jobs'
+
+    command_args = ['--once']
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION=True)
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.validation_step, None)
+        self.assertTrue(DatasetValidationJob.objects.filter(dataset=dataset).exists())
+
+        self.call_command()
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.validation_step, 'completed')
+        self.assertTrue(dataset.is_valid)
+        self.assertFalse(DatasetValidationJob.objects.filter(dataset=dataset).exists())
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION=True)
+    def test_command_with_validation_routine(self):
+
+        self.create_validation_routine()
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        self.call_command()
+
+        # the first step is a human interaction step, the dataset waits for review
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.validation_step, DATASET_VALIDATION_CHOICES[0][0])
+        self.assertFalse(dataset.is_valid)
+        self.assertFalse(DatasetValidationJob.objects.filter(dataset=dataset).exists())
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION=True)
+    def test_failed_job(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        job = DatasetValidationJob.objects.get(dataset=dataset)
+
+        with mock.patch.object(Dataset, 'validate', side_effect=ValueError('validation failed')):
+
+            for attempt in range(1, job.max_attempts + 1):
+
+                self.call_command()
+
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                self.assertIn('validation failed', job.error)
+
+                if attempt < job.max_attempts:
+                    self.assertEqual(job.status, JOB_STATUS_QUEUED)
+                    self.assertTrue(job.retry_at > timezone.now())
+
+                    # not retried before retry_at
+                    self.call_command()
+                    job.refresh_from_db()
+                    self.assertEqual(job.attempts, attempt)
+
+                    DatasetValidationJob.objects.filter(pk=job.pk).update(retry_at=timezone.now())
+
+        self.assertEqual(job.status, JOB_STATUS_FAILED)
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION=True)
+    def test_stale_job(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        job = DatasetValidationJob.objects.get(dataset=dataset)
+
+        # the worker which claimed the job has crashed
+        DatasetValidationJob.objects.filter(pk=job.pk).update(status=JOB_STATUS_RUNNING, attempts=1,
+            started_at=timezone.now() - timedelta(days=1))
+
+        self.call_command()
+
+        # the crash counts as a failed attempt, the job is retried after retry_at
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertTrue(job.retry_at > timezone.now())
+        self.assertTrue(job.error is not None)
+
+        DatasetValidationJob.objects.filter(pk=job.pk).update(retry_at=timezone.now())
+
+        self.call_command()
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.validation_step, 'completed')
+        self.assertFalse(DatasetValidationJob.objects.filter(dataset=dataset).exists())
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_VALIDATION=True)
+    def test_stale_job_without_attempts_left(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        job = DatasetValidationJob.objects.get(dataset=dataset)
+
+        # the job has crashed its worker on every attempt
+        DatasetValidationJob.objects.filter(pk=job.pk).update(status=JOB_STATUS_RUNNING,
+            attempts=job.max_attempts, started_at=timezone.now() - timedelta(days=1))
+
+        self.call_command()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_FAILED)
+        self.assertTrue(job.finished_at is not None)
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.validation_step, None)
+
+
+
+class TestCreateDatasetFieldIndexes(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'create_dataset_field_indexes'
+
+    def get_command_args(self):
+        return [self.app.uid, '--dry-run']
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        self.create_dataset(observation_form)
+
+        out = self.call_command()
+        self.assertIn('has no filterable fields', out)
+
+        filterable_fields = {}
+        for field in self.observation_form_json['fields']:
+            if field['fieldClass'] in ['IntegerField', 'ChoiceField', 'MultipleChoiceField', 'PictureField']:
+                field['definition']['isFilterable'] = True
+                filterable_fields[field['fieldClass']] = field['uuid']
+
+        observation_form.definition = self.observation_form_json
+        observation_form.save()
+
+        out = self.call_command()
+
+        self.assertIn(get_field_index_name(filterable_fields['IntegerField']), out)
+        self.assertIn(get_field_index_name(filterable_fields['ChoiceField']), out)
+        self.assertIn(DATA_GIN_INDEX_NAME, out)
+        self.assertNotIn(get_field_index_name(filterable_fields['PictureField']), out)
+
+
+
+class TestBackfillDatasetColumns(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'backfill_dataset_columns'
+
+    command_args = ['--workers', '1', '--chunk-size', '1']
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+
+        dataset.refresh_from_db()
+        timestamp = dataset.timestamp
+        taxon_latname = dataset.taxon_latname
+        self.assertTrue(timestamp is not None)
+
+        out = self.call_command()
+        self.assertIn('Updated 0 changed datasets, 2 datasets processed', out)
+
+        Dataset.objects.filter(pk=dataset.pk).update(timestamp=None, taxon_latname='Wrong')
+
+        out = self.call_command('--dry-run')
+        self.assertIn('Found 1 changed datasets', out)
+        self.assertIn('Dataset {0}: timestamp'.format(dataset.pk), out)
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.timestamp, None)
+
+        out = self.call_command()
+        self.assertIn('Updated 1 changed datasets', out)
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.timestamp, timestamp)
+        self.assertEqual(dataset.taxon_latname, taxon_latname)
+
+
+    @test_settings
+    def test_checkpoint(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, 'checkpoint.json')
+
+            self.call_command('--checkpoint', checkpoint_path)
+
+            with open(checkpoint_path, 'r') as checkpoint_file:
+                self.assertEqual(json.load(checkpoint_file)['completed_pk'], dataset_2.pk)
+
+            Dataset.objects.filter(pk=dataset.pk).update(timestamp=None)
+
+            # the completed datasets are skipped
+            out = self.call_command('--checkpoint', checkpoint_path)
+            self.assertIn('Resuming after pk {0}'.format(dataset_2.pk), out)
+            self.assertIn('0 datasets processed', out)
+
+
+    @test_settings
+    def test_checkpoint_failed_dataset(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+        dataset_3 = self.create_dataset(observation_form)
+
+        update_reference_columns = Dataset.update_reference_columns
+
+        def fail_dataset_2(dataset_instance):
+            if dataset_instance.pk == dataset_2.pk:
+                raise ValueError('invalid data')
+            update_reference_columns(dataset_instance)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, 'checkpoint.json')
+
+            with mock.patch.object(Dataset, 'update_reference_columns', autospec=True,
+                                   side_effect=fail_dataset_2):
+                self.call_command('--checkpoint', checkpoint_path)
+
+            # the checkpoint stops before the failed dataset, the datasets after it are processed anyway
+            with open(checkpoint_path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+
+            self.assertEqual(checkpoint['completed_pk'], dataset_2.pk - 1)
+            self.assertEqual(checkpoint['failed_pks'], [dataset_2.pk])
+
+            # the failed dataset is retried
+            out = self.call_command('--checkpoint', checkpoint_path)
+            self.assertIn('Resuming after pk {0}'.format(dataset_2.pk - 1), out)
+            self.assertIn('2 datasets processed', out)
+
+            with open(checkpoint_path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+
+            self.assertEqual(checkpoint['completed_pk'], dataset_3.pk)
+            self.assertEqual(checkpoint['failed_pks'], [])
+
+
+    @test_settings
+    def test_missing_reference(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset.refresh_from_db()
+        self.assertTrue(dataset.timestamp is not None)
+
+        data = dict(dataset.data)
+        del data[dataset.observation_form_index.temporal_reference]
+        Dataset.objects.filter(pk=dataset.pk).update(data=data)
+
+        out = self.call_command()
+        self.assertIn('Updated 1 changed datasets', out)
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.timestamp, None)
+
+
+
+@mock.patch('localcosmos_server.datasets.models.LOCALCOSMOS_SERVER_ACHIEVEMENTS_ENABLED', True)
+class TestProcessAchievementsJobs(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'process_achievements_jobs'
+
+    command_args = ['--once']
+
+    def create_rule(self):
+
+        rule = PointRule.objects.create(
+            app=self.app,
+            name='Dataset created',
+            points=1,
+            awarded_for='Dataset created',
+        )
+        PointRuleCondition.objects.create(
+            rule=rule,
+            factor_type=FACTOR_DATASET_CREATED,
+            operator='equals',
+            value_json=True,
+        )
+
+        return rule
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS=True)
+    def test_command(self):
+
+        user = self.create_user()
+        rule = self.create_rule()
+
+        observation_form = self.create_observation_form(observation_form_json=self.observation_form_point_json)
+        dataset = self.create_dataset(observation_form, user=user)
+
+        # only enqueued
+        self.assertEqual(UserPoints.objects.filter(user=user).count(), 0)
+        self.assertTrue(DatasetAchievementsJob.objects.filter(dataset=dataset).exists())
+
+        self.call_command()
+
+        self.assertEqual(UserPoints.objects.filter(user=user, rule=rule).count(), 1)
+        self.assertFalse(DatasetAchievementsJob.objects.filter(dataset=dataset).exists())
+
+        # a retried job does not award the points twice
+        DatasetAchievementsJob.objects.create(dataset=dataset)
+        self.call_command()
+
+        self.assertEqual(UserPoints.objects.filter(user=user, rule=rule).count(), 1)
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS=True)
+    def test_first_dataset(self):
+
+        user = self.create_user()
+
+        rule = PointRule.objects.create(app=self.app, name='First dataset', points=10,
+            awarded_for='First dataset bonus')
+        PointRuleCondition.objects.create(rule=rule, factor_type=FACTOR_IS_FIRST_DATASET_FOR_USER,
+            operator='equals', value_json=True)
+
+        observation_form = self.create_observation_form(observation_form_json=self.observation_form_point_json)
+        first_dataset = self.create_dataset(observation_form, user=user)
+
+        # later datasets of the user exist before the queue is processed
+        for i in range(0, 2):
+            self.create_dataset(observation_form, user=user)
+
+        self.call_command()
+
+        user_points = UserPoints.objects.filter(user=user, rule=rule)
+        self.assertEqual(user_points.count(), 1)
+        self.assertEqual(user_points.first().content_object, first_dataset)
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS=True)
+    def test_anonymous_dataset(self):
+
+        observation_form = self.create_observation_form(observation_form_json=self.observation_form_point_json)
+        dataset = self.create_dataset(observation_form)
+
+        self.assertFalse(DatasetAchievementsJob.objects.filter(dataset=dataset).exists())
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_ACHIEVEMENTS=True)
+    def test_requeue_stale_periodically(self):
+
+        observation_form = self.create_observation_form(observation_form_json=self.observation_form_point_json)
+        dataset = self.create_dataset(observation_form, user=self.create_user())
+
+        job = DatasetAchievementsJob.objects.get(dataset=dataset)
+
+        # the job has been claimed by another worker
+        DatasetAchievementsJob.objects.filter(pk=job.pk).update(status=JOB_STATUS_RUNNING, attempts=1,
+            started_at=timezone.now())
+
+        class StopWorker(Exception):
+            pass
+
+        # the other worker crashes while this worker waits for jobs
+        def sleep(seconds):
+            if sleep_mock.call_count > 1:
+                raise StopWorker()
+            DatasetAchievementsJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(days=1))
+
+        # without --once
+        with mock.patch('localcosmos_server.management.commands.process_achievements_jobs.time.sleep',
+                        side_effect=sleep) as sleep_mock:
+            with self.assertRaises(StopWorker):
+                call_command(self.command_name, '--requeue-interval', '0', stdout=StringIO(),
+                    stderr=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertTrue(job.retry_at > timezone.now())
+
+
+
+class TestProcessDatasetExportJobs(CommandTestMixin, WithMedia, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'process_dataset_export_jobs'
+
+    command_args = ['--once']
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form(observation_form_json=self.observation_form_point_json)
+        self.create_dataset(observation_form)
+        self.create_dataset(observation_form)
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+
+        self.call_command()
+
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, JOB_STATUS_FINISHED)
+        self.assertEqual(job.total_rows, 2)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertEqual(job.progress, 100)
+        self.assertTrue(job.filename.endswith('.csv'))
+
+        filepath = job.get_filepath(self.app)
+        self.assertTrue(os.path.isfile(filepath))
+        self.assertFalse(os.path.isfile('{0}.part'.format(filepath)))
+
+        with open(filepath, 'r') as csv_file:
+            # header + 2 datasets
+            self.assertEqual(len(csv_file.read().splitlines()), 3)
+
+
+    @test_settings
+    def test_cancelled_job(self):
+
+        observation_form = self.create_observation_form()
+        self.create_dataset(observation_form)
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+        job.request_cancel()
+
+        self.call_command()
+
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, JOB_STATUS_CANCELLED)
+        self.assertIsNone(job.filename)
+
+
+    @test_settings
+    def test_delete_expired(self):
+
+        observation_form = self.create_observation_form()
+        self.create_dataset(observation_form)
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+        self.call_command()
+
+        job.refresh_from_db()
+        filepath = job.get_filepath(self.app)
+        self.assertTrue(os.path.isfile(filepath))
+
+        DatasetExportJob.objects.filter(pk=job.pk).update(finished_at=timezone.now() - timedelta(days=8))
+
+        self.call_command()
+
+        self.assertFalse(DatasetExportJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(os.path.isfile(filepath))
+
+
+    @test_settings
+    def test_requeue_stale_periodically(self):
+
+        job = DatasetExportJob.objects.create(app_uuid=self.app.uuid, export_format='csv')
+
+        # the job has been claimed by another worker
+        DatasetExportJob.objects.filter(pk=job.pk).update(status=JOB_STATUS_RUNNING, attempts=1,
+            started_at=timezone.now())
+
+        class StopWorker(Exception):
+            pass
+
+        # the other worker crashes while this worker waits for jobs
+        def sleep(seconds):
+            if sleep_mock.call_count > 1:
+                raise StopWorker()
+            DatasetExportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(days=1))
+
+        # without --once
+        with mock.patch('localcosmos_server.management.commands.process_dataset_export_jobs.time.sleep',
+                        side_effect=sleep) as sleep_mock:
+            with self.assertRaises(StopWorker):
+                call_command(self.command_name, '--requeue-interval', '0', stdout=StringIO(),
+                    stderr=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertTrue(job.retry_at > timezone.now())
+
+
+
+class TestCreateDarwinCoreArchive(CommandTestMixin, WithMedia, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'create_darwin_core_archive'
+
+    def get_command_args(self):
+        return [self.app.uid, '--now']
+
+    def setUp(self):
+        super().setUp()
+
+        with connection.cursor() as cursor:
+            cursor.execute(get_darwin_core_view_create_sql(self.app))
+
+    def read_occurrence_ids(self, job):
+
+        with zipfile.ZipFile(job.get_filepath(self.app), 'r') as archive:
+            self.assertIn('meta.xml', archive.namelist())
+            self.assertIn('eml.xml', archive.namelist())
+
+            lines = archive.read('occurrence.txt').decode('utf-8').splitlines()
+
+        self.assertEqual(lines[0].split('\t')[0], 'occurrenceID')
+        return set([line.split('\t')[0] for line in lines[1:]])
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+
+        self.call_command()
+
+        job = DatasetExportJob.objects.get(app_uuid=self.app.uuid, export_format='dwca')
+
+        self.assertEqual(job.status, JOB_STATUS_FINISHED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.change_xid)
+        self.assertIsNotNone(job.change_sequence)
+        self.assertEqual(self.read_occurrence_ids(job), set([str(dataset.uuid), str(dataset_2.uuid)]))
+
+
+    @test_settings
+    def test_incremental(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+
+        self.call_command()
+
+        dataset_2.delete()
+        dataset_3 = self.create_dataset(observation_form)
+
+        self.call_command('--incremental')
+
+        job = DatasetExportJob.objects.filter(app_uuid=self.app.uuid, export_format='dwca').order_by('-pk').first()
+
+        self.assertTrue('previous_export' in job.filters)
+        self.assertEqual(job.status, JOB_STATUS_FINISHED)
+        # only the new dataset has been read from the database
+        self.assertEqual(job.total_rows, 1)
+        self.assertEqual(self.read_occurrence_ids(job), set([str(dataset.uuid), str(dataset_3.uuid)]))
+
+
+    @test_settings
+    def test_incremental_changed_during_export(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        self.call_command()
+
+        # a change of a transaction which is still running while the archive is written
+        with mock.patch('localcosmos_server.datasets.models.get_change_watermark', return_value=1):
+            Dataset.objects.filter(pk=dataset.pk).update(is_valid=False)
+            dataset_2 = self.create_dataset(observation_form)
+            self.call_command('--incremental')
+
+        job = DatasetExportJob.objects.filter(app_uuid=self.app.uuid, export_format='dwca').order_by('-pk').first()
+        self.assertEqual(self.read_occurrence_ids(job), set([str(dataset.uuid), str(dataset_2.uuid)]))
+
+        # the next archive reads the changes again
+        self.call_command('--incremental')
+
+        job = DatasetExportJob.objects.filter(app_uuid=self.app.uuid, export_format='dwca').order_by('-pk').first()
+        self.assertEqual(job.total_rows, 2)
+        self.assertEqual(self.read_occurrence_ids(job), set([str(dataset.uuid), str(dataset_2.uuid)]))
+
+
+
+class TestRefreshDarwinCoreViews(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'refresh_darwin_core_views'
+
+    def count_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM {0}'.format(get_darwin_core_view_name(self.app)))
+            return cursor.fetchone()[0]
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        self.create_dataset(observation_form)
+
+        with connection.cursor() as cursor:
+            cursor.execute(get_darwin_core_materialized_view_create_sql(self.app))
+
+        DarwinCoreViewRefresh.objects.create(app_uuid=self.app.uuid, change_xid=0, change_sequence=0)
+
+        self.assertEqual(self.count_rows(), 1)
+
+        self.create_dataset(observation_form)
+
+        # the materialized view is only updated by a refresh
+        self.assertEqual(self.count_rows(), 1)
+        self.assertEqual(DarwinCoreViewRefresh.objects.get_pending_changes(self.app), 2)
+
+        out = self.call_command('--min-changes', '3')
+        self.assertIn('not refreshed', out)
+        self.assertEqual(self.count_rows(), 1)
+
+        self.call_command()
+        self.assertEqual(self.count_rows(), 2)
+
+        refresh = DarwinCoreViewRefresh.objects.get(app_uuid=self.app.uuid)
+        self.assertIsNotNone(refresh.refreshed_at)
+        self.assertEqual(DarwinCoreViewRefresh.objects.get_pending_changes(self.app), 0)
+
+
+
+class TestReconcileUserDatasetCounters(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'reconcile_user_dataset_counters'
+
+    @test_settings
+    def test_command(self):
+
+        user = self.create_user()
+        observation_form = self.create_observation_form()
+
+        self.create_dataset(observation_form, user=user)
+        self.create_dataset(observation_form, user=user)
+
+        UserDatasetCounter.objects.filter(user=user).update(dataset_count=5)
+
+        out = self.call_command('--dry-run')
+        self.assertIn('Found 1 wrong counters', out)
+        self.assertEqual(user.dataset_count(), 5)
+
+        self.call_command()
+        self.assertEqual(user.dataset_count(), 2)
+
+        UserDatasetCounter.objects.filter(user=user).delete()
+
+        out = self.call_command()
+        self.assertIn('missing -> 2', out)
+        self.assertEqual(user.dataset_count(), 2)
+
+
+
+class TestPruneDatasetTombstones(CommandTestMixin, WithObservationForm, WithApp, WithUser, TestCase):
+
+    command_name = 'prune_dataset_tombstones'
+
+    @test_settings
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+
+        dataset = self.create_dataset(observation_form)
+        dataset_2 = self.create_dataset(observation_form)
+
+        dataset.delete()
+        dataset_2.delete()
+
+        DatasetTombstone.objects.filter(uuid=dataset.uuid).update(deleted_at=timezone.now() - timedelta(days=92))
+
+        out = self.call_command()
+        self.assertIn('Deleted 1 tombstones', out)
+        self.assertEqual(list(DatasetTombstone.objects.values_list('uuid', flat=True)), [dataset_2.uuid])
+
+
+
+class TestProcessDatasetImageRenditionJobs(CommandTestMixin, WithMedia, WithObservationForm, WithApp, WithUser,
+    TestCase):
+
+    command_name = 'process_dataset_image_rendition_jobs'
+
+    command_args = ['--once', '--processes', '1']
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS=True)
+    def test_command(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset_image = self.create_dataset_image(dataset)
+        dataset_image.schedule_renditions()
+
+        # uploaded before renditions were recorded
+        dataset_image_2 = self.create_dataset_image(dataset)
+
+        out = self.call_command('--missing')
+        self.assertIn('Enqueued 1 images', out)
+
+        self.assertFalse(DatasetImageRenditionJob.objects.exists())
+
+        for image in [dataset_image, dataset_image_2]:
+            image.refresh_from_db()
+            originals = [rendition for rendition in image.renditions if 'image_format' not in rendition]
+            self.assertEqual(len(originals), len(DATASET_IMAGE_RENDITIONS))
+
+            for size, square in DATASET_IMAGE_RENDITIONS:
+                self.assertTrue(os.path.isfile(image.get_resized_path(size, square=square)))
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_ASYNC_DATASET_IMAGE_RENDITIONS=True)
+    def test_requeue_stale_periodically(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset_image = self.create_dataset_image(dataset)
+        dataset_image.schedule_renditions()
+
+        job = DatasetImageRenditionJob.objects.get(dataset_image=dataset_image)
+
+        # the job has been claimed by another worker
+        DatasetImageRenditionJob.objects.filter(pk=job.pk).update(status=JOB_STATUS_RUNNING, attempts=1,
+            started_at=timezone.now())
+
+        class StopWorker(Exception):
+            pass
+
+        # the other worker crashes while this worker waits for jobs
+        def sleep(seconds):
+            if sleep_mock.call_count > 1:
+                raise StopWorker()
+            DatasetImageRenditionJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(days=1))
+
+        # without --once
+        with mock.patch('localcosmos_server.management.commands.process_dataset_image_rendition_jobs.time.sleep',
+                        side_effect=sleep) as sleep_mock:
+            with self.assertRaises(StopWorker):
+                call_command(self.command_name, '--processes', '1', '--requeue-interval', '0', stdout=StringIO(),
+                    stderr=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JOB_STATUS_QUEUED)
+        self.assertTrue(job.retry_at > timezone.now())
+
+
+
+class TestRepairImageRenditions(CommandTestMixin, WithServerContentImage, WithMedia, WithObservationForm, WithApp,
+    WithUser, TestCase):
+
+    command_name = 'repair_image_renditions'
+
+    @test_settings
+    def test_dataset_images(self):
+
+        observation_form = self.create_observation_form()
+        dataset = self.create_dataset(observation_form)
+
+        dataset_image = self.create_dataset_image(dataset)
+        dataset_image.create_renditions()
+
+        recorded_renditions = dataset_image.renditions
+
+        size, square = DATASET_IMAGE_RENDITIONS[0]
+        os.remove(dataset_image.get_resized_path(size, square=square))
+
+        out = self.call_command('--dry-run')
+        self.assertIn('Dataset images: repaired 1 manifests', out)
+
+        self.call_command()
+        dataset_image.refresh_from_db()
+        self.assertFalse(dataset_image.has_rendition(size, square=square))
+        self.assertEqual(len(dataset_image.renditions), len(recorded_renditions) - 1)
+
+        self.call_command('--create-missing')
+        dataset_image.refresh_from_db()
+        self.assertEqual(dataset_image.renditions, recorded_renditions)
+
+        out = self.call_command()
+        self.assertIn('Dataset images: repaired 0 manifests', out)
+
+
+    @test_settings
+    def test_image_stores(self):
+
+        user = self.create_user()
+        content_image = self.get_content_image(user, user)
+
+        content_image.image_url(size=200)
+        thumbname = content_image.get_thumb_filename(400)
+        content_image.image_url(size=400)
+
+        ServerImageStore.objects.filter(pk=content_image.image_store.pk).update(renditions=None)
+
+        out = self.call_command()
+        self.assertIn('Image stores: repaired 1 manifests', out)
+
+        image_store = ServerImageStore.objects.get(pk=content_image.image_store.pk)
+        originals = [rendition for rendition in image_store.renditions.values() if 'image_format' not in rendition]
+        self.assertEqual(len(originals), 2)
+        self.assertEqual(image_store.renditions[thumbname]['size'], 400)
+        self.assertEqual(image_store.renditions[thumbname]['crop_hash'], 'uncropped')
+
+        out = self.call_command()
+        self.assertIn('Image stores: repaired 0 manifests', out)
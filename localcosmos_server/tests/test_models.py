@@ -28,7 +28,7 @@ from .mixins import WithUser, WithApp
 
 from django.utils import timezone
 from datetime import timedelta
-import uuid, os, shutil
+import uuid, os, shutil, json
 
 
 class TestLocalcosmosUser(WithObservationForm, WithUser, WithApp, TestCase):
@@ -991,4 +991,139 @@ class TestServerExternalMedia(WithApp, TestCase):
         
         self.assertEqual(len(app_media), 2)
         self.assertIn(media1, app_media)
-        self.assertIn(media2, app_media)
\ No newline at end of file
+        self.assertIn(media2, app_media)
+
+from localcosmos_server.tests.mixins import WithServerContentImage, WithMedia
+from localcosmos_server.models import ServerImageStore
+from unittest import mock
+from django.test import override_settings
+
+class TestServerContentImage(WithServerContentImage, WithMedia, WithUser, TestCase):
+
+    @test_settings
+    def test_image_url(self):
+
+        user = self.create_user()
+        content_image = self.get_content_image(user, user)
+
+        image_url = content_image.image_url(size=200)
+
+        thumbname = content_image.get_thumb_filename(200)
+        self.assertTrue(image_url.endswith(thumbname))
+
+        # the thumbnail is recorded in the manifest of the image store
+        image_store = ServerImageStore.objects.get(pk=content_image.image_store.pk)
+        rendition = image_store.renditions[thumbname]
+
+        self.assertEqual(rendition['size'], 200)
+        self.assertEqual(rendition['crop_hash'], 'uncropped')
+        self.assertEqual(rendition['feature_hash'], 'nofeatures')
+        self.assertEqual(rendition['format'], 'JPEG')
+        self.assertTrue(rendition['bytes'] > 0)
+        self.assertEqual(max(rendition['width'], rendition['height']), 200)
+
+        # recorded thumbnails are served without touching the disk
+        content_image.image_store = image_store
+        with mock.patch('localcosmos_server.models.os.path.isfile') as isfile:
+            self.assertEqual(content_image.image_url(size=200), image_url)
+            isfile.assert_not_called()
+
+        content_image.image_url(size=400)
+        image_store.refresh_from_db()
+        originals = [rendition for rendition in image_store.renditions.values() if 'image_format' not in rendition]
+        self.assertEqual(len(originals), 2)
+
+
+    @test_settings
+    @override_settings(LOCALCOSMOS_SERVER_MODERN_IMAGE_FORMATS=['webp'])
+    def test_image_url_image_format(self):
+
+        user = self.create_user()
+        content_image = self.get_content_image(user, user)
+
+        image_url = content_image.image_url(size=200)
+        webp_url = content_image.image_url(size=200, image_format='webp')
+
+        thumbname = content_image.get_thumb_filename(200, image_format='webp')
+        self.assertTrue(thumbname.endswith('.webp'))
+        self.assertTrue(webp_url.endswith(thumbname))
+        self.assertNotEqual(webp_url, image_url)
+
+        image_store = ServerImageStore.objects.get(pk=content_image.image_store.pk)
+        rendition = image_store.renditions[thumbname]
+
+        self.assertEqual(rendition['image_format'], 'webp')
+        self.assertEqual(rendition['format'], 'WEBP')
+        self.assertEqual(rendition['size'], 200)
+
+        image_format_urls = content_image.image_format_urls(image_sizes=['regular'])
+        self.assertEqual(image_format_urls, {'webp': content_image.image_urls(image_sizes=['regular'],
+            image_format='webp')})
+
+        # formats which are not configured fall back to the original
+        self.assertEqual(content_image.image_url(size=200, image_format='avif'), image_url)
+
+
+    @test_settings
+    def test_get_lean_processed_image(self):
+
+        from PIL import Image
+
+        user = self.create_user()
+        content_image = self.get_content_image(user, user)
+
+        image_path = content_image.image_store.source_image.path
+
+        original_image = Image.open(image_path)
+        width, height = original_image.size
+
+        crop_parameters = [
+            None,
+            # inside the original
+            {'x': int(width / 4), 'y': int(height / 4), 'width': int(width / 2), 'height': int(height / 3)},
+            # extends past the edges of the original
+            {'x': -int(width / 4), 'y': -int(height / 4), 'width': width, 'height': width},
+        ]
+
+        for parameters in crop_parameters:
+
+            content_image.crop_parameters = json.dumps(parameters) if parameters else None
+
+            for size in [100, 400]:
+
+                expected_image = content_image.get_in_memory_processed_image(Image.open(image_path), size)
+                lean_image, image_format = content_image.get_lean_processed_image(image_path, size)
+
+                self.assertEqual(image_format, original_image.format)
+                self.assertEqual(lean_image.mode, expected_image.mode)
+                self.assertTrue(abs(lean_image.size[0] - expected_image.size[0]) <= 1)
+                self.assertTrue(abs(lean_image.size[1] - expected_image.size[1]) <= 1)
+
+
+    @test_settings
+    def test_get_image_urls(self):
+
+        from PIL import Image
+
+        user = self.create_user()
+        content_image = self.get_content_image(user, user,
+            crop_parameters=json.dumps({'x': 10, 'y': 10, 'width': 100, 'height': 100}))
+
+        # one decode for all sizes
+        with mock.patch.object(Image, 'open', wraps=Image.open) as image_open:
+            srcset = content_image.srcset()
+            self.assertEqual(image_open.call_count, 1)
+
+        self.assertEqual(srcset['1x'], content_image.image_url(200))
+        self.assertEqual(srcset['2x'], content_image.image_url(400))
+
+        with mock.patch.object(Image, 'open', wraps=Image.open) as image_open:
+            image_urls = content_image.image_urls()
+            self.assertEqual(image_open.call_count, 1)
+
+        self.assertEqual(set(image_urls.keys()), set(['1x', '2x', '4x']))
+
+        # all thumbnails exist and are recorded
+        with mock.patch.object(Image, 'open', wraps=Image.open) as image_open:
+            self.assertEqual(content_image.image_urls(), image_urls)
+            image_open.assert_not_called()
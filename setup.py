@@ -44,4 +44,7 @@ setup(
     python_requires='>=3.6',
     include_package_data=True,
     install_requires=install_requires,
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
 )